@@ -1,88 +1,109 @@
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.interval import IntervalTrigger
+from flask import Blueprint, Flask, current_app, render_template, request, jsonify, flash, redirect, url_for, stream_with_context
 from datetime import datetime, timedelta
-import atexit
 import logging
+import os
+import uuid
+import time
+from sqlalchemy.exc import IntegrityError
 from config import Config
 
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 
-# 创建Flask应用
-app = Flask(__name__)
-app.config.from_object(Config)
-
-# 先导入db，然后初始化
-from models import db
-db.init_app(app)
+# 导入模型
+from models import ApiKey, ApiGroup, UsageRecord, LatestUsage, DataVersion, AlertRule, AlertState, db
 
-# 初始化调度器
-scheduler = BackgroundScheduler(timezone=app.config['SCHEDULER_TIMEZONE'])
-scheduler.start()
+# 导入服务（各服务在首次使用时才创建）
+from services.app_services import AppServices
+from services.history_service import BUCKETS, EXPORT_COLUMNS, EXPORT_FORMATS, format_export
+from services.adaptive_polling import POLLING_MODES
+from services.alert_service import RULE_TYPES as ALERT_RULE_TYPES
+from services.alert_sinks import ALERT_SINKS
+from services.key_import import parse_csv
+from services.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from services.usage_summary import query_summary, summary_expires_at
+from migrations import upgrade_database, explain_queries
 
-# 确保应用关闭时停止调度器
-atexit.register(lambda: scheduler.shutdown())
+# 页面、API接口和命令行命令
+main = Blueprint('main', __name__, cli_group=None)
 
-# 导入模型
-from models import ApiKey, ApiGroup, UsageRecord, db
-
-# 导入服务
-from services.deepl_service import DeepLService
-from services.scheduler_service import SchedulerService
-
-# 初始化服务
-deepl_service = DeepLService()
-scheduler_service = SchedulerService(scheduler, deepl_service, db)
-
-# 创建数据库表
-with app.app_context():
-    db.create_all()
-    # 如果没有默认组，创建一个
-    if not ApiGroup.query.first():
-        default_group = ApiGroup(
-            name='默认组',
-            query_interval=app.config['DEFAULT_QUERY_INTERVAL'],
-            is_active=True
-        )
-        db.session.add(default_group)
-        db.session.commit()
+def create_app(config_object=Config, start_runtime=False):
+    """
+    创建Flask应用
     
-    # 初始化所有组的调度器
-    groups = ApiGroup.query.filter_by(is_active=True).all()
-    for group in groups:
-        scheduler_service.setup_group_scheduler(group)
+    创建过程不连接数据库、不启动调度器。数据库升级、默认组和调度器等
+    运行时初始化在第一个请求到来时执行，或传入 start_runtime=True 立即执行
+    （wsgi.py 即如此，gunicorn wsgi:app）。
+    """
+    started = time.perf_counter()
+    
+    app = Flask(__name__)
+    app.config.from_object(config_object)
+    db.init_app(app)
+    
+    app.extensions['monitor'] = AppServices(app)
+    app.register_blueprint(main)
+    app.extensions['monitor'].startup_timings['create_app'] = round((time.perf_counter() - started) * 1000, 2)
+    
+    if start_runtime:
+        app.extensions['monitor'].start_runtime()
+    return app
+
+def services():
+    """当前应用的服务容器"""
+    return current_app.extensions['monitor']
+
+@main.before_app_request
+def ensure_runtime():
+    """第一个请求到来时执行运行时初始化"""
+    monitor = services()
+    if not monitor.runtime_started:
+        monitor.start_runtime()
 
-@app.route('/')
+@main.route('/')
 def index():
     """主页 - 显示所有组和API密钥"""
     groups = ApiGroup.query.all()
     return render_template('index.html', groups=groups)
 
-@app.route('/api/groups', methods=['GET', 'POST'])
+@main.route('/api/groups', methods=['GET', 'POST'])
 def manage_groups():
     """API组管理"""
     if request.method == 'POST':
         data = request.get_json()
         
+        polling_mode = data.get('polling_mode', 'fixed')
+        if polling_mode not in POLLING_MODES:
+            return jsonify({'status': 'error', 'message': '不支持的查询模式'}), 400
+        
         group = ApiGroup(
             name=data['name'],
-            query_interval=data.get('query_interval', app.config['DEFAULT_QUERY_INTERVAL']),
+            query_interval=data.get('query_interval', current_app.config['DEFAULT_QUERY_INTERVAL']),
+            polling_mode=polling_mode,
             is_active=data.get('is_active', True)
         )
         
         db.session.add(group)
+        DataVersion.bump('config')
         db.session.commit()
+        services().response_cache.invalidate()
         
         # 重新配置调度器
-        scheduler_service.setup_group_scheduler(group)
+        services().scheduler_service.setup_group_scheduler(group)
         
         return jsonify({'status': 'success', 'group_id': group.id})
     
+    return services().response_cache.response('groups', ('config',), _build_groups)
+
+def _build_groups():
+    """所有组及其密钥数量"""
     groups = ApiGroup.query.all()
-    return jsonify([group.to_dict() for group in groups])
+    key_counts = dict(
+        db.session.query(ApiKey.group_id, db.func.count(ApiKey.id)).group_by(ApiKey.group_id).all()
+    )
+    return [group.to_dict(api_keys_count=key_counts.get(group.id, 0)) for group in groups]
 
-@app.route('/api/groups/<int:group_id>', methods=['PUT', 'DELETE'])
+@main.route('/api/groups/<int:group_id>', methods=['PUT', 'DELETE'])
 def update_group(group_id):
     """更新或删除API组"""
     group = ApiGroup.query.get_or_404(group_id)
@@ -90,29 +111,39 @@ def update_group(group_id):
     if request.method == 'PUT':
         data = request.get_json()
         
+        polling_mode = data.get('polling_mode', group.polling_mode or 'fixed')
+        if polling_mode not in POLLING_MODES:
+            return jsonify({'status': 'error', 'message': '不支持的查询模式'}), 400
+        
         group.name = data.get('name', group.name)
         old_interval = group.query_interval
+        old_polling_mode = group.polling_mode
         group.query_interval = data.get('query_interval', group.query_interval)
+        group.polling_mode = polling_mode
         group.is_active = data.get('is_active', group.is_active)
         
+        DataVersion.bump('config')
         db.session.commit()
+        services().response_cache.invalidate()
         
-        # 如果查询间隔改变，重新配置调度器
-        if old_interval != group.query_interval:
-            scheduler_service.update_group_scheduler(group)
+        # 如果查询间隔或查询模式改变，重新配置调度器
+        if old_interval != group.query_interval or old_polling_mode != group.polling_mode:
+            services().scheduler_service.update_group_scheduler(group)
         
         return jsonify({'status': 'success'})
     
     elif request.method == 'DELETE':
-        # 删除组及其所有API密钥
-        ApiKey.query.filter_by(group_id=group_id).delete()
-        scheduler_service.remove_group_scheduler(group)
+        # 删除组及其所有API密钥（同一事务中删除密钥的用量、预测和告警数据）
+        ApiKey.delete_many(db.select(ApiKey.id).where(ApiKey.group_id == group_id))
+        services().scheduler_service.remove_group_scheduler(group)
         db.session.delete(group)
+        DataVersion.bump('config')
         db.session.commit()
+        services().response_cache.invalidate()
         
         return jsonify({'status': 'success'})
 
-@app.route('/api/keys', methods=['POST'])
+@main.route('/api/keys', methods=['POST'])
 def add_api_key():
     """添加API密钥"""
     data = request.get_json()
@@ -138,11 +169,68 @@ def add_api_key():
     )
     
     db.session.add(key)
+    DataVersion.bump('config')
     db.session.commit()
+    services().response_cache.invalidate()
     
     return jsonify({'status': 'success', 'key_id': key.id})
 
-@app.route('/api/keys/<int:key_id>', methods=['PUT', 'DELETE'])
+@main.route('/api/keys/bulk', methods=['POST'])
+def bulk_import_api_keys():
+    """
+    批量导入API密钥
+    
+    请求体可以是:
+    - JSON: {"group_id": 1, "first_poll": true, "keys": ["密钥", {"api_key": "...", "name": "...", "group_id": 2}]}，
+      也可以直接是 keys 列表
+    - CSV（text/csv 请求体或 multipart 的 file 字段）: 表头为 api_key,name,group_id，
+      或每行一个密钥；group_id 和 first_poll 通过查询参数传入
+    """
+    options = request.args
+    if request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            options = data
+            rows = data.get('keys')
+        else:
+            rows = data
+    else:
+        upload = request.files.get('file')
+        if upload is not None:
+            options = request.form or request.args
+            text = upload.read().decode('utf-8-sig', errors='replace')
+        else:
+            text = request.get_data(as_text=True)
+        rows = parse_csv(text)
+    
+    if not isinstance(rows, list) or not rows:
+        return jsonify({'status': 'error', 'message': '没有要导入的API密钥'}), 400
+    if len(rows) > Config.BULK_IMPORT_MAX_ROWS:
+        return jsonify({'status': 'error', 'message': f'单次最多导入 {Config.BULK_IMPORT_MAX_ROWS} 个API密钥'}), 400
+    
+    try:
+        result = services().key_import_service.import_keys(rows, options.get('group_id'))
+    except IntegrityError:
+        return jsonify({'status': 'error', 'message': '导入期间有相同的API密钥被添加，请重试'}), 409
+    services().response_cache.invalidate()
+    
+    created_ids = result.pop('created_ids')
+    first_poll = str(options.get('first_poll', '')).lower() in ('1', 'true', 'yes')
+    result['first_poll'] = 0
+    result['first_poll_job_id'] = None
+    if first_poll and created_ids:
+        # 首次查询作为检查任务在后台线程池中执行，进度通过任务ID查询
+        try:
+            job, _ = services().check_jobs.submit(f'import:{uuid.uuid4().hex}', created_ids)
+        except Exception as e:
+            current_app.logger.error(f"提交导入密钥的首次查询失败: {e}")
+        else:
+            result['first_poll'] = len(created_ids)
+            result['first_poll_job_id'] = job['job_id']
+    
+    return jsonify(dict(result, status='success'))
+
+@main.route('/api/keys/<int:key_id>', methods=['PUT', 'DELETE'])
 def update_api_key(key_id):
     """更新或删除API密钥"""
     key = ApiKey.query.get_or_404(key_id)
@@ -153,119 +241,321 @@ def update_api_key(key_id):
         key.name = data.get('name', key.name)
         key.is_active = data.get('is_active', key.is_active)
         
+        # 手动解除隔离，下一次定时查询时恢复检查
+        if data.get('status') == 'active' and key.status == 'quarantined':
+            key.status = 'active'
+            key.auth_failures = 0
+            key.quarantined_at = None
+            key.next_probe_at = None
+        
+        DataVersion.bump('config')
         db.session.commit()
+        services().response_cache.invalidate()
         return jsonify({'status': 'success'})
     
     elif request.method == 'DELETE':
         db.session.delete(key)
+        DataVersion.bump('config')
         db.session.commit()
+        services().response_cache.invalidate()
         return jsonify({'status': 'success'})
 
-@app.route('/api/keys/<int:key_id>/details')
+@main.route('/api/keys/<int:key_id>/details')
 def get_api_key_details(key_id):
     """获取API密钥详细信息"""
     key = ApiKey.query.get_or_404(key_id)
     return jsonify(key.to_dict(show_full_key=True))
 
-@app.route('/api/usage/<int:key_id>')
+@main.route('/api/usage/<int:key_id>')
 def get_usage_history(key_id):
     """获取API密钥的用量历史"""
     key = ApiKey.query.get_or_404(key_id)
     
     # 获取时间范围参数
-    period = request.args.get('period', 'hour')  # hour, day
+    period = request.args.get('period', 'hour')  # hour, day（兼容旧参数）
+    bucket = request.args.get('bucket')  # minute, hour, day, week, month
     hours = request.args.get('hours', 24, type=int)
     start_time = datetime.utcnow() - timedelta(hours=hours)
     
-    records = UsageRecord.query.filter(
-        UsageRecord.api_key_id == key_id,
-        UsageRecord.check_time >= start_time
-    ).order_by(UsageRecord.check_time.desc()).all()
-    
-    # 如果是按天查看，需要聚合数据
-    if period == 'day':
-        # 按天聚合数据
-        daily_data = {}
-        for record in records:
-            day = record.check_time.date().isoformat()
-            if day not in daily_data:
-                daily_data[day] = {
-                    'date': day,
-                    'max_usage': record.character_count,
-                    'records': 1
-                }
-            else:
-                daily_data[day]['max_usage'] = max(daily_data[day]['max_usage'], record.character_count)
-                daily_data[day]['records'] += 1
+    # 兼容旧接口：period=day 等同于按天聚合，但与旧版一样按日期倒序返回
+    legacy_days = not bucket and period == 'day'
+    if legacy_days:
+        bucket = 'day'
+    
+    # 按时间桶聚合，由数据库完成（按时间升序）
+    if bucket:
+        if bucket not in BUCKETS:
+            return jsonify({'status': 'error', 'message': f'bucket 参数必须是 {", ".join(BUCKETS)} 之一'}), 400
+        buckets = services().history_service.get_buckets(key.id, bucket, start_time)
+        if legacy_days:
+            buckets.reverse()
+        return jsonify(buckets)
+    
+    # 键集分页：?limit=200&cursor=<上一页的 next_cursor>
+    if 'limit' in request.args or 'cursor' in request.args:
+        limit = request.args.get('limit', Config.HISTORY_PAGE_SIZE, type=int)
+        if limit < 1:
+            return jsonify({'status': 'error', 'message': 'limit 参数必须大于0'}), 400
         
-        return jsonify(list(daily_data.values()))
+        try:
+            page = services().history_service.get_records_page(
+                key.id, start_time, min(limit, Config.HISTORY_PAGE_MAX), request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        return jsonify(page)
     
-    return jsonify([record.to_dict() for record in records])
+    return jsonify(services().history_service.get_records(key.id, start_time))
 
-@app.route('/api/usage/summary')
+@main.route('/api/usage/export')
+def export_usage():
+    """
+    流式导出用量数据
+    
+    参数: format=ndjson|csv, source=raw|hourly|daily, key_id 或 group_id（都不传则导出全部密钥）,
+    hours（不传则导出全部时间范围）
+    """
+    fmt = request.args.get('format', 'ndjson')
+    source = request.args.get('source', 'raw')
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'status': 'error', 'message': f'format 参数必须是 {", ".join(EXPORT_FORMATS)} 之一'}), 400
+    if source not in EXPORT_COLUMNS:
+        return jsonify({'status': 'error', 'message': f'source 参数必须是 {", ".join(EXPORT_COLUMNS)} 之一'}), 400
+    
+    key_id = request.args.get('key_id', type=int)
+    group_id = request.args.get('group_id', type=int)
+    if key_id is not None:
+        key_ids = [ApiKey.query.get_or_404(key_id).id]
+        scope = f'key-{key_id}'
+    elif group_id is not None:
+        ApiGroup.query.get_or_404(group_id)
+        key_ids = db.select(ApiKey.id).where(ApiKey.group_id == group_id).scalar_subquery()
+        scope = f'group-{group_id}'
+    else:
+        key_ids = None
+        scope = 'all'
+    
+    hours = request.args.get('hours', type=int)
+    start_time = datetime.utcnow() - timedelta(hours=hours) if hours else None
+    
+    rows = services().history_service.iter_export_rows(source, start_time, key_ids=key_ids)
+    body = format_export(rows, EXPORT_COLUMNS[source], fmt, chunk_rows=Config.EXPORT_BATCH_SIZE)
+    
+    response = current_app.response_class(
+        stream_with_context(body),
+        mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename=usage-{scope}-{source}.{fmt}'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@main.route('/api/usage/summary')
 def get_usage_summary():
-    """获取所有API密钥的用量摘要"""
-    keys = ApiKey.query.filter_by(is_active=True).all()
-    summary = []
-    
-    for key in keys:
-        latest_record = UsageRecord.query.filter_by(
-            api_key_id=key.id
-        ).order_by(UsageRecord.check_time.desc()).first()
+    """获取所有API密钥的用量摘要（按数据版本号和最近的计费周期结束时间缓存，支持 If-None-Match）"""
+    return services().response_cache.response('usage-summary', ('usage', 'config'), _build_summary, summary_expires_at)
+
+def _build_summary():
+    """从最新用量表单次查询所有启用密钥的用量摘要"""
+    return query_summary(db)
+
+@main.route('/api/usage/stream')
+def usage_stream():
+    """用量推送（Server-Sent Events）：用量写入后推送变化的密钥摘要，配置变化时推送 reload"""
+    broker = services().usage_stream
+    client = broker.subscribe()
+    
+    response = current_app.response_class(broker.stream(client), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # 禁止反向代理缓冲
+    return response
+
+@main.route('/api/forecast')
+def get_forecast():
+    """按预计用尽时间排序的密钥（读取预测表，不扫描历史）"""
+    limit = request.args.get('limit', type=int)
+    group_id = request.args.get('group_id', type=int)
+    at_risk = request.args.get('at_risk', '').lower() in ('1', 'true', 'yes')
+    return jsonify(services().forecast_service.get_ranking(limit, group_id, at_risk))
+
+@main.route('/api/alerts')
+def get_alerts():
+    """正在触发的告警"""
+    return jsonify(services().alert_service.get_active_alerts())
+
+@main.route('/api/alerts/rules', methods=['GET', 'POST'])
+def manage_alert_rules():
+    """告警规则管理"""
+    if request.method == 'POST':
+        rule = AlertRule(is_active=True)
+        error = _apply_alert_rule(rule, request.get_json() or {})
+        if error:
+            return jsonify({'status': 'error', 'message': error}), 400
         
-        if latest_record:
-            # 对于Pro API，使用api_key_character_count/limit字段
-            if key.api_type == 'pro' and latest_record.api_key_character_count is not None:
-                character_count = latest_record.api_key_character_count
-                character_limit = latest_record.api_key_character_limit or 0
-            else:
-                character_count = latest_record.character_count
-                character_limit = latest_record.character_limit
-            
-            # 判断是否过期（仅Pro API有计费周期）
-            is_expired = False
-            if key.api_type == 'pro' and key.billing_end_time:
-                is_expired = datetime.utcnow() > key.billing_end_time
-            
-            summary.append({
-                'key_id': key.id,
-                'key_name': key.name,
-                'api_key': key.api_key,  # 添加完整密钥
-                'api_type': key.api_type,
-                'character_count': character_count,
-                'character_limit': character_limit,
-                'usage_percentage': (character_count / character_limit * 100) if character_limit > 0 else 0,
-                'last_check': latest_record.check_time.isoformat(),
-                'group_id': key.group_id,
-                'is_expired': is_expired,
-                'billing_end_time': key.billing_end_time.isoformat() if key.billing_end_time else None
-            })
-        else:
-            # 即使没有使用记录，也显示API密钥
-            summary.append({
-                'key_id': key.id,
-                'key_name': key.name,
-                'api_key': key.api_key,  # 添加完整密钥
-                'api_type': key.api_type,
-                'character_count': 0,
-                'character_limit': 0,
-                'usage_percentage': 0,
-                'last_check': None,
-                'group_id': key.group_id
-            })
-    
-    return jsonify(summary)
-
-@app.route('/api/check-now/<int:group_id>')
+        db.session.add(rule)
+        db.session.commit()
+        return jsonify({'status': 'success', 'rule_id': rule.id})
+    
+    return jsonify([rule.to_dict() for rule in AlertRule.query.order_by(AlertRule.id).all()])
+
+@main.route('/api/alerts/rules/<int:rule_id>', methods=['PUT', 'DELETE'])
+def update_alert_rule(rule_id):
+    """更新或删除告警规则（修改规则类型、阈值或作用范围时清除已有的告警状态）"""
+    rule = AlertRule.query.get_or_404(rule_id)
+    
+    if request.method == 'PUT':
+        scope = (rule.rule_type, rule.threshold, rule.group_id, rule.api_key_id)
+        error = _apply_alert_rule(rule, request.get_json() or {})
+        if error:
+            db.session.rollback()
+            return jsonify({'status': 'error', 'message': error}), 400
+        
+        if scope != (rule.rule_type, rule.threshold, rule.group_id, rule.api_key_id) or not rule.is_active:
+            AlertState.query.filter_by(rule_id=rule.id).delete()
+        db.session.commit()
+        return jsonify({'status': 'success'})
+    
+    db.session.delete(rule)
+    db.session.commit()
+    return jsonify({'status': 'success'})
+
+def _apply_alert_rule(rule, data):
+    """校验并设置告警规则字段，返回错误信息"""
+    rule_type = data.get('rule_type', rule.rule_type)
+    if rule_type not in ALERT_RULE_TYPES:
+        return '不支持的规则类型'
+    
+    try:
+        threshold = float(data.get('threshold', rule.threshold))
+    except (TypeError, ValueError):
+        return '阈值必须是数字'
+    
+    sink = data.get('sink', rule.sink or 'log')
+    if sink not in ALERT_SINKS:
+        return '不支持的通知方式'
+    webhook_url = data.get('webhook_url', rule.webhook_url)
+    if sink == 'webhook' and not (webhook_url or '').startswith(('http://', 'https://')):
+        return 'webhook 通知需要配置 http(s) 地址'
+    
+    group_id = data.get('group_id', rule.group_id)
+    if group_id is not None and not db.session.get(ApiGroup, group_id):
+        return '组不存在'
+    api_key_id = data.get('api_key_id', rule.api_key_id)
+    if api_key_id is not None and not db.session.get(ApiKey, api_key_id):
+        return 'API密钥不存在'
+    
+    name = (data.get('name') or rule.name or '').strip()
+    if not name:
+        return '规则名称不能为空'
+    
+    rule.name = name[:100]
+    rule.rule_type = rule_type
+    rule.threshold = threshold
+    rule.sink = sink
+    rule.webhook_url = webhook_url
+    rule.group_id = group_id
+    rule.api_key_id = api_key_id
+    rule.is_active = bool(data.get('is_active', rule.is_active))
+    return None
+
+@main.route('/api/check-now/<int:group_id>', methods=['GET', 'POST'])
 def check_group_now(group_id):
-    """立即检查指定组的所有API密钥"""
+    """立即检查指定组的所有API密钥（后台执行，返回任务ID）"""
     group = ApiGroup.query.get_or_404(group_id)
-    
+    return _submit_check_job(f'group:{group.id}', f'组 {group.name}')
+
+@main.route('/api/check-now/key/<int:key_id>', methods=['GET', 'POST'])
+def check_key_now(key_id):
+    """立即检查单个API密钥（后台执行，返回任务ID）"""
+    key = ApiKey.query.get_or_404(key_id)
+    return _submit_check_job(f'key:{key.id}', f'API密钥 {key.name}')
+
+@main.route('/api/check-now/all', methods=['GET', 'POST'])
+def check_all_now():
+    """立即检查所有活跃组（后台执行，返回任务ID）"""
+    return _submit_check_job('all', '所有组')
+
+def _submit_check_job(target, label):
+    """提交检查任务；同一目标已有未完成的任务时合并到该任务"""
     try:
-        scheduler_service.check_group_usage(group.id)
-        return jsonify({'status': 'success', 'message': f'已开始检查组 {group.name} 的用量'})
+        job, coalesced = services().check_jobs.submit(target)
     except Exception as e:
         return jsonify({'status': 'error', 'message': str(e)}), 500
+    
+    message = f'{label} 的检查正在进行中' if coalesced else f'已开始检查{label}的用量'
+    return jsonify({
+        'status': 'success',
+        'message': message,
+        'job_id': job['job_id'],
+        'coalesced': coalesced,
+        'job': job
+    }), 202
+
+@main.route('/api/check-jobs')
+def list_check_jobs():
+    """最近的检查任务"""
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    return jsonify(services().check_jobs.get_recent(limit))
+
+@main.route('/api/check-jobs/<job_id>')
+def get_check_job(job_id):
+    """检查任务的状态和进度"""
+    job = services().check_jobs.get(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': '任务不存在'}), 404
+    return jsonify(job)
+
+@main.route('/api/scheduler/status')
+def get_scheduler_status():
+    """获取调度器和查询执行器的状态（含各组排队中的查询数、启动耗时、响应缓存、用量推送和熔断器统计）"""
+    status = services().scheduler_service.get_scheduler_status()
+    status['circuit_breakers'] = (services().async_deepl_service or services().deepl_service).get_breaker_stats()
+    status['quarantined_keys'] = ApiKey.query.filter_by(status='quarantined').count()
+    status['startup'] = services().startup_timings
+    status['response_cache'] = services().response_cache.get_stats()
+    status['usage_stream'] = services().usage_stream.get_stats()
+    return jsonify(status)
+
+@main.route('/metrics')
+def metrics():
+    """Prometheus 格式的本进程指标（DeepL请求耗时、组检查耗时、调度延迟、写入耗时和错误计数）"""
+    return current_app.response_class(REGISTRY.render(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+@main.cli.command('upgrade-db')
+def upgrade_db_command():
+    """升级数据库结构（补齐新增的表、列和索引）"""
+    upgrade_database(db)
+    print('数据库结构已是最新')
+
+@main.cli.command('compact-usage')
+def compact_usage_command():
+    """立即执行一次用量汇总与数据清理"""
+    result = services().rollup_service.compact()
+    print(result)
+
+@main.cli.command('refresh-forecasts')
+def refresh_forecasts_command():
+    """重新计算所有启用密钥的用量预测"""
+    count = services().forecast_service.refresh()
+    print(f'已刷新 {count} 个API密钥的用量预测')
+
+@main.cli.command('explain-queries')
+def explain_queries_command():
+    """显示关键查询的执行计划，用于确认索引生效"""
+    for item in explain_queries(db):
+        print(f"== {item['name']}")
+        print(item['sql'])
+        for line in item['plan']:
+            print(f'  {line}')
+        print()
+
+# flask 命令使用的应用实例（创建时没有I/O，运行时在第一个请求到来时初始化）；
+# 生产环境使用 wsgi:app，启动时即开始定时查询
+app = create_app()
+if __name__ != '__main__':
+    app.extensions['monitor'].warn_if_runtime_idle(Config.RUNTIME_START_WARNING_SECONDS)
 
 if __name__ == '__main__':
+    # 调试模式的重载器会启动子进程，只在实际处理请求的子进程中初始化运行时
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        app.extensions['monitor'].start_runtime()
     app.run(debug=True, host='0.0.0.0', port=5323)
@@ -9,6 +9,25 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///api_monitor.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # 连接池配置（SQLite文件数据库和PostgreSQL通用；SQLite内存数据库不使用连接池参数）
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 10))        # 常驻连接数
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 20))  # 高峰时额外允许的连接数
+    DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 30))  # 等待空闲连接的最长时间（秒）
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))  # 连接最长使用时间（秒），避免被服务端断开
+    SQLALCHEMY_ENGINE_OPTIONS = {} if SQLALCHEMY_DATABASE_URI in ('sqlite://', 'sqlite:///:memory:') else {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True
+    }
+    
+    # SQLite连接参数（每个连接建立时设置）：WAL模式下读写互不阻塞
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')       # WAL / DELETE / TRUNCATE / PERSIST / MEMORY / OFF
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')      # OFF / NORMAL / FULL / EXTRA，WAL模式下NORMAL即可保证一致性
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE', -64000))     # 页缓存，负数表示KB（约64MB）
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000))   # 数据库被锁定时的等待时间（毫秒）
+    
     # DeepL API配置
     DEEPL_FREE_BASE_URL = 'https://api-free.deepl.com/v2'
     DEEPL_PRO_BASE_URL = 'https://api.deepl.com/v2'
@@ -16,12 +35,117 @@ class Config:
     # 调度器配置
     SCHEDULER_API_ENABLED = True
     SCHEDULER_TIMEZONE = 'Asia/Shanghai'
+    SCHEDULER_STAGGER_ENABLED = os.environ.get('SCHEDULER_STAGGER_ENABLED', 'true').lower() == 'true'  # 各组首次运行时间在间隔内错开
+    SCHEDULER_JITTER = int(os.environ.get('SCHEDULER_JITTER', 30))  # 每次运行的随机延迟上限（秒）
+    SCHEDULER_JOBSTORE = os.environ.get('SCHEDULER_JOBSTORE', 'memory')  # memory（重启后重建）/ database（保存在数据库中，仅持有租约的进程加载，需要启用租约）
+    SCHEDULER_JOBS_TABLE = 'apscheduler_jobs'
+    AUTO_UPGRADE_DB = os.environ.get('AUTO_UPGRADE_DB', 'true').lower() == 'true'  # 运行时初始化时是否自动升级数据库结构
+    RUNTIME_START_WARNING_SECONDS = 60  # 以 app:app 运行时，超过该时间仍未初始化运行时（没有请求）则输出警告
+    
+    # 调度器租约（多进程部署时只有一个进程运行定时任务）
+    LEADER_ELECTION_ENABLED = os.environ.get('LEADER_ELECTION_ENABLED', 'true').lower() == 'true'
+    LEADER_LEASE_TTL = int(os.environ.get('LEADER_LEASE_TTL', 30))            # 租约有效期（秒）
+    LEADER_RENEW_INTERVAL = int(os.environ.get('LEADER_RENEW_INTERVAL', 10))  # 续约间隔（秒），应明显小于有效期
+    
+    # 独立查询进程（poller.py）
+    EMBEDDED_SCHEDULER_ENABLED = os.environ.get('EMBEDDED_SCHEDULER_ENABLED', 'true').lower() == 'true'  # Web进程是否运行定时查询（有存活的独立查询进程时自动暂停）
+    POLLER_NODE_ID = os.environ.get('POLLER_NODE_ID')  # 查询进程标识前缀，默认为主机名
+    POLLER_PROCESSES = int(os.environ.get('POLLER_PROCESSES', 1))                  # poller.py 启动的进程数
+    POLLER_HEARTBEAT_INTERVAL = int(os.environ.get('POLLER_HEARTBEAT_INTERVAL', 10))  # 心跳间隔（秒）
+    POLLER_NODE_TTL = int(os.environ.get('POLLER_NODE_TTL', 30))                   # 超过该时间没有心跳的进程视为离开（秒）
+    POLLER_VIRTUAL_NODES = 64  # 一致性哈希环上每个进程的虚拟节点数
+    POLLER_METRICS_PORT = int(os.environ.get('POLLER_METRICS_PORT', 0))  # 查询进程导出 /metrics 的起始端口，0为不导出
     
     # 默认查询频率（秒）
     DEFAULT_QUERY_INTERVAL = 3600  # 1小时
     
     # 并发控制
-    MAX_CONCURRENT_GROUPS = 10
+    MAX_CONCURRENT_GROUPS = int(os.environ.get('MAX_CONCURRENT_GROUPS', 10))  # 查询工作线程数（所有组共享）
+    SCHEDULER_THREADS = int(os.environ.get('SCHEDULER_THREADS', 50))  # 定时任务线程数（组任务只负责分发查询和写入结果）
     REQUEST_TIMEOUT = 30
+    
+    # 异步轮询配置
+    ASYNC_POLLING_ENABLED = os.environ.get('ASYNC_POLLING_ENABLED', 'true').lower() == 'true'
+    ASYNC_MAX_CONCURRENCY = int(os.environ.get('ASYNC_MAX_CONCURRENCY', 20))  # 每个进程同时进行的异步请求数（所有查询任务共用）
+    
+    # DeepL限速（令牌桶，每个基础URL独立）
+    DEEPL_FREE_RATE_LIMIT = float(os.environ.get('DEEPL_FREE_RATE_LIMIT', 5))  # 每秒请求数
+    DEEPL_PRO_RATE_LIMIT = float(os.environ.get('DEEPL_PRO_RATE_LIMIT', 10))   # 每秒请求数
+    DEEPL_RATE_LIMIT_BURST = int(os.environ.get('DEEPL_RATE_LIMIT_BURST', 10))  # 允许的突发请求数
+    
+    # DeepL请求重试与熔断（429、5xx、超时和网络错误重试；认证失败不重试）
+    DEEPL_MAX_RETRIES = int(os.environ.get('DEEPL_MAX_RETRIES', 2))  # 每次查询的最大重试次数
+    DEEPL_RETRY_BASE_DELAY = 1     # 指数退避的初始上限（秒），每次重试翻倍并随机抖动
+    DEEPL_RETRY_MAX_DELAY = 30     # 单次等待上限（秒），Retry-After 超过该值时不再重试
+    DEEPL_BREAKER_THRESHOLD = int(os.environ.get('DEEPL_BREAKER_THRESHOLD', 10))  # 连续失败多少次后熔断
+    DEEPL_BREAKER_RESET_TIMEOUT = int(os.environ.get('DEEPL_BREAKER_RESET_TIMEOUT', 60))  # 熔断后多久放行探测请求（秒）
+    
+    # 失效密钥隔离
+    KEY_QUARANTINE_THRESHOLD = int(os.environ.get('KEY_QUARANTINE_THRESHOLD', 3))  # 连续认证失败多少次后隔离
+    KEY_PROBE_INTERVAL = int(os.environ.get('KEY_PROBE_INTERVAL', 21600))          # 隔离期间的探测间隔（秒）
+    
+    # 自适应查询（组的 polling_mode 为 adaptive 时生效）
+    ADAPTIVE_MIN_INTERVAL = int(os.environ.get('ADAPTIVE_MIN_INTERVAL', 300))      # 最小查询间隔（秒），也是自适应组的调度周期
+    ADAPTIVE_MAX_INTERVAL = int(os.environ.get('ADAPTIVE_MAX_INTERVAL', 86400))    # 最大查询间隔（秒）
+    ADAPTIVE_LOOKBACK_HOURS = int(os.environ.get('ADAPTIVE_LOOKBACK_HOURS', 24))   # 计算消耗速度使用的时间窗口
+    ADAPTIVE_TARGET_CHANGE = 0.01  # 期望每次查询间用量变化的额度比例
+    ADAPTIVE_NEAR_LIMIT = 0.9      # 用量超过该比例时使用最小间隔
+    ADAPTIVE_BACKOFF_FACTOR = 2    # 没有消耗时间隔的增长倍数
+    ADAPTIVE_JITTER_RATIO = 0.1    # 下一次查询时间的随机抖动比例
+    
+    # 用量写入（查询结果入队后由写入线程批量写入）
+    INGEST_FLUSH_SIZE = int(os.environ.get('INGEST_FLUSH_SIZE', 500))          # 每批最多写入的结果数
+    INGEST_FLUSH_INTERVAL = float(os.environ.get('INGEST_FLUSH_INTERVAL', 1))  # 攒批的最长等待时间（秒）
+    INGEST_QUEUE_SIZE = int(os.environ.get('INGEST_QUEUE_SIZE', 10000))        # 队列上限，写满后查询线程阻塞等待
+    INGEST_MAX_RETRIES = 3      # 批量写入失败时的尝试次数
+    INGEST_WAIT_TIMEOUT = 60    # 立即检查等待写入完成的最长时间（秒）
+    
+    # 接口响应缓存（按数据版本号失效）
+    RESPONSE_CACHE_CHECK_INTERVAL = float(os.environ.get('RESPONSE_CACHE_CHECK_INTERVAL', 2))  # 读取版本号的最短间隔（秒），决定其他进程修改的可见延迟
+    
+    # 用量推送（/api/usage/stream）
+    USAGE_STREAM_CHECK_INTERVAL = float(os.environ.get('USAGE_STREAM_CHECK_INTERVAL', 1))  # 检查其他进程写入的间隔（秒）
+    USAGE_STREAM_KEEPALIVE = 15        # 空闲时发送保活注释的间隔（秒）
+    USAGE_STREAM_RETRY_MS = 5000       # 断开后浏览器重连的等待时间（毫秒）
+    USAGE_STREAM_CLIENT_QUEUE = 100    # 每个页面最多积压的消息数，超出后改为通知页面重新加载
+    
+    # 用量存储模式: full（每次查询写一条记录）/ change_only（仅在用量变化或查询失败时写入新记录）
+    USAGE_STORAGE_MODE = os.environ.get('USAGE_STORAGE_MODE', 'full')
+    
+    # 用量汇总与数据保留
+    USAGE_COMPACTION_INTERVAL = int(os.environ.get('USAGE_COMPACTION_INTERVAL', 3600))  # 汇总任务间隔（秒），0为禁用
+    USAGE_COMPACTION_GRACE = 300  # 小时结束后等待多久再汇总（秒）
+    USAGE_COMPACTION_LOOKBACK = int(os.environ.get('USAGE_COMPACTION_LOOKBACK', 21600))  # 每次从水位回溯重新汇总的时间（秒），覆盖晚写入的记录
+    RAW_RETENTION_DAYS = int(os.environ.get('RAW_RETENTION_DAYS', 30))        # 原始记录保留天数，0为永久保留
+    HOURLY_RETENTION_DAYS = int(os.environ.get('HOURLY_RETENTION_DAYS', 365))  # 小时汇总保留天数，0为永久保留（天汇总永久保留）
+    
+    # 立即检查任务（后台执行，同一目标的重复请求合并）
+    CHECK_JOB_WORKERS = int(os.environ.get('CHECK_JOB_WORKERS', 4))  # 同时执行的检查任务数
+    CHECK_JOB_FLUSH_INTERVAL = 1     # 进度写入数据库的最短间隔（秒）
+    CHECK_JOB_STALE_SECONDS = 300    # 未完成的任务超过该时间未更新视为已中断，不再合并新请求
+    CHECK_JOB_HEARTBEAT_INTERVAL = 60  # 排队和执行中的任务刷新更新时间的间隔（秒），应明显小于上面的时间
+    CHECK_JOB_RETENTION = 86400      # 已结束任务的保留时间（秒）
+    
+    # 批量导入API密钥
+    BULK_IMPORT_MAX_ROWS = int(os.environ.get('BULK_IMPORT_MAX_ROWS', 50000))  # 单次导入的最大行数
+    BULK_IMPORT_BATCH_SIZE = 500  # 去重查询和插入的每批行数
+    
+    # 用量预测
+    FORECAST_WINDOW_HOURS = int(os.environ.get('FORECAST_WINDOW_HOURS', 72))  # 拟合使用最近多少小时的用量
+    FORECAST_MIN_SAMPLES = 3       # 少于该采样数时不计算消耗速度
+    FORECAST_BATCH_SIZE = 500      # 每次聚合查询的密钥数
+    
+    # 告警通知（webhook 在后台线程中发送）
+    ALERT_WEBHOOK_TIMEOUT = int(os.environ.get('ALERT_WEBHOOK_TIMEOUT', 5))  # 单次发送超时（秒）
+    ALERT_WEBHOOK_RETRIES = int(os.environ.get('ALERT_WEBHOOK_RETRIES', 2))  # 失败后的重试次数
+    ALERT_WEBHOOK_WORKERS = 2  # 发送线程数
+    ALERT_DELIVERY_TIMEOUT = 120        # 发送中的通知超过该时间没有结果时视为中断，重新发送（秒）
+    ALERT_REDELIVERY_INTERVAL = 60      # 发送失败后重新发送的初始间隔（秒），每次翻倍，最长1小时
+    ALERT_REDELIVERY_MAX_ATTEMPTS = int(os.environ.get('ALERT_REDELIVERY_MAX_ATTEMPTS', 10))  # 失败多少次后放弃
+    
+    # 用量历史分页与导出
+    HISTORY_PAGE_SIZE = 200      # /api/usage/<key_id> 分页时的默认每页记录数
+    HISTORY_PAGE_MAX = 1000      # 每页记录数上限
+    EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 1000))  # 导出时每次从数据库读取的行数
 
 
@@ -0,0 +1,110 @@
+"""
+数据库结构迁移
+
+为已有的数据库文件就地补齐模型中新增的表、列和索引（不删除任何数据），
+并提供查看关键查询执行计划的工具，用于确认索引生效。
+"""
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import inspect
+
+logger = logging.getLogger(__name__)
+
+def upgrade_database(db):
+    """将数据库结构升级到与模型一致，可重复执行"""
+    from models import LatestUsage, UsageRecord, DataVersion
+    
+    engine = db.engine
+    
+    # 新增的表
+    db.create_all()
+    
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    ddl = f'ALTER TABLE {table.name} ADD COLUMN {_column_ddl(column, engine.dialect)}'
+                    logger.info(f"迁移: {ddl}")
+                    conn.exec_driver_sql(ddl)
+            
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    logger.info(f"迁移: 为表 {table.name} 创建索引 {index.name}")
+                    index.create(conn)
+    
+    # 已有历史数据的数据库首次升级时，回填最新用量表
+    if not LatestUsage.query.first() and UsageRecord.query.first():
+        logger.info("迁移: 回填最新用量表")
+        LatestUsage.rebuild()
+    
+    # 预先创建版本号行，避免多个进程首次递增时同时插入
+    existing_versions = DataVersion.current()
+    for name in DataVersion.NAMES:
+        if name not in existing_versions:
+            db.session.add(DataVersion(name=name, version=0))
+    db.session.commit()
+
+def _column_ddl(column, dialect):
+    """生成 ADD COLUMN 的列定义（新增列一律允许为空，已有行使用默认值）"""
+    ddl = f'{column.name} {column.type.compile(dialect=dialect)}'
+    
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if isinstance(default, bool):
+        ddl += f' DEFAULT {int(default)}'
+    elif isinstance(default, (int, float)):
+        ddl += f' DEFAULT {default}'
+    elif isinstance(default, str):
+        ddl += " DEFAULT '{}'".format(default.replace("'", "''"))
+    
+    return ddl
+
+def explain_queries(db):
+    """
+    输出关键查询的执行计划
+    
+    Returns:
+        list[dict]: 每个查询的名称、SQL和执行计划
+    """
+    from models import ApiKey, LatestUsage, UsageRecord
+    
+    since = datetime.utcnow() - timedelta(hours=24)
+    latest_record, is_latest = UsageRecord.latest_per_key()
+    
+    queries = {
+        '用量历史': db.select(UsageRecord).where(
+            UsageRecord.api_key_id == 1,
+            UsageRecord.check_time >= since
+        ).order_by(UsageRecord.check_time.desc()),
+        '单个密钥最新记录': db.select(UsageRecord).where(
+            UsageRecord.api_key_id == 1
+        ).order_by(UsageRecord.check_time.desc()).limit(1),
+        '各密钥最新记录（重建最新用量表）': db.select(latest_record).where(is_latest),
+        '用量摘要': db.select(ApiKey, LatestUsage).outerjoin(
+            LatestUsage, LatestUsage.api_key_id == ApiKey.id
+        ).where(ApiKey.is_active == True),
+        '组内活跃密钥': db.select(ApiKey).where(ApiKey.group_id == 1, ApiKey.is_active == True),
+    }
+    
+    engine = db.engine
+    prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    
+    plans = []
+    with engine.connect() as conn:
+        for name, statement in queries.items():
+            compiled = statement.compile(dialect=engine.dialect)
+            if compiled.positional:
+                params = tuple(compiled.params[key] for key in compiled.positiontup)
+            else:
+                params = compiled.params
+            
+            rows = conn.exec_driver_sql(prefix + compiled.string, params).fetchall()
+            plans.append({
+                'name': name,
+                'sql': compiled.string,
+                'plan': [' '.join(str(value) for value in row) for row in rows]
+            })
+    
+    return plans
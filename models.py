@@ -1,8 +1,39 @@
+import sqlite3
 from datetime import datetime
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased, declared_attr
+from config import Config
 
 db = SQLAlchemy()
 
+SQLITE_JOURNAL_MODES = ('WAL', 'DELETE', 'TRUNCATE', 'PERSIST', 'MEMORY', 'OFF')
+SQLITE_SYNCHRONOUS_LEVELS = ('OFF', 'NORMAL', 'FULL', 'EXTRA')
+
+def _pragma_value(name, value, allowed):
+    """校验 PRAGMA 取值（配置来自环境变量，不能直接拼接到 SQL 中）"""
+    value = str(value).strip().upper()
+    if value not in allowed:
+        raise ValueError(f'{name} 必须是 {", ".join(allowed)} 之一，实际为 {value!r}')
+    return value
+
+@event.listens_for(Engine, 'connect')
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """SQLite连接建立时设置日志模式、同步级别、缓存和锁等待时间"""
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    
+    journal_mode = _pragma_value('SQLITE_JOURNAL_MODE', Config.SQLITE_JOURNAL_MODE, SQLITE_JOURNAL_MODES)
+    synchronous = _pragma_value('SQLITE_SYNCHRONOUS', Config.SQLITE_SYNCHRONOUS, SQLITE_SYNCHRONOUS_LEVELS)
+    
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f'PRAGMA busy_timeout = {int(Config.SQLITE_BUSY_TIMEOUT)}')
+    cursor.execute(f'PRAGMA journal_mode = {journal_mode}')
+    cursor.execute(f'PRAGMA synchronous = {synchronous}')
+    cursor.execute(f'PRAGMA cache_size = {int(Config.SQLITE_CACHE_SIZE)}')
+    cursor.close()
+
 class ApiGroup(db.Model):
     """API组模型"""
     __tablename__ = 'api_groups'
@@ -10,25 +41,33 @@ class ApiGroup(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     query_interval = db.Column(db.Integer, default=3600)  # 查询间隔（秒）
+    polling_mode = db.Column(db.String(20), default='fixed')  # 'fixed' 固定间隔 或 'adaptive' 按消耗速度自适应
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # 关联的API密钥
     api_keys = db.relationship('ApiKey', backref='group', lazy=True, cascade='all, delete-orphan')
     
-    def to_dict(self):
+    # 作用于本组的告警规则
+    alert_rules = db.relationship('AlertRule', lazy=True, cascade='all, delete-orphan')
+    
+    def to_dict(self, api_keys_count=None):
         return {
             'id': self.id,
             'name': self.name,
             'query_interval': self.query_interval,
+            'polling_mode': self.polling_mode or 'fixed',
             'is_active': self.is_active,
             'created_at': self.created_at.isoformat() if self.created_at else None,
-            'api_keys_count': len(self.api_keys)
+            'api_keys_count': len(self.api_keys) if api_keys_count is None else api_keys_count
         }
 
 class ApiKey(db.Model):
     """API密钥模型"""
     __tablename__ = 'api_keys'
+    __table_args__ = (
+        db.Index('ix_api_keys_group_active', 'group_id', 'is_active'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)  # 密钥别名
@@ -39,17 +78,36 @@ class ApiKey(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_check = db.Column(db.DateTime)
     
+    # 自适应查询
+    poll_interval = db.Column(db.Integer)  # 当前查询间隔（秒）
+    next_check_at = db.Column(db.DateTime)  # 下一次查询时间
+    
     # Pro API的计费周期
     billing_start_time = db.Column(db.DateTime)  # 计费周期开始时间
     billing_end_time = db.Column(db.DateTime)    # 计费周期结束时间
     
+    # 密钥状态：连续认证失败（401/403）达到 KEY_QUARANTINE_THRESHOLD 次后隔离，
+    # 隔离期间定时查询只按 KEY_PROBE_INTERVAL 重新探测，探测成功后恢复
+    status = db.Column(db.String(20), default='active')  # active / quarantined
+    auth_failures = db.Column(db.Integer, default=0)  # 连续认证失败次数
+    quarantined_at = db.Column(db.DateTime)  # 隔离时间
+    next_probe_at = db.Column(db.DateTime)   # 隔离期间下一次探测时间
+    
     # 关联的用量记录
     usage_records = db.relationship('UsageRecord', backref='api_key', lazy=True, cascade='all, delete-orphan')
     
+    # 最新用量（每个密钥一行，采集时同步更新）
+    latest_usage = db.relationship('LatestUsage', uselist=False, lazy=True, cascade='all, delete-orphan')
+    
+    # 用量预测（每个密钥一行，写入用量后刷新）
+    forecast = db.relationship('UsageForecast', uselist=False, lazy=True, cascade='all, delete-orphan')
+    
+    # 告警状态和只作用于本密钥的告警规则
+    alert_states = db.relationship('AlertState', lazy=True, cascade='all, delete-orphan')
+    alert_rules = db.relationship('AlertRule', lazy=True, cascade='all, delete-orphan')
+    
     def to_dict(self, show_full_key=False):
-        latest_record = UsageRecord.query.filter_by(
-            api_key_id=self.id
-        ).order_by(UsageRecord.check_time.desc()).first()
+        latest_record = self.latest_usage
         
         # 如果有最新记录，处理Pro API的特殊字段
         if latest_record and self.api_type == 'pro':
@@ -77,18 +135,62 @@ class ApiKey(db.Model):
             'is_expired': is_expired,
             'created_at': self.created_at.isoformat() if self.created_at else None,
             'last_check': self.last_check.isoformat() if self.last_check else None,
+            'poll_interval': self.poll_interval,
+            'next_check_at': self.next_check_at.isoformat() if self.next_check_at else None,
             'billing_start_time': self.billing_start_time.isoformat() if self.billing_start_time else None,
             'billing_end_time': self.billing_end_time.isoformat() if self.billing_end_time else None,
+            'status': self.status or 'active',
+            'auth_failures': self.auth_failures or 0,
+            'quarantined_at': self.quarantined_at.isoformat() if self.quarantined_at else None,
+            'next_probe_at': self.next_probe_at.isoformat() if self.next_probe_at else None,
             'latest_usage': usage_dict
         }
+    
+    @classmethod
+    def delete_many(cls, key_ids):
+        """
+        批量删除密钥及其关联数据（在当前事务中执行，不提交）
+        
+        批量 DELETE 不会触发关系上的级联删除，关联表按 api_key_id IN (...) 逐个删除
+        
+        Args:
+            key_ids: 密钥ID列表或子查询
+        
+        Returns:
+            int: 删除的密钥数
+        """
+        key_rule_ids = db.select(AlertRule.id).where(AlertRule.api_key_id.in_(key_ids))
+        statements = [
+            db.delete(AlertState).where(db.or_(
+                AlertState.api_key_id.in_(key_ids),
+                AlertState.rule_id.in_(key_rule_ids)
+            )),
+            db.delete(AlertRule).where(AlertRule.api_key_id.in_(key_ids)),
+            db.delete(LatestUsage).where(LatestUsage.api_key_id.in_(key_ids)),
+            db.delete(UsageForecast).where(UsageForecast.api_key_id.in_(key_ids)),
+            db.delete(UsageRollupHourly).where(UsageRollupHourly.api_key_id.in_(key_ids)),
+            db.delete(UsageRollupDaily).where(UsageRollupDaily.api_key_id.in_(key_ids)),
+            db.delete(UsageRecord).where(UsageRecord.api_key_id.in_(key_ids))
+        ]
+        for statement in statements:
+            db.session.execute(statement.execution_options(synchronize_session=False))
+        
+        return db.session.execute(
+            db.delete(cls).where(cls.id.in_(key_ids)).execution_options(synchronize_session=False)
+        ).rowcount
 
 class UsageRecord(db.Model):
     """用量记录模型"""
     __tablename__ = 'usage_records'
+    __table_args__ = (
+        # 历史、摘要、最新记录查询都按密钥过滤并按时间排序/筛选
+        db.Index('ix_usage_records_key_time', 'api_key_id', 'check_time'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     api_key_id = db.Column(db.Integer, db.ForeignKey('api_keys.id'), nullable=False)
     check_time = db.Column(db.DateTime, default=datetime.utcnow)
+    last_seen = db.Column(db.DateTime)  # 仅变化存储模式下，值未变化的最后一次查询时间
     
     # DeepL API返回的字段
     character_count = db.Column(db.Integer, nullable=False)  # 已使用字符数
@@ -104,11 +206,114 @@ class UsageRecord(db.Model):
     is_success = db.Column(db.Boolean, default=True)
     error_message = db.Column(db.Text)
     
+    @classmethod
+    def latest_per_key(cls):
+        """
+        返回每个API密钥最新一条记录的别名实体（基于窗口函数的子查询），
+        可与 ApiKey 外连接，一次查询取出所有密钥的最新用量
+        """
+        ranked = db.session.query(
+            cls,
+            db.func.row_number().over(
+                partition_by=cls.api_key_id,
+                order_by=(cls.check_time.desc(), cls.id.desc())
+            ).label('row_number')
+        ).subquery()
+        
+        latest = aliased(cls, ranked)
+        return latest, ranked.c.row_number == 1
+    
     def to_dict(self):
         return {
             'id': self.id,
             'api_key_id': self.api_key_id,
             'check_time': self.check_time.isoformat() if self.check_time else None,
+            'last_seen': self.last_seen.isoformat() if self.last_seen else None,
+            'character_count': self.character_count,
+            'character_limit': self.character_limit,
+            'usage_percentage': (self.character_count / self.character_limit * 100) if self.character_limit > 0 else 0,
+            'api_key_character_count': self.api_key_character_count,
+            'api_key_character_limit': self.api_key_character_limit,
+            'start_time': self.start_time.isoformat() if self.start_time else None,
+            'end_time': self.end_time.isoformat() if self.end_time else None,
+            'is_success': self.is_success,
+            'error_message': self.error_message
+        }
+
+class LatestUsage(db.Model):
+    """最新用量模型 - 每个API密钥一行，与用量记录在同一事务中更新"""
+    __tablename__ = 'latest_usage'
+    
+    api_key_id = db.Column(db.Integer, db.ForeignKey('api_keys.id'), primary_key=True)
+    record_id = db.Column(db.Integer, db.ForeignKey('usage_records.id'))  # 对应的最新用量记录
+    check_time = db.Column(db.DateTime)
+    
+    character_count = db.Column(db.Integer, nullable=False, default=0)
+    character_limit = db.Column(db.Integer, nullable=False, default=0)
+    api_key_character_count = db.Column(db.Integer)
+    api_key_character_limit = db.Column(db.Integer)
+    start_time = db.Column(db.DateTime)
+    end_time = db.Column(db.DateTime)
+    
+    is_success = db.Column(db.Boolean, default=True)
+    error_message = db.Column(db.Text)
+    
+    record = db.relationship('UsageRecord')
+    
+    # 与 UsageRecord 同名、需要同步的字段
+    SYNC_FIELDS = (
+        'check_time', 'character_count', 'character_limit',
+        'api_key_character_count', 'api_key_character_limit',
+        'start_time', 'end_time', 'is_success', 'error_message'
+    )
+    
+    # 判断用量是否变化时比较的字段
+    VALUE_FIELDS = (
+        'character_count', 'character_limit',
+        'api_key_character_count', 'api_key_character_limit',
+        'start_time', 'end_time'
+    )
+    
+    def update_from(self, record):
+        """用一条用量记录覆盖当前状态"""
+        self.record = record
+        for field in self.SYNC_FIELDS:
+            setattr(self, field, getattr(record, field))
+    
+    def effective_usage(self):
+        """实际用量和上限：Pro API优先使用api_key_character_count/limit"""
+        if self.api_key_character_count is not None:
+            return self.api_key_character_count, self.api_key_character_limit or 0
+        return self.character_count, self.character_limit
+    
+    def is_unchanged(self, usage_info):
+        """新的查询结果与当前状态是否相同（均为成功且各项用量值一致）"""
+        if not (self.is_success and usage_info['is_success']):
+            return False
+        return all(getattr(self, field) == usage_info.get(field) for field in self.VALUE_FIELDS)
+    
+    @classmethod
+    def rebuild(cls):
+        """根据用量记录历史重建最新用量表（用于已有数据库的首次迁移）"""
+        latest_record, is_latest = UsageRecord.latest_per_key()
+        columns = [latest_record.api_key_id, latest_record.id] + [
+            getattr(latest_record, field) for field in cls.SYNC_FIELDS
+        ]
+        select = db.select(*columns).where(is_latest).where(
+            latest_record.api_key_id.in_(db.select(ApiKey.id))
+        )
+        
+        db.session.execute(db.delete(cls))
+        db.session.execute(
+            db.insert(cls).from_select(['api_key_id', 'record_id'] + list(cls.SYNC_FIELDS), select)
+        )
+        db.session.commit()
+    
+    def to_dict(self):
+        return {
+            'id': self.record_id,
+            'api_key_id': self.api_key_id,
+            'check_time': self.check_time.isoformat() if self.check_time else None,
             'character_count': self.character_count,
             'character_limit': self.character_limit,
             'usage_percentage': (self.character_count / self.character_limit * 100) if self.character_limit > 0 else 0,
@@ -119,3 +324,271 @@ class UsageRecord(db.Model):
             'is_success': self.is_success,
             'error_message': self.error_message
         }
+
+class UsageRollupMixin:
+    """用量汇总表公共字段 - 每个密钥每个时间桶一行"""
+    
+    @declared_attr
+    def api_key_id(cls):
+        return db.Column(db.Integer, db.ForeignKey('api_keys.id'), primary_key=True)
+    
+    bucket_start = db.Column(db.DateTime, primary_key=True)  # 时间桶起始时间
+    first_time = db.Column(db.DateTime, nullable=False)  # 桶内第一条记录时间
+    last_time = db.Column(db.DateTime, nullable=False)   # 桶内最后一条记录时间
+    
+    # 用量值（Pro API为api_key_character_count）
+    max_usage = db.Column(db.Integer, nullable=False)
+    min_usage = db.Column(db.Integer, nullable=False)
+    first_usage = db.Column(db.Integer, nullable=False)
+    last_usage = db.Column(db.Integer, nullable=False)
+    character_limit = db.Column(db.Integer)
+    records = db.Column(db.Integer, nullable=False)  # 汇总的原始记录数
+    
+    def to_dict(self):
+        return {
+            'api_key_id': self.api_key_id,
+            'bucket_start': self.bucket_start.isoformat(),
+            'first_time': self.first_time.isoformat(),
+            'last_time': self.last_time.isoformat(),
+            'max_usage': self.max_usage,
+            'min_usage': self.min_usage,
+            'first_usage': self.first_usage,
+            'last_usage': self.last_usage,
+            'character_limit': self.character_limit,
+            'records': self.records
+        }
+
+class UsageRollupHourly(UsageRollupMixin, db.Model):
+    """按小时汇总的用量"""
+    __tablename__ = 'usage_rollups_hourly'
+    __table_args__ = (
+        db.Index('ix_usage_rollups_hourly_bucket', 'bucket_start'),
+    )
+
+class UsageRollupDaily(UsageRollupMixin, db.Model):
+    """按天汇总的用量"""
+    __tablename__ = 'usage_rollups_daily'
+    __table_args__ = (
+        db.Index('ix_usage_rollups_daily_bucket', 'bucket_start'),
+    )
+
+class SchedulerLease(db.Model):
+    """调度器租约 - 多进程部署时只有持有租约的进程运行定时任务"""
+    __tablename__ = 'scheduler_leases'
+    
+    name = db.Column(db.String(50), primary_key=True)  # 租约名称
+    holder = db.Column(db.String(200), nullable=False)  # 持有者标识（主机名:进程号:随机串）
+    acquired_at = db.Column(db.DateTime, nullable=False)  # 当前持有者获得租约的时间
+    expires_at = db.Column(db.DateTime, nullable=False)  # 到期时间，持有者需在此之前续约
+    
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'holder': self.holder,
+            'acquired_at': self.acquired_at.isoformat(),
+            'expires_at': self.expires_at.isoformat()
+        }
+
+class PollerNode(db.Model):
+    """独立查询进程 - 各进程定期心跳，按存活进程对密钥做一致性哈希分片"""
+    __tablename__ = 'poller_nodes'
+    
+    node_id = db.Column(db.String(200), primary_key=True)  # 进程标识（默认为 主机名-序号）
+    hostname = db.Column(db.String(200))
+    pid = db.Column(db.Integer)
+    started_at = db.Column(db.DateTime, nullable=False)
+    heartbeat_at = db.Column(db.DateTime, nullable=False)  # 最近一次心跳时间
+    
+    def to_dict(self):
+        return {
+            'node_id': self.node_id,
+            'hostname': self.hostname,
+            'pid': self.pid,
+            'started_at': self.started_at.isoformat(),
+            'heartbeat_at': self.heartbeat_at.isoformat()
+        }
+
+class DataVersion(db.Model):
+    """数据版本号 - 数据变化时递增，用于接口缓存和 ETag 失效（多进程共享）"""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)  # usage: 用量数据; config: 组和密钥配置
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    NAMES = ('usage', 'config')
+    
+    @classmethod
+    def bump(cls, *names):
+        """在当前事务中递增指定的版本号（不提交）"""
+        now = datetime.utcnow()
+        for name in names:
+            updated = db.session.execute(
+                db.update(cls).where(cls.name == name).values(version=cls.version + 1, updated_at=now)
+            ).rowcount
+            if not updated:
+                db.session.add(cls(name=name, version=1, updated_at=now))
+    
+    @classmethod
+    def current(cls):
+        """所有版本号 {name: version}"""
+        return dict(db.session.query(cls.name, cls.version).all())
+
+class CheckJob(db.Model):
+    """立即检查任务 - 在后台执行，进度保存在数据库中供状态接口查询（多进程共享）"""
+    __tablename__ = 'check_jobs'
+    __table_args__ = (
+        db.Index('ix_check_jobs_target_status', 'target', 'status'),
+        db.Index('ux_check_jobs_active_target', 'active_target', unique=True),
+    )
+    
+    id = db.Column(db.String(32), primary_key=True)
+    target = db.Column(db.String(50), nullable=False)  # group:<id> / key:<id> / all / import:<批次ID>
+    active_target = db.Column(db.String(50))  # 未结束时等于 target，唯一索引保证同一目标最多一个未结束的任务
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued / running / succeeded / failed
+    total = db.Column(db.Integer, nullable=False, default=0)      # 需要查询的密钥数
+    completed = db.Column(db.Integer, nullable=False, default=0)  # 已完成查询的密钥数
+    failed = db.Column(db.Integer, nullable=False, default=0)     # 查询失败的密钥数
+    coalesced = db.Column(db.Integer, nullable=False, default=0)  # 合并到本任务的重复请求数
+    error = db.Column(db.Text)
+    holder = db.Column(db.String(200))  # 执行任务的进程
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    ACTIVE_STATUSES = ('queued', 'running')
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'target': self.target,
+            'status': self.status,
+            'total': self.total,
+            'completed': self.completed,
+            'failed': self.failed,
+            'progress': round(self.completed / self.total * 100, 1) if self.total else (100.0 if self.finished_at else 0.0),
+            'coalesced': self.coalesced,
+            'error': self.error,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class UsageForecast(db.Model):
+    """用量预测 - 按近期用量趋势（最小二乘直线）预测额度用尽时间，每个密钥一行"""
+    __tablename__ = 'usage_forecasts'
+    __table_args__ = (
+        db.Index('ix_usage_forecasts_hours', 'hours_to_exhaustion'),
+    )
+    
+    api_key_id = db.Column(db.Integer, db.ForeignKey('api_keys.id'), primary_key=True)
+    computed_at = db.Column(db.DateTime, nullable=False)
+    samples = db.Column(db.Integer, nullable=False, default=0)  # 参与拟合的采样点数
+    last_sample_at = db.Column(db.DateTime)
+    rate_per_hour = db.Column(db.Float)  # 每小时消耗的字符数（采样不足时为空）
+    
+    character_count = db.Column(db.Integer, nullable=False, default=0)
+    character_limit = db.Column(db.Integer, nullable=False, default=0)
+    
+    hours_to_exhaustion = db.Column(db.Float)  # 距离用尽的小时数（不会用尽时为空）
+    exhaustion_at = db.Column(db.DateTime)
+    
+    def to_dict(self):
+        remaining = max(self.character_limit - self.character_count, 0)
+        return {
+            'api_key_id': self.api_key_id,
+            'computed_at': self.computed_at.isoformat(),
+            'samples': self.samples,
+            'last_sample_at': self.last_sample_at.isoformat() if self.last_sample_at else None,
+            'rate_per_hour': self.rate_per_hour,
+            'rate_per_day': self.rate_per_hour * 24 if self.rate_per_hour is not None else None,
+            'character_count': self.character_count,
+            'character_limit': self.character_limit,
+            'remaining': remaining,
+            'hours_to_exhaustion': self.hours_to_exhaustion,
+            'exhaustion_at': self.exhaustion_at.isoformat() if self.exhaustion_at else None
+        }
+
+class AlertRule(db.Model):
+    """告警规则"""
+    __tablename__ = 'alert_rules'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    rule_type = db.Column(db.String(30), nullable=False)  # percent / remaining / burn_rate / consecutive_failures / billing_ending
+    threshold = db.Column(db.Float, nullable=False)
+    
+    # 作用范围：指定密钥 > 指定组 > 全部密钥
+    group_id = db.Column(db.Integer, db.ForeignKey('api_groups.id'))
+    api_key_id = db.Column(db.Integer, db.ForeignKey('api_keys.id'))
+    
+    sink = db.Column(db.String(20), nullable=False, default='log')  # 通知方式: log / webhook
+    webhook_url = db.Column(db.String(500))
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    states = db.relationship('AlertState', backref='rule', lazy=True, cascade='all, delete-orphan')
+    
+    def applies_to(self, api_key_id, group_id):
+        """规则是否作用于该密钥"""
+        if self.api_key_id is not None:
+            return self.api_key_id == api_key_id
+        if self.group_id is not None:
+            return self.group_id == group_id
+        return True
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'rule_type': self.rule_type,
+            'threshold': self.threshold,
+            'group_id': self.group_id,
+            'api_key_id': self.api_key_id,
+            'sink': self.sink,
+            'webhook_url': self.webhook_url,
+            'is_active': self.is_active,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+
+class AlertState(db.Model):
+    """告警状态 - 每条规则每个密钥一行，只在状态变化（或需要计数）时写入"""
+    __tablename__ = 'alert_states'
+    __table_args__ = (
+        db.Index('ix_alert_states_status', 'status'),
+        db.Index('ix_alert_states_next_delivery', 'next_delivery_at'),
+    )
+    
+    rule_id = db.Column(db.Integer, db.ForeignKey('alert_rules.id'), primary_key=True)
+    api_key_id = db.Column(db.Integer, db.ForeignKey('api_keys.id'), primary_key=True)
+    status = db.Column(db.String(20), nullable=False, default='ok')  # ok / firing
+    value = db.Column(db.Float)  # 最近一次触发或恢复时的值
+    failure_count = db.Column(db.Integer, nullable=False, default=0)  # 连续查询失败次数
+    fired_at = db.Column(db.DateTime)
+    resolved_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # 通知投递（状态变化后写入待发送的事件，发送成功后清除）
+    pending_event = db.Column(db.Text)  # 尚未送达的通知事件（JSON）
+    delivery_attempts = db.Column(db.Integer, nullable=False, default=0)  # 该事件已失败的发送次数
+    next_delivery_at = db.Column(db.DateTime)  # 下一次重新发送的时间（发送中时为认领到期时间，放弃后为空）
+    delivered_at = db.Column(db.DateTime)  # 最近一次送达时间
+    delivery_error = db.Column(db.Text)  # 最近一次发送失败的原因
+    
+    def to_dict(self):
+        return {
+            'rule_id': self.rule_id,
+            'api_key_id': self.api_key_id,
+            'status': self.status,
+            'value': self.value,
+            'failure_count': self.failure_count,
+            'fired_at': self.fired_at.isoformat() if self.fired_at else None,
+            'resolved_at': self.resolved_at.isoformat() if self.resolved_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+            'delivery_pending': self.pending_event is not None,
+            'delivery_attempts': self.delivery_attempts,
+            'delivered_at': self.delivered_at.isoformat() if self.delivered_at else None,
+            'delivery_error': self.delivery_error
+        }
@@ -0,0 +1,168 @@
+"""
+独立查询进程
+
+与 Web 应用分开运行定时查询。可以在多台机器上各启动若干进程，
+每个进程按一致性哈希只查询归属于自己的密钥，进程加入或退出后自动重新分片。
+Web 进程设置 EMBEDDED_SCHEDULER_ENABLED=false 后只处理页面和 API 请求。
+
+用法:
+    python poller.py                  # 启动一个查询进程
+    python poller.py --processes 4    # 启动4个查询进程
+"""
+import argparse
+import logging
+import multiprocessing
+import signal
+import socket
+import threading
+from flask import Flask
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def create_poller_app():
+    """创建只用于数据库访问的Flask应用（不注册路由）"""
+    from models import db
+    
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    db.init_app(app)
+    return app
+
+def create_poller_service(app, node_id):
+    """
+    创建查询进程的调度服务
+    
+    有存活的查询进程时 Web 进程不运行定时查询，写入用量后的预测刷新和告警评估只能在这里进行。
+    
+    Returns:
+        tuple: (调度服务, 告警服务)
+    """
+    from models import db
+    from services.deepl_service import DeepLService
+    from services.async_deepl_service import AsyncDeepLService
+    from services.scheduler_service import SchedulerService, create_scheduler
+    from services.history_service import HistoryService
+    from services.rollup_service import RollupService
+    from services.leader_lease import LeaderLease
+    from services.poller_registry import PollerRegistry
+    from services.forecast_service import ForecastService
+    from services.alert_service import AlertService
+    from services.app_services import register_ingest_listeners
+    
+    # 各查询进程的任务不同，始终使用内存任务存储
+    scheduler = create_scheduler()
+    
+    deepl_service = DeepLService()
+    async_deepl_service = None
+    if app.config['ASYNC_POLLING_ENABLED'] and AsyncDeepLService.is_available():
+        async_deepl_service = AsyncDeepLService()
+    
+    history_service = HistoryService(db)
+    scheduler_service = SchedulerService(
+        scheduler, deepl_service, db,
+        async_deepl_service=async_deepl_service, app=app,
+        rollup_service=RollupService(db, history_service),
+        leader_lease=LeaderLease(db) if app.config['LEADER_ELECTION_ENABLED'] else None,
+        shard=PollerRegistry(db, node_id)
+    )
+    
+    alert_service = AlertService(db, app)
+    register_ingest_listeners(
+        scheduler_service.ingest_writer,
+        forecast_service=ForecastService(db),
+        alert_service=alert_service
+    )
+    return scheduler_service, alert_service
+
+def run_poller(node_id, upgrade=True, metrics_port=None):
+    """运行一个查询进程，直到收到 SIGTERM / SIGINT"""
+    logging.basicConfig(level=logging.INFO)
+    
+    from models import db
+    from migrations import upgrade_database
+    from services.metrics import start_metrics_server
+    
+    app = create_poller_app()
+    if upgrade:
+        with app.app_context():
+            upgrade_database(db)
+    
+    scheduler_service, alert_service = create_poller_service(app, node_id)
+    scheduler = scheduler_service.scheduler
+    
+    if metrics_port:
+        start_metrics_server(metrics_port)
+    
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop.set())
+    signal.signal(signal.SIGINT, lambda *args: stop.set())
+    
+    scheduler.start()
+    try:
+        # 心跳后按数据库中的组创建定时任务；汇总任务只在持有租约的进程中运行
+        scheduler_service.setup_shard()
+        scheduler_service.setup_compaction_scheduler()
+        scheduler_service.setup_leader_election()
+        logger.info(f"查询进程 {node_id} 已启动")
+        
+        while not stop.wait(1):
+            pass
+    finally:
+        logger.info(f"查询进程 {node_id} 正在退出")
+        scheduler.shutdown(wait=False)
+        scheduler_service.poll_executor.shutdown(wait=False)
+        scheduler_service.ingest_writer.stop()
+        alert_service.shutdown()
+        scheduler_service.leave_shard()
+        scheduler_service.release_leadership()
+        scheduler_service.deepl_service.close()
+        if scheduler_service.async_deepl_service is not None:
+            scheduler_service.async_deepl_service.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='DeepL API 用量独立查询进程')
+    parser.add_argument('--processes', type=int, default=Config.POLLER_PROCESSES, help='启动的进程数')
+    parser.add_argument('--node-id', default=Config.POLLER_NODE_ID or socket.gethostname(),
+                        help='进程标识前缀，各进程为 <前缀>-<序号>')
+    args = parser.parse_args()
+    
+    if args.processes <= 1:
+        run_poller(f'{args.node_id}-0', metrics_port=Config.POLLER_METRICS_PORT)
+        return
+    
+    # 由父进程统一升级数据库，避免多个进程同时执行DDL
+    logging.basicConfig(level=logging.INFO)
+    from models import db
+    from migrations import upgrade_database
+    
+    with create_poller_app().app_context():
+        upgrade_database(db)
+    
+    context = multiprocessing.get_context('spawn')
+    # 启用指标导出时各进程依次使用 POLLER_METRICS_PORT 起的端口
+    processes = [
+        context.Process(
+            target=run_poller,
+            args=(f'{args.node_id}-{index}', False, Config.POLLER_METRICS_PORT and Config.POLLER_METRICS_PORT + index),
+            name=f'poller-{index}'
+        )
+        for index in range(args.processes)
+    ]
+    for process in processes:
+        process.start()
+    
+    def terminate(*args):
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+    
+    signal.signal(signal.SIGTERM, terminate)
+    # Ctrl+C 会同时发给子进程，父进程只需等待
+    signal.signal(signal.SIGINT, lambda *args: None)
+    
+    for process in processes:
+        process.join()
+
+if __name__ == '__main__':
+    main()
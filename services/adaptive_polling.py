@@ -0,0 +1,100 @@
+import logging
+import random
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from config import Config
+from services.history_service import usage_value, to_datetime
+
+logger = logging.getLogger(__name__)
+
+# 组的查询模式
+POLLING_MODES = ('fixed', 'adaptive')
+
+def compute_burn_rates(db, key_ids, now):
+    """
+    根据近期用量记录计算各密钥的消耗速度
+    
+    Args:
+        db: 数据库对象
+        key_ids (list[int]): API密钥ID列表
+        now (datetime): 当前时间
+    
+    Returns:
+        dict: {api_key_id: 每小时消耗的字符数}，样本不足的密钥不在结果中
+    """
+    from models import UsageRecord
+    
+    if not key_ids:
+        return {}
+    
+    since = now - timedelta(hours=Config.ADAPTIVE_LOOKBACK_HOURS)
+    value = usage_value(UsageRecord)
+    rows = db.session.query(
+        UsageRecord.api_key_id,
+        func.min(UsageRecord.check_time),
+        func.max(func.coalesce(UsageRecord.last_seen, UsageRecord.check_time)),
+        func.min(value),
+        func.max(value)
+    ).filter(
+        UsageRecord.api_key_id.in_(key_ids),
+        UsageRecord.is_success == True,
+        func.coalesce(UsageRecord.last_seen, UsageRecord.check_time) >= since
+    ).group_by(UsageRecord.api_key_id).all()
+    
+    burn_rates = {}
+    for api_key_id, first_time, last_time, min_value, max_value in rows:
+        first_time, last_time = to_datetime(first_time), to_datetime(last_time)
+        hours = (last_time - max(first_time, since)).total_seconds() / 3600
+        if hours > 0:
+            burn_rates[api_key_id] = max(max_value - min_value, 0) / hours
+    return burn_rates
+
+def compute_poll_interval(burn_rate, character_count, character_limit, previous_interval, base_interval):
+    """
+    根据消耗速度计算下一次查询的间隔
+    
+    - 接近上限的密钥使用最小间隔
+    - 有消耗的密钥按"每次查询约变化 ADAPTIVE_TARGET_CHANGE 比例的额度"计算间隔，
+      且不超过预计用尽时间的一半
+    - 没有消耗的密钥在上一次间隔的基础上逐步退避，直到最大间隔
+    - 样本不足（burn_rate 为 None）时使用组的查询间隔
+    
+    Returns:
+        int: 间隔秒数
+    """
+    min_interval = Config.ADAPTIVE_MIN_INTERVAL
+    max_interval = Config.ADAPTIVE_MAX_INTERVAL
+    
+    if character_limit and character_count / character_limit >= Config.ADAPTIVE_NEAR_LIMIT:
+        return min_interval
+    
+    if burn_rate is None:
+        interval = base_interval
+    elif not burn_rate or not character_limit:
+        interval = (previous_interval or base_interval) * Config.ADAPTIVE_BACKOFF_FACTOR
+    else:
+        interval = character_limit * Config.ADAPTIVE_TARGET_CHANGE / burn_rate * 3600
+        remaining = max(character_limit - character_count, 0)
+        interval = min(interval, remaining / burn_rate * 3600 / 2)
+    
+    return int(min(max(interval, min_interval), max_interval))
+
+def schedule_next_checks(db, api_keys, now=None):
+    """根据近期消耗速度为自适应组的密钥计算下一次查询时间（不提交）"""
+    now = now or datetime.utcnow()
+    burn_rates = compute_burn_rates(db, [key.id for key in api_keys], now)
+    
+    for api_key in api_keys:
+        latest = api_key.latest_usage
+        character_count, character_limit = latest.effective_usage() if latest else (0, 0)
+        
+        api_key.poll_interval = compute_poll_interval(
+            burn_rates.get(api_key.id),
+            character_count,
+            character_limit,
+            api_key.poll_interval,
+            api_key.group.query_interval
+        )
+        # 叠加随机抖动，使同一组内的密钥逐渐错开查询时间
+        jitter = api_key.poll_interval * Config.ADAPTIVE_JITTER_RATIO
+        api_key.next_check_at = now + timedelta(seconds=api_key.poll_interval + random.uniform(-jitter, jitter))
@@ -0,0 +1,344 @@
+import json
+import logging
+import threading
+from concurrent.futures import Future
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_, update
+from config import Config
+from services.alert_sinks import ALERT_SINKS
+
+logger = logging.getLogger(__name__)
+
+# 规则类型及阈值含义
+RULE_TYPES = {
+    'percent': '用量占上限的百分比达到阈值',
+    'remaining': '剩余字符数小于等于阈值',
+    'burn_rate': '每小时消耗字符数（用量预测的拟合速度）达到阈值',
+    'consecutive_failures': '连续查询失败次数达到阈值',
+    'billing_ending': '距离计费周期结束的小时数小于等于阈值'
+}
+
+class AlertService:
+    """
+    告警服务 - 在用量写入后逐条评估本批查询结果
+    
+    每批只加载启用的规则、本批密钥和对应的告警状态，计算量与查询次数成正比，
+    与密钥总数和评估频率无关。状态只在 ok 与 firing 之间变化时通知一次（触发 / 恢复），
+    持续触发期间不会重复通知；没有触发过的规则不写入状态行（连续失败计数除外）。
+    
+    待发送的通知与状态一起提交，送达后才清除；发送失败或进程退出时未送达的通知
+    按退避间隔重新发送，直到送达或超过最大次数。
+    """
+    
+    def __init__(self, db, app=None):
+        self.db = db
+        self.app = app  # 后台发送完成后记录结果时需要应用上下文
+        self._sinks = {}
+        self._sinks_lock = threading.Lock()
+    
+    def get_sink(self, name):
+        """获取通知方式实例（按名称复用）"""
+        with self._sinks_lock:
+            sink = self._sinks.get(name)
+            if sink is None:
+                sink = ALERT_SINKS[name]()
+                self._sinks[name] = sink
+        return sink
+    
+    def on_usage_written(self, results):
+        """用量写入回调（在写入线程的应用上下文中调用）"""
+        try:
+            self.redeliver_pending()
+        except Exception as e:
+            logger.error(f"重新发送告警通知失败: {e}")
+            self.db.session.rollback()
+        self.evaluate(results)
+    
+    def evaluate(self, results, now=None):
+        """
+        评估一批查询结果并发送状态变化的通知（需要应用上下文，已提交）
+        
+        Args:
+            results (list[tuple]): [(api_key_id, usage_info)]
+        
+        Returns:
+            list[dict]: 本批产生的通知事件
+        """
+        from models import AlertRule, AlertState, ApiKey, UsageForecast
+        
+        now = now or datetime.utcnow()
+        rules = AlertRule.query.filter(AlertRule.is_active == True).all()
+        if not rules or not results:
+            return []
+        
+        session = self.db.session
+        key_ids = {api_key_id for api_key_id, _ in results}
+        keys = {
+            api_key.id: api_key
+            for api_key in ApiKey.query.filter(ApiKey.id.in_(key_ids)).all()
+        }
+        
+        # 只有需要时才读取用量预测
+        forecasts = {}
+        if any(rule.rule_type == 'burn_rate' for rule in rules):
+            forecasts = {
+                forecast.api_key_id: forecast
+                for forecast in UsageForecast.query.filter(UsageForecast.api_key_id.in_(key_ids)).all()
+            }
+        
+        pairs = [
+            (rule, keys[api_key_id], usage_info)
+            for api_key_id, usage_info in results if api_key_id in keys
+            for rule in rules if rule.applies_to(api_key_id, keys[api_key_id].group_id)
+        ]
+        if not pairs:
+            return []
+        
+        state_keys = list({(rule.id, api_key.id) for rule, api_key, _ in pairs})
+        states = {}
+        for start in range(0, len(state_keys), 400):
+            chunk = state_keys[start:start + 400]
+            for state in AlertState.query.filter(tuple_(AlertState.rule_id, AlertState.api_key_id).in_(chunk)):
+                states[(state.rule_id, state.api_key_id)] = state
+        
+        events = []
+        try:
+            for rule, api_key, usage_info in pairs:
+                state = states.get((rule.id, api_key.id))
+                result = self._evaluate_rule(rule, api_key, usage_info, forecasts.get(api_key.id), state, now)
+                if result is None:
+                    continue
+                
+                firing, value, failure_count = result
+                if state is None:
+                    if not firing and not failure_count:
+                        continue
+                    state = AlertState(rule_id=rule.id, api_key_id=api_key.id, status='ok', failure_count=0)
+                    session.add(state)
+                    states[(rule.id, api_key.id)] = state
+                
+                changed = False
+                if failure_count is not None and failure_count != state.failure_count:
+                    state.failure_count = failure_count
+                    changed = True
+                
+                new_status = 'firing' if firing else 'ok'
+                if new_status != state.status:
+                    state.status = new_status
+                    state.value = value
+                    if firing:
+                        state.fired_at = now
+                    else:
+                        state.resolved_at = now
+                    
+                    # 通知与状态一起提交，由本进程认领发送
+                    event = self._event(rule, api_key, new_status, value, now)
+                    state.pending_event = json.dumps(event, ensure_ascii=False)
+                    state.delivery_attempts = 0
+                    state.delivery_error = None
+                    state.next_delivery_at = now + timedelta(seconds=Config.ALERT_DELIVERY_TIMEOUT)
+                    events.append((rule, state.pending_event, event))
+                    changed = True
+                
+                if changed:
+                    state.updated_at = now
+            
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        
+        # 状态提交后再通知，避免重复发送
+        for rule, payload, event in events:
+            self._deliver(rule, payload, event)
+        
+        return [event for _, _, event in events]
+    
+    def _deliver(self, rule, payload, event):
+        """发送一条已认领的通知，完成后记录结果"""
+        rule_id, api_key_id = rule.id, event['api_key_id']
+        try:
+            result = self.get_sink(rule.sink).send(rule, event)
+        except Exception as e:
+            return self._record_delivery(rule_id, api_key_id, payload, e)
+        
+        if isinstance(result, Future):
+            # 进程退出时取消的发送不记录结果，认领到期后重新发送
+            result.add_done_callback(
+                lambda future: future.cancelled() or self._record_delivery(
+                    rule_id, api_key_id, payload, future.exception()
+                )
+            )
+        else:
+            self._record_delivery(rule_id, api_key_id, payload, None)
+    
+    def _record_delivery(self, rule_id, api_key_id, payload, error):
+        """
+        记录发送结果（可在发送线程中调用）
+        
+        只更新仍在等待该事件的状态行；之后的状态变化产生了新事件时不覆盖。
+        发送失败时按退避间隔安排重新发送，超过最大次数后放弃
+        """
+        if self.app is None:
+            return self._update_delivery(rule_id, api_key_id, payload, error)
+        
+        with self.app.app_context():
+            return self._update_delivery(rule_id, api_key_id, payload, error)
+    
+    def _update_delivery(self, rule_id, api_key_id, payload, error):
+        from models import AlertState
+        
+        session = self.db.session
+        now = datetime.utcnow()
+        try:
+            state = session.get(AlertState, (rule_id, api_key_id))
+            if state is None or state.pending_event != payload:
+                return
+            
+            if error is None:
+                values = {'pending_event': None, 'delivered_at': now, 'delivery_error': None, 'next_delivery_at': None}
+            else:
+                attempts = state.delivery_attempts + 1
+                delay = min(Config.ALERT_REDELIVERY_INTERVAL * 2 ** (attempts - 1), 3600)
+                values = {
+                    'delivery_attempts': attempts,
+                    'delivery_error': str(error)[:500],
+                    'next_delivery_at': now + timedelta(seconds=delay) if attempts < Config.ALERT_REDELIVERY_MAX_ATTEMPTS else None
+                }
+                if values['next_delivery_at'] is None:
+                    logger.error(f"告警通知发送失败 {attempts} 次，放弃发送（规则 {rule_id}，API密钥 {api_key_id}）: {error}")
+            
+            session.execute(update(AlertState).where(
+                AlertState.rule_id == rule_id,
+                AlertState.api_key_id == api_key_id,
+                AlertState.pending_event == payload
+            ).values(**values))
+            session.commit()
+        except Exception as e:
+            logger.error(f"记录告警通知发送结果失败: {e}")
+            session.rollback()
+    
+    def redeliver_pending(self, now=None, limit=100):
+        """
+        重新发送到期的未送达通知（需要应用上下文）
+        
+        每条通知先用带条件的 UPDATE 认领（推迟下一次发送时间），多个进程不会同时发送同一条
+        
+        Returns:
+            int: 本次重新发送的通知数
+        """
+        from models import AlertRule, AlertState
+        
+        now = now or datetime.utcnow()
+        session = self.db.session
+        due = AlertState.query.filter(
+            AlertState.pending_event.is_not(None),
+            AlertState.next_delivery_at <= now
+        ).order_by(AlertState.next_delivery_at).limit(limit).all()
+        if not due:
+            return 0
+        
+        claimed = []
+        for state in due:
+            if session.execute(update(AlertState).where(
+                AlertState.rule_id == state.rule_id,
+                AlertState.api_key_id == state.api_key_id,
+                AlertState.pending_event == state.pending_event,
+                AlertState.next_delivery_at == state.next_delivery_at
+            ).values(next_delivery_at=now + timedelta(seconds=Config.ALERT_DELIVERY_TIMEOUT))).rowcount == 1:
+                claimed.append((state.rule_id, state.pending_event))
+        session.commit()
+        
+        rules = {rule.id: rule for rule in AlertRule.query.filter(AlertRule.id.in_({rule_id for rule_id, _ in claimed}))}
+        for rule_id, payload in claimed:
+            rule = rules.get(rule_id)
+            if rule is not None:
+                self._deliver(rule, payload, json.loads(payload))
+        
+        logger.info(f"重新发送了 {len(claimed)} 条未送达的告警通知")
+        return len(claimed)
+    
+    def _evaluate_rule(self, rule, api_key, usage_info, forecast, state, now):
+        """
+        评估一条规则
+        
+        Returns:
+            tuple: (是否触发, 当前值, 连续失败次数或None)；本次结果无法评估该规则时返回 None
+        """
+        if rule.rule_type == 'consecutive_failures':
+            if usage_info['is_success']:
+                return False, 0, 0
+            count = (state.failure_count if state else 0) + 1
+            return count >= rule.threshold, count, count
+        
+        if not usage_info['is_success']:
+            return None
+        
+        if usage_info.get('api_key_character_count') is not None:
+            count = usage_info['api_key_character_count']
+            limit = usage_info.get('api_key_character_limit') or 0
+        else:
+            count = usage_info['character_count']
+            limit = usage_info['character_limit']
+        
+        if rule.rule_type == 'percent':
+            if limit <= 0:
+                return None
+            value = round(count / limit * 100, 2)
+            return value >= rule.threshold, value, None
+        
+        if rule.rule_type == 'remaining':
+            if limit <= 0:
+                return None
+            value = limit - count
+            return value <= rule.threshold, value, None
+        
+        if rule.rule_type == 'burn_rate':
+            if forecast is None or forecast.rate_per_hour is None:
+                return None
+            value = round(forecast.rate_per_hour, 2)
+            return value >= rule.threshold, value, None
+        
+        if rule.rule_type == 'billing_ending':
+            if api_key.billing_end_time is None:
+                return None
+            value = round((api_key.billing_end_time - now).total_seconds() / 3600, 2)
+            return value <= rule.threshold, value, None
+        
+        return None
+    
+    def _event(self, rule, api_key, status, value, now):
+        return {
+            'event': 'firing' if status == 'firing' else 'resolved',
+            'rule_id': rule.id,
+            'rule_name': rule.name,
+            'rule_type': rule.rule_type,
+            'threshold': rule.threshold,
+            'api_key_id': api_key.id,
+            'key_name': api_key.name,
+            'group_id': api_key.group_id,
+            'value': value,
+            'time': now.isoformat()
+        }
+    
+    def get_active_alerts(self):
+        """正在触发的告警"""
+        from models import AlertRule, AlertState, ApiKey
+        
+        rows = self.db.session.query(AlertState, AlertRule, ApiKey.name).join(
+            AlertRule, AlertRule.id == AlertState.rule_id
+        ).join(
+            ApiKey, ApiKey.id == AlertState.api_key_id
+        ).filter(AlertState.status == 'firing').order_by(AlertState.fired_at.desc()).all()
+        
+        return [
+            dict(state.to_dict(), rule_name=rule.name, rule_type=rule.rule_type,
+                 threshold=rule.threshold, key_name=key_name)
+            for state, rule, key_name in rows
+        ]
+    
+    def shutdown(self):
+        """停止后台发送的通知方式"""
+        for sink in list(self._sinks.values()):
+            if hasattr(sink, 'shutdown'):
+                sink.shutdown()
@@ -0,0 +1,68 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class DeliveryError(Exception):
+    """通知发送失败（已用完重试次数）"""
+
+# 通知方式的 send(rule, event) 返回 None 表示已同步送达，返回 Future 表示在后台发送
+# （成功时正常完成，失败时抛出异常）；send 本身抛出异常也视为发送失败
+
+class LogSink:
+    """写入日志"""
+    
+    def send(self, rule, event):
+        log = logger.warning if event['event'] == 'firing' else logger.info
+        log(
+            f"告警{'触发' if event['event'] == 'firing' else '恢复'}: 规则 '{rule.name}' "
+            f"API密钥 '{event['key_name']}' 值 {event['value']} 阈值 {event['threshold']}"
+        )
+
+class WebhookSink:
+    """以 JSON POST 到规则配置的 webhook_url（在后台线程中发送，失败时重试）"""
+    
+    def __init__(self, max_workers=None, timeout=None, retries=None):
+        self.timeout = timeout or Config.ALERT_WEBHOOK_TIMEOUT
+        self.retries = Config.ALERT_WEBHOOK_RETRIES if retries is None else retries
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.ALERT_WEBHOOK_WORKERS,
+            thread_name_prefix='alert-webhook'
+        )
+    
+    def send(self, rule, event):
+        if not rule.webhook_url:
+            raise DeliveryError(f"告警规则 '{rule.name}' 未配置 webhook_url")
+        return self.executor.submit(self._post, rule.webhook_url, event)
+    
+    def _post(self, url, event):
+        error = None
+        for attempt in range(1, self.retries + 2):
+            try:
+                response = requests.post(url, json=event, timeout=self.timeout)
+                if response.status_code < 400:
+                    return
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = str(e)
+            logger.error(f"告警 webhook 发送失败（第 {attempt} 次）: {error}")
+            if attempt <= self.retries:
+                time.sleep(attempt)
+        raise DeliveryError(error)
+    
+    def shutdown(self):
+        # 未发送的通知仍保存在告警状态中，由之后的进程重新发送
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+# 可用的通知方式，可通过 register_sink 扩展
+ALERT_SINKS = {
+    'log': LogSink,
+    'webhook': WebhookSink
+}
+
+def register_sink(name, sink_class):
+    """注册通知方式（需要在创建告警服务之前调用）"""
+    ALERT_SINKS[name] = sink_class
@@ -0,0 +1,271 @@
+import atexit
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+def register_ingest_listeners(ingest_writer, forecast_service=None, alert_service=None,
+                              response_cache=None, usage_stream=None):
+    """
+    注册用量写入后的回调（Web 进程和独立查询进程共用）
+    
+    预测刷新和告警评估只能在写入用量的进程中进行；
+    响应缓存和页面推送只存在于 Web 进程，其他进程的写入通过数据版本号生效。
+    """
+    # 本进程写入用量后立即使响应缓存失效（其他进程通过版本号检查失效）
+    if response_cache is not None:
+        ingest_writer.add_listener(lambda results: response_cache.invalidate())
+    # 本进程写入用量后立即推送给已连接的页面
+    if usage_stream is not None:
+        ingest_writer.add_listener(usage_stream.notify)
+    # 刷新本批密钥的用量预测
+    if forecast_service is not None:
+        ingest_writer.add_listener(forecast_service.on_usage_written)
+    # 按本批结果评估告警规则（在预测刷新之后，消耗速度规则使用最新预测）
+    if alert_service is not None:
+        ingest_writer.add_listener(alert_service.on_usage_written)
+
+class AppServices:
+    """
+    应用服务容器 - 保存在 app.extensions['monitor'] 中
+    
+    各服务在首次使用时才创建（导入和创建应用时不连接数据库、不启动线程）。
+    数据库升级、默认组和调度器等运行时初始化由 start_runtime() 显式执行一次，
+    各步骤耗时记录在 startup_timings 中。
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.startup_timings = {}  # 启动各阶段耗时（毫秒）
+        self.runtime_started = False
+        self._services = {}
+        self._lock = threading.RLock()
+    
+    def _get(self, name, factory):
+        service = self._services.get(name)
+        if service is None:
+            with self._lock:
+                service = self._services.get(name)
+                if service is None:
+                    service = factory()
+                    self._services[name] = service
+        return service
+    
+    @property
+    def deepl_service(self):
+        from services.deepl_service import DeepLService
+        return self._get('deepl_service', DeepLService)
+    
+    @property
+    def async_deepl_service(self):
+        return self._get('async_deepl_service', self._create_async_deepl_service) or None
+    
+    def _create_async_deepl_service(self):
+        if not self.app.config['ASYNC_POLLING_ENABLED']:
+            return False
+        
+        from services.async_deepl_service import AsyncDeepLService
+        if not AsyncDeepLService.is_available():
+            logger.warning("未安装aiohttp，异步轮询不可用，使用同步轮询")
+            return False
+        
+        async_deepl_service = AsyncDeepLService()
+        atexit.register(async_deepl_service.close)
+        return async_deepl_service
+    
+    @property
+    def history_service(self):
+        from models import db
+        from services.history_service import HistoryService
+        return self._get('history_service', lambda: HistoryService(db))
+    
+    @property
+    def rollup_service(self):
+        from models import db
+        from services.rollup_service import RollupService
+        return self._get('rollup_service', lambda: RollupService(db, self.history_service))
+    
+    @property
+    def response_cache(self):
+        from models import db
+        from services.response_cache import ResponseCache
+        return self._get('response_cache', lambda: ResponseCache(db))
+    
+    @property
+    def usage_stream(self):
+        from models import db
+        from services.usage_stream import UsageStreamBroker
+        return self._get('usage_stream', lambda: UsageStreamBroker(db, self.app))
+    
+    @property
+    def key_import_service(self):
+        from models import db
+        from services.key_import import KeyImportService
+        return self._get('key_import_service', lambda: KeyImportService(db, self.deepl_service))
+    
+    @property
+    def forecast_service(self):
+        from models import db
+        from services.forecast_service import ForecastService
+        return self._get('forecast_service', lambda: ForecastService(db))
+    
+    @property
+    def alert_service(self):
+        return self._get('alert_service', self._create_alert_service)
+    
+    def _create_alert_service(self):
+        from models import db
+        from services.alert_service import AlertService
+        
+        alert_service = AlertService(db, self.app)
+        atexit.register(alert_service.shutdown)
+        return alert_service
+    
+    @property
+    def check_jobs(self):
+        return self._get('check_jobs', self._create_check_jobs)
+    
+    def _create_check_jobs(self):
+        from models import db
+        from services.check_jobs import CheckJobManager
+        
+        check_jobs = CheckJobManager(db, self.app, self.scheduler_service)
+        atexit.register(check_jobs.shutdown)
+        return check_jobs
+    
+    @property
+    def scheduler(self):
+        return self._get('scheduler', self._create_scheduler)
+    
+    def _create_scheduler(self):
+        from services.scheduler_service import create_scheduler
+        return create_scheduler()
+    
+    def _create_persistent_jobstore(self):
+        """数据库任务存储（每次获得租约时新建并挂载到调度器）"""
+        from models import db
+        from services.scheduler_service import create_persistent_jobstore
+        
+        with self.app.app_context():
+            return create_persistent_jobstore(db.engine)
+    
+    @property
+    def scheduler_service(self):
+        return self._get('scheduler_service', self._create_scheduler_service)
+    
+    def _create_scheduler_service(self):
+        from models import db
+        from services.scheduler_service import SchedulerService
+        from services.leader_lease import LeaderLease
+        
+        # 多个进程不能共用同一个数据库任务存储，只有持有租约的进程挂载它
+        persistent_jobstore = None
+        if self.app.config['SCHEDULER_JOBSTORE'] == 'database':
+            persistent_jobstore = self._create_persistent_jobstore
+        
+        scheduler_service = SchedulerService(
+            self.scheduler, self.deepl_service, db,
+            async_deepl_service=self.async_deepl_service, app=self.app,
+            rollup_service=self.rollup_service,
+            leader_lease=LeaderLease(db) if self.app.config['LEADER_ELECTION_ENABLED'] else None,
+            schedule_jobs=self.app.config['EMBEDDED_SCHEDULER_ENABLED'],
+            persistent_jobstore=persistent_jobstore
+        )
+        
+        register_ingest_listeners(
+            scheduler_service.ingest_writer,
+            forecast_service=self.forecast_service,
+            alert_service=self.alert_service,
+            response_cache=self.response_cache,
+            usage_stream=self.usage_stream
+        )
+        
+        # 进程退出时依次停止查询执行器（取消排队中的查询）、写完剩余结果、
+        # 释放调度器租约，最后释放DeepL连接池
+        atexit.register(self.deepl_service.close)
+        atexit.register(scheduler_service.release_leadership)
+        atexit.register(scheduler_service.ingest_writer.stop)
+        atexit.register(lambda: scheduler_service.poll_executor.shutdown(wait=False))
+        return scheduler_service
+    
+    def _timed(self, name, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.startup_timings[name] = round((time.perf_counter() - started) * 1000, 2)
+        return result
+    
+    def start_runtime(self):
+        """
+        运行时初始化（每个进程执行一次）
+        
+        - 升级数据库结构（AUTO_UPGRADE_DB）
+        - 创建默认组
+        - 启动内置调度器并设置组任务、汇总任务和租约（EMBEDDED_SCHEDULER_ENABLED）
+        """
+        with self._lock:
+            if self.runtime_started:
+                return
+            self.runtime_started = True
+            
+            started = time.perf_counter()
+            with self.app.app_context():
+                if self.app.config['AUTO_UPGRADE_DB']:
+                    from models import db
+                    from migrations import upgrade_database
+                    self._timed('upgrade_database', upgrade_database, db)
+                
+                self._timed('seed_default_group', self._seed_default_group)
+                
+                if self.app.config['EMBEDDED_SCHEDULER_ENABLED']:
+                    self._timed('scheduler_start', self._start_scheduler)
+                    self._timed('schedule_jobs', self._schedule_jobs)
+            
+            self.startup_timings['runtime_total'] = round((time.perf_counter() - started) * 1000, 2)
+            logger.info(f"运行时初始化完成: {self.startup_timings}")
+    
+    def warn_if_runtime_idle(self, seconds):
+        """seconds 秒后运行时仍未初始化（内置调度器未启动、没有在查询）时输出警告"""
+        def check():
+            if not self.runtime_started and self.app.config['EMBEDDED_SCHEDULER_ENABLED']:
+                logger.warning(
+                    f"启动 {seconds} 秒后仍没有请求，运行时未初始化，定时查询没有运行。"
+                    f"生产环境请使用 wsgi:app（或 create_app(start_runtime=True)）"
+                )
+        
+        timer = threading.Timer(seconds, check)
+        timer.daemon = True
+        timer.start()
+    
+    def _seed_default_group(self):
+        """如果没有任何组，创建默认组"""
+        from models import db, ApiGroup, DataVersion
+        
+        if not ApiGroup.query.first():
+            default_group = ApiGroup(
+                name='默认组',
+                query_interval=self.app.config['DEFAULT_QUERY_INTERVAL'],
+                is_active=True
+            )
+            db.session.add(default_group)
+            DataVersion.bump('config')
+            db.session.commit()
+    
+    def _start_scheduler(self):
+        # 先创建调度器服务，使持久化任务存储中的任务函数可以找到它
+        self.scheduler_service
+        self.scheduler.start()
+        
+        # 确保应用关闭时先停止调度器
+        atexit.register(lambda: self.scheduler.shutdown(wait=False))
+    
+    def _schedule_jobs(self):
+        # 按数据库中的组设置定时任务（持久化任务存储中间隔未变的任务保持原运行时间）
+        self.scheduler_service.sync_group_schedulers()
+        
+        # 用量汇总与数据清理任务
+        self.scheduler_service.setup_compaction_scheduler()
+        
+        # 多进程部署时只有持有租约的进程运行上面的定时任务
+        # （使用数据库任务存储时，获得租约后才挂载任务存储并设置上面的任务）
+        self.scheduler_service.setup_leader_election()
@@ -0,0 +1,204 @@
+import asyncio
+import logging
+import threading
+import time
+from config import Config
+from services.deepl_service import DeepLService
+from services.resilience import ERROR_UNAVAILABLE, parse_retry_after
+
+try:
+    import aiohttp
+except ImportError:  # 未安装aiohttp时退回同步轮询
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+class AsyncDeepLService(DeepLService):
+    """
+    基于asyncio的DeepL API服务类，用于批量并发查询用量
+    
+    所有查询在同一个后台事件循环中执行，共用一个 ClientSession 和一个信号量，
+    因此无论多少个查询任务同时运行，整个进程同时进行的请求数都不超过 max_concurrency。
+    """
+    
+    def __init__(self, max_concurrency=None):
+        super().__init__()
+        self.max_concurrency = max_concurrency or Config.ASYNC_MAX_CONCURRENCY
+        self._loop = None
+        self._loop_thread = None
+        self._session = None
+        self._semaphore = None
+        self._loop_lock = threading.Lock()
+    
+    @staticmethod
+    def is_available():
+        """是否安装了异步HTTP客户端"""
+        return aiohttp is not None
+    
+    def poll_many(self, api_keys):
+        """同步入口：在共享的事件循环中并发查询一批密钥，阻塞到全部得到最终结果（含重试）"""
+        return asyncio.run_coroutine_threadsafe(self.get_usage_many(api_keys), self._get_loop()).result()
+    
+    def poll_attempts(self, api_keys, attempt=1):
+        """查询执行器入口：在共享的事件循环中并发查询一批密钥，阻塞到本批完成（不等待重试）"""
+        future = asyncio.run_coroutine_threadsafe(self.try_get_usage_many(api_keys, attempt), self._get_loop())
+        return future.result()
+    
+    async def _in_shared_loop(self, coroutine):
+        """在共享的事件循环中执行（从其他事件循环调用时转交过去，请求数仍受同一个上限约束）"""
+        loop = self._get_loop()
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+    
+    def _get_loop(self):
+        """首次使用时启动后台事件循环线程"""
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, name='deepl-async', daemon=True)
+                self._loop_thread.start()
+            return self._loop
+    
+    def _get_session(self):
+        """共享的会话和信号量（只在事件循环线程中调用）"""
+        if self._session is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency)
+            )
+        return self._session, self._semaphore
+    
+    def close(self):
+        """关闭同步和异步会话，停止事件循环"""
+        super().close()
+        
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is None:
+            return
+        
+        async def close_session():
+            if self._session is not None:
+                await self._session.close()
+                self._session = self._semaphore = None
+        
+        try:
+            asyncio.run_coroutine_threadsafe(close_session(), loop).result(timeout=self.timeout)
+        except Exception as e:
+            logger.warning(f"关闭异步会话失败: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout=self.timeout)
+        loop.close()
+    
+    async def get_usage_many(self, api_keys):
+        """
+        并发获取多个API密钥的用量信息
+        
+        重试和熔断规则与 get_usage 相同，重试等待在事件循环中进行，不占用线程
+        
+        Args:
+            api_keys (list[str]): DeepL API密钥列表
+        
+        Returns:
+            list[dict]: 与输入顺序一致的用量信息列表（重试结束后的最终结果）
+        """
+        if not api_keys:
+            return []
+        return await self._in_shared_loop(self._get_usage_many(api_keys))
+    
+    async def _get_usage_many(self, api_keys):
+        session, semaphore = self._get_session()
+        tasks = [self._get_usage_async(session, semaphore, api_key) for api_key in api_keys]
+        return await asyncio.gather(*tasks)
+    
+    async def _get_usage_async(self, session, semaphore, api_key):
+        """查询单个API密钥的用量，需要重试时等待后再次查询（异步版 get_usage）"""
+        attempt = 0
+        while True:
+            attempt += 1
+            usage_info, delay = await self._try_get_usage_async(session, semaphore, api_key, attempt)
+            if delay is None:
+                return usage_info
+            await asyncio.sleep(delay)
+    
+    async def try_get_usage_many(self, api_keys, attempt=1):
+        """
+        并发发送一批API密钥的第 attempt 次查询
+        
+        与 get_usage_many 相同，但不等待重试，返回每个密钥的重试等待时间。
+        查询执行器用它把重试放回队列。
+        
+        Args:
+            api_keys (list[str]): DeepL API密钥列表
+            attempt (int): 第几次查询（决定是否还能重试）
+        
+        Returns:
+            list[tuple]: 与输入顺序一致的 (用量信息, 重试等待秒数或None)
+        """
+        if not api_keys:
+            return []
+        return await self._in_shared_loop(self._try_get_usage_many(api_keys, attempt))
+    
+    async def _try_get_usage_many(self, api_keys, attempt):
+        session, semaphore = self._get_session()
+        tasks = [self._try_get_usage_async(session, semaphore, api_key, attempt) for api_key in api_keys]
+        return await asyncio.gather(*tasks)
+    
+    async def _try_get_usage_async(self, session, semaphore, api_key, attempt):
+        """查询单个API密钥的用量（异步版 try_get_usage，重试和熔断规则相同）"""
+        is_free, url, headers = self._build_request(api_key)
+        base_url = self.free_base_url if is_free else self.pro_base_url
+        breaker = self.circuit_breakers[base_url]
+        
+        if not breaker.allow():
+            return self._circuit_open_result(base_url, is_free), None
+        
+        async with semaphore:
+            usage_info, retry_after = await self._request_usage_async(session, base_url, url, headers, is_free, api_key)
+        self._record_attempt(breaker, usage_info, is_free)
+        return usage_info, self._schedule_retry(usage_info, attempt, retry_after, api_key, is_free)
+    
+    async def _request_usage_async(self, session, base_url, url, headers, is_free, api_key):
+        """发送一次 /usage 请求，返回 (usage_info, Retry-After秒数)"""
+        started = None
+        try:
+            await self.rate_limiters[base_url].acquire()
+            
+            logger.info(f"查询API用量: {api_key[:10]}...{api_key[-4:]} ({'Free' if is_free else 'Pro'})")
+            
+            started = time.perf_counter()
+            async with session.get(url, headers=headers) as response:
+                self._observe_request(is_free, response.status, started)
+                if response.status == 200:
+                    return self._parse_usage(await response.json(content_type=None), is_free), None
+                
+                text = await response.text()
+                error_data = None
+                if text:
+                    try:
+                        error_data = await response.json(content_type=None)
+                    except:
+                        pass
+                return (
+                    self._http_error_result(response.status, text, error_data),
+                    parse_retry_after(response.headers.get('Retry-After'))
+                )
+                
+        except asyncio.TimeoutError:
+            self._observe_request(is_free, 'timeout', started)
+            logger.error(f"查询超时: {api_key[:10]}...{api_key[-4:]}")
+            return self._error_result("请求超时", ERROR_UNAVAILABLE), None
+            
+        except aiohttp.ClientError as e:
+            self._observe_request(is_free, 'network', started)
+            error_msg = f"网络请求错误: {str(e)}"
+            logger.error(f"网络错误: {error_msg}")
+            return self._error_result(error_msg, ERROR_UNAVAILABLE), None
+            
+        except Exception as e:
+            error_msg = f"未知错误: {str(e)}"
+            logger.error(f"未知错误: {error_msg}")
+            return self._error_result(error_msg), None
@@ -0,0 +1,221 @@
+import threading
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from config import Config
+from services.leader_lease import make_holder_id
+
+logger = logging.getLogger(__name__)
+
+class JobProgress:
+    """检查任务的进度计数，按间隔写入数据库（使用独立连接，不影响查询线程的会话）"""
+    
+    def __init__(self, db, job_id, flush_interval=None):
+        self.db = db
+        self.job_id = job_id
+        self.flush_interval = flush_interval or Config.CHECK_JOB_FLUSH_INTERVAL
+        self.total = 0
+        self.completed = 0
+        self.failed = 0
+        self._flushed_at = 0.0
+        self._lock = threading.Lock()
+    
+    def add_total(self, count):
+        with self._lock:
+            self.total += count
+        self.flush()
+    
+    def advance(self, count, failed=0):
+        with self._lock:
+            self.completed += count
+            self.failed += failed
+        if time.monotonic() - self._flushed_at >= self.flush_interval:
+            self.flush()
+    
+    def flush(self, **values):
+        """写入当前进度（及其他字段）；任务已结束（如被标记为中断）时不再更新"""
+        from models import CheckJob
+        
+        with self._lock:
+            values.update(total=self.total, completed=self.completed, failed=self.failed)
+        values['updated_at'] = datetime.utcnow()
+        with self.db.engine.begin() as connection:
+            connection.execute(update(CheckJob).where(
+                CheckJob.id == self.job_id,
+                CheckJob.active_target.is_not(None)
+            ).values(**values))
+        self._flushed_at = time.monotonic()
+
+class CheckJobManager:
+    """
+    立即检查任务管理 - 请求立即返回任务ID，查询在后台线程池中执行
+    
+    同一目标（某个组、某个密钥或全部组）已有未完成的任务时，新的请求合并到该任务。
+    批量导入后的首次查询每批是一个独立的任务。
+    任务和进度保存在 check_jobs 表中，多个进程共享。
+    未结束的任务在 active_target 列上有唯一索引，多个进程同时提交时只有一个能创建任务。
+    本进程排队和执行中的任务定期写入心跳。
+    超过 CHECK_JOB_STALE_SECONDS 未更新的任务视为已中断，标记为失败后由新的请求重新创建。
+    """
+    
+    def __init__(self, db, app, scheduler_service, max_workers=None):
+        self.db = db
+        self.app = app
+        self.scheduler_service = scheduler_service
+        self.holder = make_holder_id()
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or Config.CHECK_JOB_WORKERS,
+            thread_name_prefix='check-job'
+        )
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+        self._stopping = threading.Event()
+    
+    def submit(self, target, key_ids=None):
+        """
+        提交检查任务（需要应用上下文）
+        
+        Args:
+            target (str): group:<id> / key:<id> / all / import:<批次ID>
+            key_ids (list[int]): import 任务要查询的密钥ID
+        
+        Returns:
+            tuple: (任务字典, 是否合并到已有任务)
+        """
+        from models import CheckJob
+        
+        with self._lock:
+            # 创建失败说明其他进程同时创建了任务，重新查找并合并
+            for _ in range(3):
+                job = self._find_active(target)
+                if job is not None and self._abandon_if_stale(job):
+                    continue
+                if job is not None:
+                    self.db.session.execute(
+                        update(CheckJob).where(CheckJob.id == job.id).values(coalesced=CheckJob.coalesced + 1)
+                    )
+                    self.db.session.commit()
+                    self.db.session.refresh(job)
+                    return job.to_dict(), True
+                
+                self._purge_finished()
+                job = CheckJob(id=uuid.uuid4().hex, target=target, active_target=target, status='queued', holder=self.holder)
+                self.db.session.add(job)
+                try:
+                    self.db.session.commit()
+                except IntegrityError:
+                    self.db.session.rollback()
+                    continue
+                
+                self._start_heartbeat()
+                self.executor.submit(self._run, job.id, target, key_ids)
+                return job.to_dict(), False
+        
+        raise RuntimeError('提交检查任务失败，请稍后重试')
+    
+    def get(self, job_id):
+        """获取任务状态，不存在时返回 None"""
+        from models import CheckJob
+        
+        job = self.db.session.get(CheckJob, job_id)
+        return job.to_dict() if job else None
+    
+    def get_recent(self, limit=20):
+        """最近的任务（按创建时间倒序）"""
+        from models import CheckJob
+        
+        jobs = CheckJob.query.order_by(CheckJob.created_at.desc()).limit(limit).all()
+        return [job.to_dict() for job in jobs]
+    
+    def _find_active(self, target):
+        from models import CheckJob
+        
+        return CheckJob.query.filter(CheckJob.active_target == target).first()
+    
+    def _abandon_if_stale(self, job):
+        """
+        执行进程已中断（超时未更新）的任务标记为失败并释放目标
+        
+        Returns:
+            bool: 任务已超时、需要重新查找（标记前刚更新过或已被其他进程释放时也返回 True）
+        """
+        from models import CheckJob
+        
+        stale_before = datetime.utcnow() - timedelta(seconds=Config.CHECK_JOB_STALE_SECONDS)
+        if job.updated_at >= stale_before:
+            return False
+        
+        abandoned = self.db.session.execute(
+            update(CheckJob).where(CheckJob.id == job.id, CheckJob.updated_at < stale_before).values(
+                status='failed', error='执行任务的进程已中断', active_target=None, finished_at=datetime.utcnow()
+            )
+        ).rowcount
+        self.db.session.commit()
+        if abandoned:
+            logger.warning(f"检查任务 {job.id}（{job.target}）超过 {Config.CHECK_JOB_STALE_SECONDS} 秒未更新，标记为失败")
+        return True
+    
+    def _start_heartbeat(self):
+        """启动心跳线程（首次提交任务时）"""
+        if self._heartbeat_thread is None or not self._heartbeat_thread.is_alive():
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat, name='check-job-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+    
+    def _heartbeat(self):
+        """定期刷新本进程排队和执行中的任务的更新时间，避免排队较久的任务被视为已中断"""
+        from models import CheckJob
+        
+        while not self._stopping.wait(Config.CHECK_JOB_HEARTBEAT_INTERVAL):
+            try:
+                with self.app.app_context():
+                    with self.db.engine.begin() as connection:
+                        connection.execute(update(CheckJob).where(
+                            CheckJob.holder == self.holder,
+                            CheckJob.active_target.is_not(None)
+                        ).values(updated_at=datetime.utcnow()))
+            except Exception as e:
+                logger.error(f"更新检查任务心跳失败: {e}")
+    
+    def _purge_finished(self):
+        """删除超过保留时间的已结束任务"""
+        from models import CheckJob
+        
+        cutoff = datetime.utcnow() - timedelta(seconds=Config.CHECK_JOB_RETENTION)
+        CheckJob.query.filter(
+            CheckJob.status.notin_(CheckJob.ACTIVE_STATUSES),
+            CheckJob.created_at < cutoff
+        ).delete(synchronize_session=False)
+    
+    def _run(self, job_id, target, key_ids=None):
+        """在后台线程中执行检查，等待结果写入数据库后结束"""
+        with self.app.app_context():
+            progress = JobProgress(self.db, job_id)
+            try:
+                progress.flush(status='running', started_at=datetime.utcnow())
+                
+                kind, _, target_id = target.partition(':')
+                if kind == 'group':
+                    self.scheduler_service.check_group_usage(int(target_id), wait=True, progress=progress)
+                elif kind == 'key':
+                    self.scheduler_service.check_keys_now([int(target_id)], wait=True, progress=progress)
+                elif kind == 'import':
+                    self.scheduler_service.check_keys_now(key_ids, wait=True, progress=progress)
+                else:
+                    self.scheduler_service.check_all_groups_now(wait=True, progress=progress)
+                
+                progress.flush(status='succeeded', active_target=None, finished_at=datetime.utcnow())
+            except Exception as e:
+                logger.error(f"检查任务 {job_id}（{target}）失败: {e}")
+                try:
+                    progress.flush(status='failed', error=str(e), active_target=None, finished_at=datetime.utcnow())
+                except Exception as flush_error:
+                    logger.error(f"更新检查任务 {job_id} 状态失败: {flush_error}")
+    
+    def shutdown(self):
+        """取消尚未开始的任务（停止心跳后，这些任务超时后由其他进程的请求重新创建）"""
+        self._stopping.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
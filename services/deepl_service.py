@@ -1,10 +1,58 @@
+import asyncio
 import requests
+import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
 from datetime import datetime
 from config import Config
+from services.metrics import DEEPL_ERRORS, DEEPL_REQUEST_SECONDS, DEEPL_RETRIES
+from services.resilience import (
+    CircuitBreaker, ERROR_CIRCUIT_OPEN, ERROR_OTHER, ERROR_UNAVAILABLE, RETRYABLE_ERRORS,
+    classify_status, parse_retry_after, retry_delay
+)
 import logging
 
 logger = logging.getLogger(__name__)
 
+class TokenBucket:
+    """
+    令牌桶限速器
+    
+    状态由线程锁保护，可以被多个工作线程共享；
+    同步调用通过 wait() 阻塞等待，异步调用通过 acquire() 在事件循环中等待。
+    """
+    
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)          # 每秒补充的令牌数
+        self.capacity = float(capacity)  # 桶容量（允许的突发请求数）
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def _reserve(self):
+        """预留一个令牌，返回需要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            return -self.tokens / self.rate
+    
+    def wait(self):
+        """获取一个令牌，不足时阻塞当前线程"""
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+    
+    async def acquire(self):
+        """获取一个令牌，不足时异步等待"""
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
 class DeepLService:
     """DeepL API服务类"""
     
@@ -12,108 +60,243 @@ class DeepLService:
         self.free_base_url = Config.DEEPL_FREE_BASE_URL
         self.pro_base_url = Config.DEEPL_PRO_BASE_URL
         self.timeout = Config.REQUEST_TIMEOUT
+        
+        # 每个基础URL一个长连接会话，复用TCP/TLS连接
+        self.pool_size = Config.MAX_CONCURRENT_GROUPS
+        self._sessions = {}
+        self._sessions_lock = threading.Lock()
+        
+        # 每个基础URL（Free / Pro）一个令牌桶，多个工作线程并发查询时共享
+        self.rate_limiters = {
+            self.free_base_url: TokenBucket(Config.DEEPL_FREE_RATE_LIMIT, Config.DEEPL_RATE_LIMIT_BURST),
+            self.pro_base_url: TokenBucket(Config.DEEPL_PRO_RATE_LIMIT, Config.DEEPL_RATE_LIMIT_BURST)
+        }
+        
+        # 每个基础URL一个熔断器，服务端持续不可用时暂停查询
+        self.circuit_breakers = {
+            self.free_base_url: CircuitBreaker('free'),
+            self.pro_base_url: CircuitBreaker('pro')
+        }
+    
+    def _get_session(self, base_url):
+        """获取指定基础URL的连接池会话（线程安全，按需创建）"""
+        session = self._sessions.get(base_url)
+        if session is not None:
+            return session
+        
+        with self._sessions_lock:
+            session = self._sessions.get(base_url)
+            if session is None:
+                session = requests.Session()
+                # 每次请求都携带自己的认证头，不保存Cookie，避免线程间共享可变状态
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[base_url] = session
+            return session
+    
+    def get_breaker_stats(self):
+        """各基础URL的熔断器状态"""
+        return {breaker.name: breaker.get_stats() for breaker in self.circuit_breakers.values()}
+    
+    def close(self):
+        """关闭所有连接池会话"""
+        with self._sessions_lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        
+        for session in sessions:
+            session.close()
     
     def get_usage(self, api_key):
         """
         获取API密钥的用量信息
         
+        429、5xx、超时和网络错误按退避时间重试（429 优先使用 Retry-After），
+        基础URL的熔断器打开时不发送请求，直接返回 error_kind 为 circuit_open 的结果
+        
         Args:
             api_key (str): DeepL API密钥
-            
+        
         Returns:
-            dict: 用量信息，包含成功状态和数据或错误信息
+            dict: 用量信息，包含成功状态和数据或错误信息（失败时 error_kind 为失败类型）
         """
+        attempt = 0
+        while True:
+            attempt += 1
+            usage_info, delay = self.try_get_usage(api_key, attempt)
+            if delay is None:
+                return usage_info
+            time.sleep(delay)
+    
+    def try_get_usage(self, api_key, attempt=1):
+        """
+        发送第 attempt 次查询，不在当前线程中等待重试
+        
+        Returns:
+            tuple: (用量信息, 重试前需要等待的秒数；不需要重试时为 None)
+        """
+        is_free, url, headers = self._build_request(api_key)
+        base_url = self.free_base_url if is_free else self.pro_base_url
+        breaker = self.circuit_breakers[base_url]
+        
+        if not breaker.allow():
+            return self._circuit_open_result(base_url, is_free), None
+        
+        usage_info, retry_after = self._request_usage(base_url, url, headers, is_free, api_key)
+        self._record_attempt(breaker, usage_info, is_free)
+        return usage_info, self._schedule_retry(usage_info, attempt, retry_after, api_key, is_free)
+    
+    def poll_attempts(self, api_keys, attempt=1):
+        """查询执行器入口：依次查询一批密钥，返回 [(用量信息, 重试等待秒数或None)]"""
+        return [self.try_get_usage(api_key, attempt) for api_key in api_keys]
+    
+    def _request_usage(self, base_url, url, headers, is_free, api_key):
+        """发送一次 /usage 请求，返回 (usage_info, Retry-After秒数)"""
+        started = None
         try:
-            # 确定API类型和基础URL
-            is_free = api_key.endswith(':fx')
-            base_url = self.free_base_url if is_free else self.pro_base_url
-            
-            # 构建请求
-            url = f"{base_url}/usage"
-            headers = {
-                'Authorization': f'DeepL-Auth-Key {api_key}',
-                'Content-Type': 'application/json'
-            }
+            session = self._get_session(base_url)
+            self.rate_limiters[base_url].wait()
             
             logger.info(f"查询API用量: {api_key[:10]}...{api_key[-4:]} ({'Free' if is_free else 'Pro'})")
             
-            # 发送请求
-            response = requests.get(url, headers=headers, timeout=self.timeout)
+            # 发送请求（复用连接池中的长连接），耗时不含限速等待
+            started = time.perf_counter()
+            response = session.get(url, headers=headers, timeout=self.timeout)
+            self._observe_request(is_free, response.status_code, started)
             
             if response.status_code == 200:
-                data = response.json()
-                
-                # 解析响应数据
-                usage_info = {
-                    'is_success': True,
-                    'character_count': data.get('character_count', 0),
-                    'character_limit': data.get('character_limit', 0),
-                    'api_type': 'free' if is_free else 'pro',
-                    'check_time': datetime.utcnow()
-                }
-                
-                # Pro API特有字段
-                if not is_free:
-                    usage_info.update({
-                        'api_key_character_count': data.get('api_key_character_count'),
-                        'api_key_character_limit': data.get('api_key_character_limit'),
-                        'start_time': self._parse_datetime(data.get('start_time')),
-                        'end_time': self._parse_datetime(data.get('end_time'))
-                    })
-                
-                logger.info(f"查询成功: {usage_info['character_count']}/{usage_info['character_limit']}")
-                return usage_info
-                
-            else:
-                error_msg = f"API请求失败: HTTP {response.status_code}"
-                if response.text:
-                    try:
-                        error_data = response.json()
-                        error_msg += f" - {error_data.get('message', response.text)}"
-                    except:
-                        error_msg += f" - {response.text}"
-                
-                logger.error(f"查询失败: {error_msg}")
-                return {
-                    'is_success': False,
-                    'error_message': error_msg,
-                    'character_count': 0,
-                    'character_limit': 0,
-                    'check_time': datetime.utcnow()
-                }
-                
+                return self._parse_usage(response.json(), is_free), None
+            
+            error_data = None
+            if response.text:
+                try:
+                    error_data = response.json()
+                except:
+                    pass
+            return (
+                self._http_error_result(response.status_code, response.text, error_data),
+                parse_retry_after(response.headers.get('Retry-After'))
+            )
+        
         except requests.exceptions.Timeout:
-            error_msg = "请求超时"
+            self._observe_request(is_free, 'timeout', started)
             logger.error(f"查询超时: {api_key[:10]}...{api_key[-4:]}")
-            return {
-                'is_success': False,
-                'error_message': error_msg,
-                'character_count': 0,
-                'character_limit': 0,
-                'check_time': datetime.utcnow()
-            }
-            
+            return self._error_result("请求超时", ERROR_UNAVAILABLE), None
+        
         except requests.exceptions.RequestException as e:
+            self._observe_request(is_free, 'network', started)
             error_msg = f"网络请求错误: {str(e)}"
             logger.error(f"网络错误: {error_msg}")
-            return {
-                'is_success': False,
-                'error_message': error_msg,
-                'character_count': 0,
-                'character_limit': 0,
-                'check_time': datetime.utcnow()
-            }
-            
+            return self._error_result(error_msg, ERROR_UNAVAILABLE), None
+        
         except Exception as e:
             error_msg = f"未知错误: {str(e)}"
             logger.error(f"未知错误: {error_msg}")
-            return {
-                'is_success': False,
-                'error_message': error_msg,
-                'character_count': 0,
-                'character_limit': 0,
-                'check_time': datetime.utcnow()
-            }
+            return self._error_result(error_msg), None
+    
+    def _api_type(self, is_free):
+        return 'free' if is_free else 'pro'
+    
+    def _observe_request(self, is_free, status, started):
+        """记录一次请求的耗时（请求未发出时不记录）"""
+        if started is not None:
+            DEEPL_REQUEST_SECONDS.observe(time.perf_counter() - started, api_type=self._api_type(is_free), status=status)
+    
+    def _record_attempt(self, breaker, usage_info, is_free):
+        """按一次请求的结果更新熔断器和失败计数"""
+        breaker.record_result(usage_info)
+        if not usage_info['is_success']:
+            DEEPL_ERRORS.inc(api_type=self._api_type(is_free), kind=usage_info['error_kind'])
+    
+    def _schedule_retry(self, usage_info, attempt, retry_after, api_key, is_free):
+        """计算重试等待时间并记录重试，不重试时返回 None"""
+        delay = self._retry_delay(usage_info, attempt, retry_after)
+        if delay is not None:
+            logger.warning(f"{delay:.1f} 秒后重试: {api_key[:10]}...{api_key[-4:]}（第 {attempt} 次失败）")
+            DEEPL_RETRIES.inc(api_type=self._api_type(is_free))
+        return delay
+    
+    def _retry_delay(self, usage_info, attempt, retry_after):
+        """
+        第 attempt 次请求失败后是否重试
+        
+        Returns:
+            float: 重试前等待的秒数，不重试时返回 None（成功、不可重试的错误、超过重试次数，
+                   或 Retry-After 超过 DEEPL_RETRY_MAX_DELAY）
+        """
+        if usage_info['is_success'] or usage_info.get('error_kind') not in RETRYABLE_ERRORS:
+            return None
+        if attempt > Config.DEEPL_MAX_RETRIES:
+            return None
+        
+        delay = retry_delay(attempt, retry_after)
+        if delay > Config.DEEPL_RETRY_MAX_DELAY:
+            return None
+        return delay
+    
+    def _build_request(self, api_key):
+        """根据密钥类型构建请求，返回 (is_free, url, headers)"""
+        is_free = api_key.endswith(':fx')
+        base_url = self.free_base_url if is_free else self.pro_base_url
+        
+        url = f"{base_url}/usage"
+        headers = {
+            'Authorization': f'DeepL-Auth-Key {api_key}',
+            'Content-Type': 'application/json'
+        }
+        return is_free, url, headers
+    
+    def _parse_usage(self, data, is_free):
+        """解析 /usage 的成功响应"""
+        usage_info = {
+            'is_success': True,
+            'character_count': data.get('character_count', 0),
+            'character_limit': data.get('character_limit', 0),
+            'api_type': 'free' if is_free else 'pro',
+            'check_time': datetime.utcnow()
+        }
+        
+        # Pro API特有字段
+        if not is_free:
+            usage_info.update({
+                'api_key_character_count': data.get('api_key_character_count'),
+                'api_key_character_limit': data.get('api_key_character_limit'),
+                'start_time': self._parse_datetime(data.get('start_time')),
+                'end_time': self._parse_datetime(data.get('end_time'))
+            })
+        
+        logger.info(f"查询成功: {usage_info['character_count']}/{usage_info['character_limit']}")
+        return usage_info
+    
+    def _http_error_result(self, status_code, text, error_data=None):
+        """将非200响应转换为失败结果（按状态码标记失败类型）"""
+        error_msg = f"API请求失败: HTTP {status_code}"
+        if text:
+            if isinstance(error_data, dict):
+                error_msg += f" - {error_data.get('message', text)}"
+            else:
+                error_msg += f" - {text}"
+        
+        logger.error(f"查询失败: {error_msg}")
+        return self._error_result(error_msg, classify_status(status_code))
+    
+    def _circuit_open_result(self, base_url, is_free):
+        """熔断中未发送请求的结果（不写入用量记录）"""
+        DEEPL_ERRORS.inc(api_type=self._api_type(is_free), kind=ERROR_CIRCUIT_OPEN)
+        return self._error_result(f"{base_url} 连续请求失败，暂停查询", ERROR_CIRCUIT_OPEN)
+    
+    def _error_result(self, error_msg, error_kind=ERROR_OTHER):
+        """构建失败结果"""
+        return {
+            'is_success': False,
+            'error_message': error_msg,
+            'error_kind': error_kind,
+            'character_count': 0,
+            'character_limit': 0,
+            'check_time': datetime.utcnow()
+        }
     
     def _parse_datetime(self, datetime_str):
         """解析ISO 8601格式的时间字符串"""
@@ -135,7 +318,7 @@ class DeepLService:
         
         Args:
             api_key (str): API密钥
-            
+        
         Returns:
             dict: 验证结果
         """
@@ -162,4 +345,3 @@ class DeepLService:
             'api_type': api_type,
             'api_key': api_key
         }
-
@@ -0,0 +1,254 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import case, func, or_, select, union_all
+from config import Config
+from services.history_service import raw_sources
+
+logger = logging.getLogger(__name__)
+
+_EPOCH = datetime(1970, 1, 1)
+
+def epoch_hours_expression(column, dialect_name):
+    """时间列距 1970-01-01 的小时数（SQL表达式）"""
+    if dialect_name == 'sqlite':
+        return (func.julianday(column) - 2440587.5) * 24
+    if dialect_name == 'postgresql':
+        return func.extract('epoch', column) / 3600.0
+    raise ValueError(f'不支持的数据库: {dialect_name}')
+
+def epoch_hours(value):
+    return (value - _EPOCH).total_seconds() / 3600
+
+class ForecastService:
+    """
+    用量预测服务 - 预测各密钥额度用尽的时间
+    
+    对每个密钥最近 FORECAST_WINDOW_HOURS 小时（且在当前计费周期内）的用量采样做最小二乘直线拟合，
+    斜率即每小时的消耗速度。拟合所需的 n、Σx、Σy、Σxy、Σx² 由数据库一次聚合查询
+    按密钥算出，不把历史记录加载到进程中；结果保存在 usage_forecasts 表，
+    接口直接读取该表排序，不再扫描历史。写入用量后只刷新本批涉及的密钥。
+    """
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def refresh(self, key_ids=None, now=None):
+        """
+        重新计算预测并保存（需要应用上下文，已提交）
+        
+        Args:
+            key_ids (iterable): 只刷新这些密钥，默认刷新全部启用的密钥
+        
+        Returns:
+            int: 刷新的密钥数
+        """
+        from models import ApiKey, UsageForecast
+        
+        now = now or datetime.utcnow()
+        session = self.db.session
+        
+        keys_query = session.query(ApiKey.id).filter(ApiKey.is_active == True)
+        if key_ids is not None:
+            key_ids = list(key_ids)
+            if not key_ids:
+                return 0
+            keys_query = keys_query.filter(ApiKey.id.in_(key_ids))
+        keys = [key_id for (key_id,) in keys_query.all()]
+        if not keys:
+            return 0
+        
+        stats = {}
+        batch_size = Config.FORECAST_BATCH_SIZE
+        for start in range(0, len(keys), batch_size):
+            stats.update(self._fit_stats(keys[start:start + batch_size], now))
+        
+        try:
+            for start in range(0, len(keys), batch_size):
+                chunk = keys[start:start + batch_size]
+                session.query(UsageForecast).filter(
+                    UsageForecast.api_key_id.in_(chunk)
+                ).delete(synchronize_session=False)
+                session.execute(self.db.insert(UsageForecast), [
+                    self._forecast(key_id, stats.get(key_id), now) for key_id in chunk
+                ])
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        
+        return len(keys)
+    
+    def _fit_stats(self, key_ids, now):
+        """
+        按密钥聚合拟合所需的统计量
+        
+        只使用当前计费周期的采样：有计费周期开始时间的密钥（Pro）从该时间起，
+        并且只取最近一次用量下降（周期重置，Free API 没有计费周期时间）之后的采样
+        
+        Returns:
+            dict: {api_key_id: row}，row 包含 n, sum_x, sum_y, sum_xy, sum_xx, current_value, limit_value, last_time
+        """
+        from models import ApiKey, UsageRecord
+        
+        dialect_name = self.db.engine.dialect.name
+        window_start = now - timedelta(hours=Config.FORECAST_WINDOW_HOURS)
+        
+        sources = raw_sources(UsageRecord.api_key_id.in_(key_ids), since=window_start)
+        samples = (sources[0] if len(sources) == 1 else union_all(*sources)).subquery()
+        
+        # 各密钥窗口内最近一次用量下降的时间
+        lagged = select(
+            samples.c.api_key_id,
+            samples.c.first_time,
+            samples.c.first_value,
+            func.lag(samples.c.first_value).over(
+                partition_by=samples.c.api_key_id,
+                order_by=samples.c.first_time
+            ).label('previous_value')
+        ).subquery()
+        resets = select(
+            lagged.c.api_key_id,
+            func.max(lagged.c.first_time).label('reset_time')
+        ).where(lagged.c.first_value < lagged.c.previous_value).group_by(lagged.c.api_key_id).subquery()
+        
+        period = select(
+            samples,
+            func.row_number().over(
+                partition_by=samples.c.api_key_id,
+                order_by=samples.c.first_time.desc()
+            ).label('rank_desc')
+        ).join(
+            ApiKey, ApiKey.id == samples.c.api_key_id
+        ).outerjoin(
+            resets, resets.c.api_key_id == samples.c.api_key_id
+        ).where(
+            or_(ApiKey.billing_start_time.is_(None), samples.c.first_time >= ApiKey.billing_start_time),
+            or_(resets.c.reset_time.is_(None), samples.c.first_time >= resets.c.reset_time)
+        ).subquery()
+        
+        # x 以窗口起点为原点（小时），数值较小，减少平方和的精度损失
+        x = epoch_hours_expression(period.c.first_time, dialect_name) - epoch_hours(window_start)
+        y = period.c.first_value
+        
+        query = select(
+            period.c.api_key_id,
+            func.count().label('n'),
+            func.sum(x).label('sum_x'),
+            func.sum(y).label('sum_y'),
+            func.sum(x * y).label('sum_xy'),
+            func.sum(x * x).label('sum_xx'),
+            func.max(case((period.c.rank_desc == 1, y))).label('current_value'),
+            func.max(case((period.c.rank_desc == 1, period.c.limit_value))).label('limit_value'),
+            func.max(period.c.first_time).label('last_time')
+        ).group_by(period.c.api_key_id)
+        
+        return {row.api_key_id: row for row in self.db.session.execute(query)}
+    
+    def _forecast(self, api_key_id, stats, now):
+        """由聚合统计量计算一个密钥的预测结果"""
+        forecast = {
+            'api_key_id': api_key_id,
+            'computed_at': now,
+            'samples': 0,
+            'last_sample_at': None,
+            'rate_per_hour': None,
+            'character_count': 0,
+            'character_limit': 0,
+            'hours_to_exhaustion': None,
+            'exhaustion_at': None
+        }
+        if stats is None:
+            return forecast
+        
+        # 当前用量和上限取最新的采样
+        current = stats.current_value or 0
+        limit = stats.limit_value or 0
+        last_time = stats.last_time
+        if last_time is not None and not isinstance(last_time, datetime):
+            last_time = datetime.fromisoformat(last_time)
+        forecast.update(
+            samples=stats.n,
+            last_sample_at=last_time,
+            character_count=current,
+            character_limit=limit
+        )
+        
+        rate = None
+        denominator = stats.n * stats.sum_xx - stats.sum_x * stats.sum_x
+        if stats.n >= Config.FORECAST_MIN_SAMPLES and denominator > 1e-9:
+            rate = (stats.n * stats.sum_xy - stats.sum_x * stats.sum_y) / denominator
+            forecast['rate_per_hour'] = rate
+        
+        remaining = limit - current
+        if limit <= 0:
+            return forecast
+        
+        if remaining <= 0:
+            hours = 0.0
+        elif rate is not None and rate > 0:
+            hours = remaining / rate
+        else:
+            hours = None
+        
+        if hours is not None:
+            # 限制在 datetime 可表示的范围内（约100年）
+            hours = min(hours, 24 * 365 * 100)
+            forecast['hours_to_exhaustion'] = hours
+            forecast['exhaustion_at'] = now + timedelta(hours=hours)
+        return forecast
+    
+    def on_usage_written(self, results):
+        """用量写入回调：刷新本批涉及的密钥（在写入线程中调用）"""
+        key_ids = {api_key_id for api_key_id, usage_info in results if usage_info.get('is_success')}
+        if key_ids:
+            self.refresh(key_ids)
+    
+    def get_ranking(self, limit=None, group_id=None, at_risk=False):
+        """
+        按距离用尽的时间排序的预测结果（不会用尽的排在最后）
+        
+        Args:
+            limit (int): 最多返回的条数
+            group_id (int): 只返回该组的密钥
+            at_risk (bool): 只返回预计在计费周期结束前用尽的密钥
+        """
+        from models import ApiKey, UsageForecast
+        
+        query = self.db.session.query(UsageForecast, ApiKey).join(
+            ApiKey, ApiKey.id == UsageForecast.api_key_id
+        ).filter(ApiKey.is_active == True)
+        if group_id is not None:
+            query = query.filter(ApiKey.group_id == group_id)
+        if at_risk:
+            # 计费周期取自密钥当前的值，周期变化后无需重新计算预测
+            query = query.filter(
+                UsageForecast.exhaustion_at.is_not(None),
+                UsageForecast.exhaustion_at <= ApiKey.billing_end_time
+            )
+        
+        query = query.order_by(
+            UsageForecast.hours_to_exhaustion.is_(None),
+            UsageForecast.hours_to_exhaustion,
+            UsageForecast.api_key_id
+        )
+        if limit:
+            query = query.limit(limit)
+        
+        return [self._ranking_item(forecast, api_key) for forecast, api_key in query.all()]
+    
+    def _ranking_item(self, forecast, api_key):
+        item = forecast.to_dict()
+        billing_end_time = api_key.billing_end_time
+        if billing_end_time is None:
+            exhausts_before_reset = None  # 没有计费周期（Free API）
+        else:
+            exhausts_before_reset = forecast.exhaustion_at is not None and forecast.exhaustion_at <= billing_end_time
+        
+        item.update({
+            'key_name': api_key.name,
+            'api_type': api_key.api_type,
+            'group_id': api_key.group_id,
+            'billing_end_time': billing_end_time.isoformat() if billing_end_time else None,
+            'exhausts_before_reset': exhausts_before_reset
+        })
+        return item
@@ -0,0 +1,37 @@
+import bisect
+import hashlib
+
+def _hash(value):
+    """稳定的64位哈希（不受 PYTHONHASHSEED 影响，各进程结果一致）"""
+    return int.from_bytes(hashlib.md5(str(value).encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    """
+    一致性哈希环
+    
+    每个节点在环上放置 replicas 个虚拟节点，键归属于顺时针方向的第一个虚拟节点。
+    节点加入或离开时，只有约 1/N 的键会改变归属。
+    """
+    
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self.nodes = sorted(set(nodes))
+        
+        ring = sorted(
+            (_hash(f'{node}#{index}'), node)
+            for node in self.nodes
+            for index in range(replicas)
+        )
+        self._hashes = [point for point, _ in ring]
+        self._owners = [node for _, node in ring]
+    
+    def get_node(self, key):
+        """获取键所属的节点，环为空时返回 None"""
+        if not self._hashes:
+            return None
+        
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+    
+    def __len__(self):
+        return len(self.nodes)
@@ -0,0 +1,542 @@
+import base64
+import csv
+import io
+import json
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import and_ as db_and, case, func, literal, or_ as db_or, select, union_all
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 支持的聚合粒度
+BUCKETS = ('minute', 'hour', 'day', 'week', 'month')
+
+# 导出的数据源（原始记录 / 小时汇总 / 天汇总）及各自的列
+EXPORT_COLUMNS = {
+    'raw': (
+        'api_key_id', 'check_time', 'last_seen', 'character_count', 'character_limit',
+        'api_key_character_count', 'api_key_character_limit', 'start_time', 'end_time',
+        'is_success', 'error_message'
+    ),
+    'hourly': (
+        'api_key_id', 'bucket_start', 'first_time', 'last_time', 'max_usage', 'min_usage',
+        'first_usage', 'last_usage', 'character_limit', 'records'
+    )
+}
+EXPORT_COLUMNS['daily'] = EXPORT_COLUMNS['hourly']
+
+# 导出格式
+EXPORT_FORMATS = ('ndjson', 'csv')
+
+# SQLite下各粒度的时间截断格式（与SQLAlchemy存储DateTime的格式一致，便于直接比较）
+_SQLITE_BUCKET_FORMATS = {
+    'minute': '%Y-%m-%d %H:%M:00.000000',
+    'hour': '%Y-%m-%d %H:00:00.000000',
+    'day': '%Y-%m-%d 00:00:00.000000',
+    'month': '%Y-%m-01 00:00:00.000000'
+}
+
+def bucket_expression(column, bucket, dialect_name):
+    """
+    生成把时间列截断到指定粒度的SQL表达式
+    
+    Args:
+        column: 时间列
+        bucket (str): minute / hour / day / week / month
+        dialect_name (str): 数据库方言名称
+    
+    Returns:
+        SQL表达式，值为桶的起始时间
+    """
+    if bucket not in BUCKETS:
+        raise ValueError(f'不支持的聚合粒度: {bucket}')
+    
+    if dialect_name == 'sqlite':
+        if bucket == 'week':
+            # 周一作为一周的开始
+            return func.strftime('%Y-%m-%d 00:00:00.000000', column, 'weekday 0', '-6 days')
+        return func.strftime(_SQLITE_BUCKET_FORMATS[bucket], column)
+    
+    if dialect_name == 'postgresql':
+        return func.date_trunc(bucket, column)
+    
+    raise ValueError(f'不支持的数据库: {dialect_name}')
+
+def usage_value(model):
+    """用量值表达式：Pro API优先使用api_key_character_count"""
+    return func.coalesce(model.api_key_character_count, model.character_count)
+
+def usage_limit(model):
+    """用量上限表达式：Pro API优先使用api_key_character_limit"""
+    return func.coalesce(model.api_key_character_limit, model.character_limit)
+
+def raw_sources(*conditions, since=None, until=None):
+    """
+    原始用量记录作为聚合数据源
+    
+    所有数据源都输出相同的列（部分聚合结果），因此原始记录和汇总表
+    可以 UNION ALL 后再统一聚合到任意粒度。
+    
+    仅变化存储模式下，一条记录代表 [check_time, last_seen] 内值不变的多次采样，
+    因此在两个端点各产出一个采样点，分别按各自的时间筛选和分桶
+    
+    Returns:
+        list: 查询列表
+    """
+    from models import UsageRecord
+    
+    value = usage_value(UsageRecord)
+    
+    def sample(time_column, records, *extra):
+        time_conditions = []
+        if since is not None:
+            time_conditions.append(time_column >= since)
+        if until is not None:
+            time_conditions.append(time_column < until)
+        
+        return select(
+            UsageRecord.api_key_id.label('api_key_id'),
+            time_column.label('first_time'),
+            time_column.label('last_time'),
+            value.label('first_value'),
+            value.label('last_value'),
+            value.label('max_value'),
+            value.label('min_value'),
+            usage_limit(UsageRecord).label('limit_value'),
+            literal(records).label('records')
+        ).where(UsageRecord.is_success == True, *conditions, *time_conditions, *extra)
+    
+    return [
+        sample(UsageRecord.check_time, 1),
+        sample(
+            UsageRecord.last_seen, 1,
+            UsageRecord.last_seen.is_not(None),
+            UsageRecord.last_seen != UsageRecord.check_time
+        )
+    ]
+
+def rollup_source(model, *conditions):
+    """汇总表作为聚合数据源"""
+    return select(
+        model.api_key_id.label('api_key_id'),
+        model.first_time.label('first_time'),
+        model.last_time.label('last_time'),
+        model.first_usage.label('first_value'),
+        model.last_usage.label('last_value'),
+        model.max_usage.label('max_value'),
+        model.min_usage.label('min_value'),
+        model.character_limit.label('limit_value'),
+        model.records.label('records')
+    ).where(*conditions)
+
+def aggregate_query(sources, bucket, dialect_name, per_key=False):
+    """
+    将一个或多个数据源聚合到指定粒度的时间桶
+    
+    Args:
+        sources (list): raw_sources / rollup_source 生成的查询
+        bucket (str): 聚合粒度
+        dialect_name (str): 数据库方言名称
+        per_key (bool): 是否按密钥分别聚合
+    
+    Returns:
+        查询，列为 [api_key_id,] bucket_start, max_usage, min_usage, first_usage,
+        last_usage, character_limit, records, first_time, last_time
+    """
+    samples = (sources[0] if len(sources) == 1 else union_all(*sources)).subquery()
+    bucket_start = bucket_expression(samples.c.first_time, bucket, dialect_name)
+    partition = [samples.c.api_key_id, bucket_start] if per_key else [bucket_start]
+    
+    ranked = select(
+        samples,
+        bucket_start.label('bucket_start'),
+        func.row_number().over(
+            partition_by=partition,
+            order_by=samples.c.first_time.asc()
+        ).label('rank_asc'),
+        func.row_number().over(
+            partition_by=partition,
+            order_by=samples.c.last_time.desc()
+        ).label('rank_desc')
+    ).subquery()
+    
+    keys = [ranked.c.api_key_id, ranked.c.bucket_start] if per_key else [ranked.c.bucket_start]
+    return select(
+        *keys,
+        func.max(ranked.c.max_value).label('max_usage'),
+        func.min(ranked.c.min_value).label('min_usage'),
+        func.max(case((ranked.c.rank_asc == 1, ranked.c.first_value))).label('first_usage'),
+        func.max(case((ranked.c.rank_desc == 1, ranked.c.last_value))).label('last_usage'),
+        func.max(case((ranked.c.rank_desc == 1, ranked.c.limit_value))).label('character_limit'),
+        func.sum(ranked.c.records).label('records'),
+        func.min(ranked.c.first_time).label('first_time'),
+        func.max(ranked.c.last_time).label('last_time')
+    ).group_by(*keys).order_by(*keys)
+
+def _next_bucket_start(start, bucket):
+    """下一个桶的起始时间"""
+    if bucket == 'month':
+        return start.replace(year=start.year + start.month // 12, month=start.month % 12 + 1)
+    steps = {
+        'minute': timedelta(minutes=1),
+        'hour': timedelta(hours=1),
+        'day': timedelta(days=1),
+        'week': timedelta(weeks=1)
+    }
+    return start + steps[bucket]
+
+def to_datetime(value):
+    """将桶起始时间统一为datetime（SQLite返回字符串）"""
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+def encode_cursor(position):
+    """将分页位置编码为不透明的游标字符串"""
+    data = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """解析分页游标，格式不正确时抛出 ValueError"""
+    try:
+        data = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(data)
+        if position.get('s') == 'raw' and 't' in position:
+            datetime.fromisoformat(position['t'])
+            int(position['i'])
+        elif position.get('s') == 'rollup':
+            datetime.fromisoformat(position['b'])
+            if 't' in position:
+                datetime.fromisoformat(position['t'])
+        elif position.get('s') != 'raw':
+            raise ValueError
+        return position
+    except (ValueError, TypeError, KeyError, AttributeError):
+        raise ValueError('无效的分页游标')
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def format_export(rows, columns, fmt, chunk_rows=1000):
+    """
+    将导出行转换为 NDJSON 或 CSV 文本块
+    
+    每块包含最多 chunk_rows 行，逐块产出，内存占用与导出范围无关
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'不支持的导出格式: {fmt}')
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == 'csv' else None
+    if writer:
+        writer.writerow(columns)
+    
+    count = 0
+    for row in rows:
+        values = [_export_value(value) for value in row]
+        if writer:
+            writer.writerow(values)
+        else:
+            buffer.write(json.dumps(dict(zip(columns, values)), ensure_ascii=False))
+            buffer.write('\n')
+        
+        count += 1
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    
+    if buffer.tell():
+        yield buffer.getvalue()
+
+class HistoryService:
+    """用量历史服务类 - 在数据库中完成时间桶聚合，并按时间范围选择合适精度的数据"""
+    
+    def __init__(self, db):
+        self.db = db
+    
+    def get_watermarks(self):
+        """
+        获取各汇总表已完整汇总到的时间点
+        
+        Returns:
+            dict: {'hourly': datetime|None, 'daily': datetime|None}
+        """
+        from models import UsageRollupHourly, UsageRollupDaily
+        
+        hourly = self.db.session.query(func.max(UsageRollupHourly.bucket_start)).scalar()
+        daily = self.db.session.query(func.max(UsageRollupDaily.bucket_start)).scalar()
+        return {
+            'hourly': hourly + timedelta(hours=1) if hourly else None,
+            'daily': daily + timedelta(days=1) if daily else None
+        }
+    
+    def get_buckets(self, api_key_id, bucket, start_time):
+        """
+        按时间桶聚合指定密钥的用量
+        
+        已汇总的时间段从汇总表读取（day/week/month 优先使用天汇总，hour 使用小时汇总），
+        其余时间段从原始记录读取，合并后在数据库中统一聚合
+        
+        Args:
+            api_key_id (int): API密钥ID
+            bucket (str): 聚合粒度
+            start_time (datetime): 起始时间
+        
+        Returns:
+            list[dict]: 按时间升序排列的桶，包含 max/min/first/last/delta 和记录数
+        """
+        from models import UsageRecord, UsageRollupHourly, UsageRollupDaily
+        
+        dialect_name = self.db.engine.dialect.name
+        watermarks = self.get_watermarks() if bucket != 'minute' else {'hourly': None, 'daily': None}
+        
+        sources = []
+        raw_from = start_time
+        
+        if bucket in ('day', 'week', 'month') and watermarks['daily'] and watermarks['daily'] > start_time:
+            sources.append(rollup_source(
+                UsageRollupDaily,
+                UsageRollupDaily.api_key_id == api_key_id,
+                UsageRollupDaily.last_time >= start_time
+            ))
+            raw_from = watermarks['daily']
+        
+        if watermarks['hourly'] and watermarks['hourly'] > raw_from:
+            sources.append(rollup_source(
+                UsageRollupHourly,
+                UsageRollupHourly.api_key_id == api_key_id,
+                UsageRollupHourly.last_time >= raw_from
+            ))
+            raw_from = watermarks['hourly']
+        
+        sources.extend(raw_sources(UsageRecord.api_key_id == api_key_id, since=raw_from))
+        
+        buckets = []
+        for row in self.db.session.execute(aggregate_query(sources, bucket, dialect_name)):
+            start = to_datetime(row.bucket_start)
+            buckets.append({
+                'bucket_start': start.isoformat(),
+                'date': start.date().isoformat(),
+                'max_usage': row.max_usage,
+                'min_usage': row.min_usage,
+                'first_usage': row.first_usage,
+                'last_usage': row.last_usage,
+                'delta': row.last_usage - row.first_usage,
+                'character_limit': row.character_limit,
+                'records': row.records
+            })
+        
+        if Config.USAGE_STORAGE_MODE == 'change_only':
+            buckets = self._fill_unchanged_spans(buckets, bucket)
+        
+        return buckets
+    
+    def _fill_unchanged_spans(self, buckets, bucket):
+        """
+        补齐仅变化存储模式下值未变化的时间段
+        
+        一条记录跨越多个桶时，中间的桶没有采样点；若前后两个桶的值连续，
+        则用前一个桶的最终值补齐中间的桶
+        """
+        filled = []
+        for current in buckets:
+            if filled and filled[-1]['last_usage'] == current['first_usage']:
+                previous = filled[-1]
+                start = _next_bucket_start(datetime.fromisoformat(previous['bucket_start']), bucket)
+                current_start = datetime.fromisoformat(current['bucket_start'])
+                while start < current_start:
+                    filled.append({
+                        'bucket_start': start.isoformat(),
+                        'date': start.date().isoformat(),
+                        'max_usage': previous['last_usage'],
+                        'min_usage': previous['last_usage'],
+                        'first_usage': previous['last_usage'],
+                        'last_usage': previous['last_usage'],
+                        'delta': 0,
+                        'character_limit': previous['character_limit'],
+                        'records': 0
+                    })
+                    start = _next_bucket_start(start, bucket)
+            filled.append(current)
+        return filled
+    
+    def get_records(self, api_key_id, start_time):
+        """
+        获取指定密钥的用量记录（按时间倒序）
+        
+        仅变化存储模式下，值未变化的记录在 last_seen 处额外产出一个采样点；
+        原始记录已被保留策略清理的时间段，用小时汇总代替（每小时一条）
+        """
+        from models import UsageRecord, UsageRollupHourly
+        
+        records = UsageRecord.query.filter(
+            UsageRecord.api_key_id == api_key_id,
+            db_or(UsageRecord.check_time >= start_time, UsageRecord.last_seen >= start_time)
+        ).order_by(UsageRecord.check_time.desc()).all()
+        
+        result = self._record_items(records, start_time)
+        
+        raw_cutoff = self._raw_retention_cutoff()
+        if raw_cutoff is None or start_time >= raw_cutoff:
+            return result
+        
+        oldest_raw = records[-1].check_time if records else datetime.utcnow()
+        rollups = UsageRollupHourly.query.filter(
+            UsageRollupHourly.api_key_id == api_key_id,
+            UsageRollupHourly.last_time >= start_time,
+            UsageRollupHourly.last_time < oldest_raw
+        ).order_by(UsageRollupHourly.bucket_start.desc()).all()
+        
+        result.extend(self._rollup_as_record(rollup) for rollup in rollups)
+        return result
+    
+    def get_records_page(self, api_key_id, start_time, limit, cursor=None):
+        """
+        分页获取指定密钥的用量记录（按时间倒序，键集分页）
+        
+        先按 (check_time, id) 倒序读取原始记录，读完后继续读取原始记录已被清理的
+        时间段的小时汇总。每页只查询 limit + 1 行，翻页代价与页码无关。
+        
+        Args:
+            api_key_id (int): API密钥ID
+            start_time (datetime): 起始时间
+            limit (int): 每页记录数（仅变化存储模式下一条记录可能产出两个采样点）
+            cursor (str): 上一页返回的 next_cursor
+        
+        Returns:
+            dict: {'items': [...], 'next_cursor': str|None}
+        """
+        from models import UsageRecord, UsageRollupHourly
+        
+        position = decode_cursor(cursor) if cursor else {'s': 'raw'}
+        items = []
+        
+        if position['s'] == 'raw':
+            query = UsageRecord.query.filter(
+                UsageRecord.api_key_id == api_key_id,
+                db_or(UsageRecord.check_time >= start_time, UsageRecord.last_seen >= start_time)
+            )
+            if 't' in position:
+                after_time = datetime.fromisoformat(position['t'])
+                query = query.filter(db_or(
+                    UsageRecord.check_time < after_time,
+                    db_and(UsageRecord.check_time == after_time, UsageRecord.id < position['i'])
+                ))
+            records = query.order_by(UsageRecord.check_time.desc(), UsageRecord.id.desc()).limit(limit + 1).all()
+            
+            if len(records) > limit:
+                records = records[:limit]
+                last = records[-1]
+                return {
+                    'items': self._record_items(records, start_time),
+                    'next_cursor': encode_cursor({'s': 'raw', 't': last.check_time.isoformat(), 'i': last.id})
+                }
+            
+            items = self._record_items(records, start_time)
+            raw_cutoff = self._raw_retention_cutoff()
+            if raw_cutoff is None or start_time >= raw_cutoff:
+                return {'items': items, 'next_cursor': None}
+            
+            # 原始记录已读完，继续读取被清理时间段的小时汇总
+            if records:
+                oldest_raw = records[-1].check_time
+            elif 't' in position:
+                oldest_raw = datetime.fromisoformat(position['t'])
+            else:
+                oldest_raw = datetime.utcnow()
+            position = {'s': 'rollup', 'b': oldest_raw.isoformat()}
+            limit -= len(records)
+            if limit <= 0:
+                return {'items': items, 'next_cursor': encode_cursor(position)}
+        
+        query = UsageRollupHourly.query.filter(
+            UsageRollupHourly.api_key_id == api_key_id,
+            UsageRollupHourly.last_time >= start_time,
+            UsageRollupHourly.last_time < datetime.fromisoformat(position['b'])
+        )
+        if 't' in position:
+            query = query.filter(UsageRollupHourly.bucket_start < datetime.fromisoformat(position['t']))
+        rollups = query.order_by(UsageRollupHourly.bucket_start.desc()).limit(limit + 1).all()
+        
+        next_cursor = None
+        if len(rollups) > limit:
+            rollups = rollups[:limit]
+            next_cursor = encode_cursor(dict(position, t=rollups[-1].bucket_start.isoformat()))
+        
+        items.extend(self._rollup_as_record(rollup) for rollup in rollups)
+        return {'items': items, 'next_cursor': next_cursor}
+    
+    def iter_export_rows(self, source, start_time=None, end_time=None, key_ids=None):
+        """
+        逐行读取导出数据（按密钥和时间升序），列顺序与 EXPORT_COLUMNS[source] 一致
+        
+        使用 yield_per 分批从数据库游标读取，不会一次加载整个范围
+        
+        Args:
+            source (str): raw / hourly / daily
+            start_time (datetime): 起始时间，None为不限
+            end_time (datetime): 结束时间，None为不限
+            key_ids: 密钥ID列表或子查询，None为全部密钥
+        """
+        from models import UsageRecord, UsageRollupHourly, UsageRollupDaily
+        
+        model = {'raw': UsageRecord, 'hourly': UsageRollupHourly, 'daily': UsageRollupDaily}[source]
+        time_column = model.check_time if source == 'raw' else model.bucket_start
+        
+        query = select(*[getattr(model, column) for column in EXPORT_COLUMNS[source]])
+        if start_time is not None:
+            if source == 'raw':
+                query = query.where(db_or(time_column >= start_time, model.last_seen >= start_time))
+            else:
+                query = query.where(time_column >= start_time)
+        if end_time is not None:
+            query = query.where(time_column < end_time)
+        if key_ids is not None:
+            query = query.where(model.api_key_id.in_(key_ids))
+        
+        query = query.order_by(model.api_key_id, time_column).execution_options(
+            yield_per=Config.EXPORT_BATCH_SIZE
+        )
+        for partition in self.db.session.execute(query).partitions():
+            yield from partition
+    
+    def _record_items(self, records, start_time):
+        """将倒序的用量记录转换为采样点（仅变化存储模式下 last_seen 处额外产出一个）"""
+        result = []
+        for record in records:
+            record_dict = record.to_dict()
+            if record.last_seen and record.last_seen != record.check_time:
+                result.append(dict(record_dict, check_time=record_dict['last_seen']))
+            if record.check_time >= start_time:
+                result.append(record_dict)
+        return result
+    
+    def _raw_retention_cutoff(self):
+        """原始记录的保留起点（未启用清理时返回None）"""
+        if not Config.RAW_RETENTION_DAYS:
+            return None
+        return datetime.utcnow() - timedelta(days=Config.RAW_RETENTION_DAYS)
+    
+    def _rollup_as_record(self, rollup):
+        """将小时汇总转换为与用量记录相同结构的字典"""
+        limit = rollup.character_limit or 0
+        return {
+            'id': None,
+            'api_key_id': rollup.api_key_id,
+            'check_time': rollup.last_time.isoformat(),
+            'character_count': rollup.last_usage,
+            'character_limit': limit,
+            'usage_percentage': (rollup.last_usage / limit * 100) if limit > 0 else 0,
+            'api_key_character_count': None,
+            'api_key_character_limit': None,
+            'start_time': None,
+            'end_time': None,
+            'is_success': True,
+            'error_message': None,
+            'is_rollup': True,
+            'records': rollup.records
+        }
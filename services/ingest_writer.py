@@ -0,0 +1,360 @@
+import queue
+import threading
+import time
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy.orm import joinedload
+from config import Config
+from services.adaptive_polling import schedule_next_checks
+from services.metrics import (
+    INGEST_BATCH_SIZE, INGEST_COMMIT_SECONDS, INGEST_LISTENER_ERRORS, INGEST_POLLS, INGEST_RECORDS
+)
+from services.resilience import ERROR_AUTH
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+
+class WriteTicket:
+    """一次 submit_many 的写入状态：所有结果写入（或写入失败）后 wait() 返回"""
+    
+    def __init__(self, count):
+        self.remaining = count
+        self.failed = 0  # 写入失败的结果数
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        if not count:
+            self._event.set()
+    
+    def finish(self, count, written):
+        """记录一批中属于本次提交的结果已处理（由写入线程调用）"""
+        with self._lock:
+            self.remaining -= count
+            if not written:
+                self.failed += count
+            if self.remaining <= 0:
+                self._event.set()
+    
+    def is_set(self):
+        return self._event.is_set()
+    
+    def wait(self, timeout=None):
+        """等待全部结果处理完成，超时返回 False"""
+        return self._event.wait(timeout)
+
+class IngestWriter:
+    """
+    用量写入服务 - 查询结果先进入进程内队列，由单独的写入线程批量写入数据库
+    
+    查询线程只负责入队，写入线程每次取出最多 INGEST_FLUSH_SIZE 条结果
+    （或等待 INGEST_FLUSH_INTERVAL 秒后取出已有的结果），在一个事务中写入，
+    因此同时查询的组再多，数据库也只有一个写入者。
+    队列有上限，写入跟不上时入队会阻塞（背压），阻塞次数和时长计入统计。
+    """
+    
+    def __init__(self, db, app=None, flush_size=None, flush_interval=None, max_queue=None):
+        self.db = db
+        self.app = app
+        self.flush_size = flush_size or Config.INGEST_FLUSH_SIZE
+        self.flush_interval = flush_interval or Config.INGEST_FLUSH_INTERVAL
+        self.queue = queue.Queue(maxsize=max_queue or Config.INGEST_QUEUE_SIZE)
+        self.listeners = []  # 每批提交后调用 listener(results)，results 为 [(api_key_id, usage_info)]
+        
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'submitted': 0,
+            'written': 0,
+            'failed': 0,
+            'batches': 0,
+            'blocked_puts': 0,
+            'blocked_seconds': 0.0,
+            'max_depth': 0,
+            'last_batch_size': 0,
+            'last_batch_seconds': 0.0,
+            'last_flush_at': None
+        }
+    
+    def add_listener(self, listener):
+        """注册提交后的回调（在写入线程的应用上下文中调用，异常不影响写入）"""
+        self.listeners.append(listener)
+    
+    def start(self):
+        """启动写入线程（首次入队时自动启动）"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+    
+    def stop(self, timeout=None):
+        """写完队列中已有的结果后停止写入线程"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.queue.put(_STOP)
+        self._thread.join(timeout)
+    
+    def submit_many(self, results):
+        """
+        批量入队查询结果
+        
+        Args:
+            results (list[tuple]): [(api_key_id, usage_info)]
+        
+        Returns:
+            WriteTicket: 这些结果全部写入（或写入失败）后完成，failed 为写入失败的结果数
+        """
+        done = WriteTicket(len(results))
+        if not results:
+            return done
+        
+        self.start()
+        blocked_puts = 0
+        blocked_seconds = 0.0
+        for api_key_id, usage_info in results:
+            item = (api_key_id, usage_info, done)
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                # 背压：写入跟不上时阻塞查询线程
+                started = time.monotonic()
+                self.queue.put(item)
+                blocked_puts += 1
+                blocked_seconds += time.monotonic() - started
+        
+        with self._stats_lock:
+            self._stats['submitted'] += len(results)
+            self._stats['blocked_puts'] += blocked_puts
+            self._stats['blocked_seconds'] += blocked_seconds
+            self._stats['max_depth'] = max(self._stats['max_depth'], self.queue.qsize())
+        return done
+    
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _STOP:
+                return
+            
+            # 攒批：达到批量大小或等待超过刷新间隔后写入
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            
+            self._flush(batch)
+            if stopping:
+                return
+    
+    def _flush(self, batch):
+        """写入一批结果，失败时重试"""
+        started = time.monotonic()
+        results = [(api_key_id, usage_info) for api_key_id, usage_info, _ in batch]
+        
+        written = False
+        for attempt in range(1, Config.INGEST_MAX_RETRIES + 1):
+            try:
+                if self.app is None:
+                    self.write_batch(results)
+                else:
+                    with self.app.app_context():
+                        self.write_batch(results)
+                written = True
+                break
+            except Exception as e:
+                logger.error(f"批量写入用量记录失败（第 {attempt} 次）: {e}")
+                if attempt < Config.INGEST_MAX_RETRIES:
+                    time.sleep(min(0.5 * attempt, 2))
+        
+        INGEST_BATCH_SIZE.observe(len(batch))
+        INGEST_RECORDS.inc(len(batch), result='written' if written else 'failed')
+        if written:
+            success_count = sum(1 for _, usage_info in results if usage_info['is_success'])
+            INGEST_POLLS.inc(success_count, success='true')
+            INGEST_POLLS.inc(len(results) - success_count, success='false')
+        
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['written' if written else 'failed'] += len(batch)
+            self._stats['last_batch_size'] = len(batch)
+            self._stats['last_batch_seconds'] = round(time.monotonic() - started, 4)
+            self._stats['last_flush_at'] = datetime.utcnow().isoformat()
+        
+        tickets = {}
+        for _, _, done in batch:
+            tickets[done] = tickets.get(done, 0) + 1
+        for done, count in tickets.items():
+            done.finish(count, written)
+        
+        if written:
+            if self.app is None:
+                self._notify(results)
+            else:
+                with self.app.app_context():
+                    self._notify(results)
+    
+    def _notify(self, results):
+        for listener in self.listeners:
+            try:
+                listener(results)
+            except Exception as e:
+                logger.error(f"用量写入回调执行失败: {e}")
+                INGEST_LISTENER_ERRORS.inc()
+                self.db.session.rollback()
+    
+    def write_batch(self, results):
+        """
+        在一个事务中写入一批查询结果（需要应用上下文）
+        
+        - 更新密钥的最后检查时间、计费周期和隔离状态
+        - 写入用量记录（仅变化存储模式下用量未变化时只延长上一条记录）
+        - 同步更新最新用量表
+        - 自适应组的密钥计算下一次查询时间
+        - 递增用量数据版本号
+        """
+        from models import ApiKey, UsageRecord, LatestUsage, DataVersion
+        
+        session = self.db.session
+        try:
+            key_ids = {api_key_id for api_key_id, _ in results}
+            api_keys = ApiKey.query.options(
+                joinedload(ApiKey.group),
+                joinedload(ApiKey.latest_usage).joinedload(LatestUsage.record)
+            ).filter(ApiKey.id.in_(key_ids)).all()
+            keys_by_id = {api_key.id: api_key for api_key in api_keys}
+            
+            adaptive_keys = {}
+            for api_key_id, usage_info in results:
+                # 查询期间密钥可能已被删除
+                api_key = keys_by_id.get(api_key_id)
+                if api_key is None:
+                    continue
+                
+                try:
+                    self._record_usage(api_key, usage_info)
+                    
+                    if usage_info['is_success']:
+                        logger.info(f"API密钥 '{api_key.name}' 用量: {usage_info['character_count']}/{usage_info['character_limit']}")
+                    else:
+                        logger.error(f"API密钥 '{api_key.name}' 查询失败: {usage_info.get('error_message')}")
+                
+                except Exception as e:
+                    logger.error(f"写入API密钥 '{api_key.name}' 用量时发生错误: {e}")
+                    
+                    # 创建错误记录
+                    session.add(UsageRecord(
+                        api_key_id=api_key.id,
+                        check_time=datetime.utcnow(),
+                        character_count=0,
+                        character_limit=0,
+                        is_success=False,
+                        error_message=f"检查过程中发生错误: {str(e)}"
+                    ))
+                
+                if api_key.group is not None and api_key.group.polling_mode == 'adaptive':
+                    adaptive_keys[api_key.id] = api_key
+            
+            if adaptive_keys:
+                schedule_next_checks(self.db, list(adaptive_keys.values()))
+            
+            # 与用量在同一事务中递增版本号，使所有进程的响应缓存失效
+            DataVersion.bump('usage')
+            started = time.perf_counter()
+            session.commit()
+            INGEST_COMMIT_SECONDS.observe(time.perf_counter() - started)
+        except Exception:
+            session.rollback()
+            raise
+    
+    def _record_usage(self, api_key, usage_info):
+        """根据查询结果写入用量记录并更新密钥状态和最新用量（不提交）"""
+        from models import UsageRecord, LatestUsage
+        
+        self._update_key_status(api_key, usage_info)
+        
+        # 更新API密钥的最后检查时间和计费周期（仅Pro API）
+        api_key.last_check = usage_info['check_time']
+        if api_key.api_type == 'pro' and usage_info.get('start_time'):
+            api_key.billing_start_time = usage_info['start_time']
+            api_key.billing_end_time = usage_info['end_time']
+        
+        # 仅变化存储模式：用量未变化时只延长上一条记录的 last_seen
+        latest = api_key.latest_usage
+        if (Config.USAGE_STORAGE_MODE == 'change_only' and latest is not None
+                and latest.record is not None and latest.is_unchanged(usage_info)):
+            latest.record.last_seen = usage_info['check_time']
+            latest.check_time = usage_info['check_time']
+            return latest.record
+        
+        record = UsageRecord(
+            api_key_id=api_key.id,
+            check_time=usage_info['check_time'],
+            character_count=usage_info['character_count'],
+            character_limit=usage_info['character_limit'],
+            is_success=usage_info['is_success'],
+            error_message=usage_info.get('error_message')
+        )
+        
+        # Pro API特有字段
+        if usage_info.get('api_key_character_count') is not None:
+            record.api_key_character_count = usage_info['api_key_character_count']
+        if usage_info.get('api_key_character_limit') is not None:
+            record.api_key_character_limit = usage_info['api_key_character_limit']
+        if usage_info.get('start_time'):
+            record.start_time = usage_info['start_time']
+        if usage_info.get('end_time'):
+            record.end_time = usage_info['end_time']
+        
+        self.db.session.add(record)
+        
+        # 与用量记录在同一事务中更新最新用量
+        if api_key.latest_usage is None:
+            api_key.latest_usage = LatestUsage(api_key_id=api_key.id)
+        api_key.latest_usage.update_from(record)
+        
+        return record
+    
+    def _update_key_status(self, api_key, usage_info):
+        """根据查询结果更新密钥的隔离状态（不提交）"""
+        now = usage_info['check_time']
+        
+        if usage_info['is_success']:
+            if api_key.status == 'quarantined':
+                logger.info(f"API密钥 '{api_key.name}' 探测成功，解除隔离")
+            api_key.status = 'active'
+            api_key.auth_failures = 0
+            api_key.quarantined_at = None
+            api_key.next_probe_at = None
+            return
+        
+        if usage_info.get('error_kind') == ERROR_AUTH:
+            api_key.auth_failures = (api_key.auth_failures or 0) + 1
+            if api_key.status != 'quarantined' and api_key.auth_failures >= Config.KEY_QUARANTINE_THRESHOLD:
+                logger.warning(f"API密钥 '{api_key.name}' 连续 {api_key.auth_failures} 次认证失败，已隔离")
+                api_key.status = 'quarantined'
+                api_key.quarantined_at = now
+        
+        if api_key.status == 'quarantined':
+            api_key.next_probe_at = now + timedelta(seconds=Config.KEY_PROBE_INTERVAL)
+    
+    def get_stats(self):
+        """获取写入队列状态（队列深度、背压和批量写入统计）"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update({
+            'queue_size': self.queue.qsize(),
+            'queue_max': self.queue.maxsize,
+            'flush_size': self.flush_size,
+            'flush_interval': self.flush_interval,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'blocked_seconds': round(stats['blocked_seconds'], 3)
+        })
+        return stats
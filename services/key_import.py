@@ -0,0 +1,154 @@
+import csv
+import io
+import logging
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# CSV 导入支持的列（api_key 必填）
+IMPORT_COLUMNS = ('api_key', 'name', 'group_id')
+
+def parse_csv(text):
+    """
+    解析 CSV 格式的密钥列表
+    
+    有表头时按列名读取（api_key, name, group_id）；没有表头时每行第一列为密钥，第二列为名称
+    """
+    lines = text.lstrip('\ufeff').splitlines()
+    if not lines:
+        return []
+    
+    header = [column.strip().lower() for column in next(csv.reader([lines[0]]))]
+    if 'api_key' in header:
+        reader = csv.DictReader(io.StringIO('\n'.join(lines[1:])), fieldnames=header)
+        return [
+            {column: (row.get(column) or '').strip() for column in IMPORT_COLUMNS if row.get(column)}
+            for row in reader
+        ]
+    
+    rows = []
+    for values in csv.reader(lines):
+        values = [value.strip() for value in values]
+        if not any(values):
+            continue
+        row = {'api_key': values[0]}
+        if len(values) > 1 and values[1]:
+            row['name'] = values[1]
+        rows.append(row)
+    return rows
+
+class KeyImportService:
+    """
+    批量导入API密钥
+    
+    - 逐行用 DeepLService.validate_api_key 校验格式
+    - 请求内重复和与已有密钥重复都用集合判断（已有密钥按批 IN 查询）
+    - 新密钥在一个事务中按批插入，任一批失败则全部回滚
+    - 返回每一行的导入结果
+    """
+    
+    def __init__(self, db, deepl_service):
+        self.db = db
+        self.deepl_service = deepl_service
+    
+    def import_keys(self, rows, default_group_id=None):
+        """
+        导入密钥（需要应用上下文，成功后已提交）
+        
+        Args:
+            rows (list): [{'api_key': str, 'name': str?, 'group_id': int?}] 或密钥字符串
+            default_group_id (int): 行内未指定组时使用的组
+        
+        Returns:
+            dict: 各状态的数量、每行结果 results 和新建密钥ID created_ids
+        """
+        from models import ApiKey, ApiGroup, DataVersion
+        
+        group_ids = {group_id for (group_id,) in self.db.session.query(ApiGroup.id).all()}
+        
+        results = []
+        candidates = []  # (结果, 新密钥参数)
+        seen = set()
+        for index, row in enumerate(rows, 1):
+            if isinstance(row, str):
+                row = {'api_key': row}
+            if not isinstance(row, dict):
+                results.append({'row': index, 'status': 'invalid', 'message': '格式不正确'})
+                continue
+            
+            validation = self.deepl_service.validate_api_key(row.get('api_key'))
+            if not validation['is_valid']:
+                results.append({'row': index, 'status': 'invalid', 'message': validation['error']})
+                continue
+            
+            api_key = validation['api_key']
+            result = {'row': index, 'api_key': self._mask(api_key)}
+            results.append(result)
+            
+            try:
+                group_id = int(row.get('group_id') or default_group_id)
+            except (TypeError, ValueError):
+                group_id = None
+            if group_id not in group_ids:
+                result.update(status='invalid', message='组不存在')
+                continue
+            
+            if api_key in seen:
+                result.update(status='duplicate', message='与前面的行重复')
+                continue
+            seen.add(api_key)
+            
+            candidates.append((result, {
+                'api_key': api_key,
+                'name': (row.get('name') or f'API-{api_key[-8:]}')[:100],
+                'api_type': validation['api_type'],
+                'group_id': group_id,
+                'is_active': True
+            }))
+        
+        batch_size = Config.BULK_IMPORT_BATCH_SIZE
+        session = self.db.session
+        created_ids = []
+        try:
+            # 与已有密钥去重：按批 IN 查询
+            existing = set()
+            for start in range(0, len(candidates), batch_size):
+                chunk = [values['api_key'] for _, values in candidates[start:start + batch_size]]
+                existing.update(
+                    api_key for (api_key,) in session.query(ApiKey.api_key).filter(ApiKey.api_key.in_(chunk))
+                )
+            
+            new_rows = []
+            for result, values in candidates:
+                if values['api_key'] in existing:
+                    result.update(status='duplicate', message='API密钥已存在')
+                else:
+                    new_rows.append((result, values))
+            
+            # 一个事务内按批插入
+            for start in range(0, len(new_rows), batch_size):
+                chunk = new_rows[start:start + batch_size]
+                ids = session.scalars(
+                    self.db.insert(ApiKey).returning(ApiKey.id, sort_by_parameter_order=True),
+                    [values for _, values in chunk]
+                ).all()
+                for (result, _), key_id in zip(chunk, ids):
+                    result.update(status='created', key_id=key_id)
+                    created_ids.append(key_id)
+            
+            if created_ids:
+                DataVersion.bump('config')
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+        
+        counts = {'created': 0, 'duplicate': 0, 'invalid': 0}
+        for result in results:
+            counts[result['status']] += 1
+        logger.info(f"批量导入API密钥: {counts}")
+        
+        return dict(counts, total=len(results), results=results, created_ids=created_ids)
+    
+    def _mask(self, api_key):
+        return api_key[:6] + '...' + api_key[-6:] if len(api_key) > 16 else api_key
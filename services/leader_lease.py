@@ -0,0 +1,132 @@
+import os
+import socket
+import uuid
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import update, case, or_
+from sqlalchemy.exc import IntegrityError
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def make_holder_id():
+    """生成当前进程的租约持有者标识"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class LeaderLease:
+    """
+    基于数据库的领导者租约
+    
+    租约保存在 scheduler_leases 表中，获取和续约都是一条带条件的 UPDATE
+    （仅当自己持有或租约已过期时成功），因此同一时刻最多只有一个进程持有租约。
+    持有者停止续约后，其他进程最迟在租约有效期（ttl）加一个续约周期后接管。
+    各进程的时钟需要基本同步。
+    """
+    
+    def __init__(self, db, name='scheduler', holder=None, ttl=None):
+        self.db = db
+        self.name = name
+        self.holder = holder or make_holder_id()
+        self.ttl = ttl or Config.LEADER_LEASE_TTL
+        self._expires_at = None  # 本进程最近一次成功续约后的到期时间
+    
+    @property
+    def is_leader(self):
+        """本进程当前是否持有有效租约"""
+        return self._expires_at is not None and datetime.utcnow() < self._expires_at
+    
+    def try_acquire(self):
+        """
+        获取或续约租约（需要应用上下文）
+        
+        Returns:
+            bool: 是否持有租约
+        """
+        from models import SchedulerLease
+        
+        was_leader = self.is_leader
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        
+        try:
+            acquired = self.db.session.execute(
+                update(SchedulerLease).where(
+                    SchedulerLease.name == self.name,
+                    or_(SchedulerLease.holder == self.holder, SchedulerLease.expires_at < now)
+                ).values(
+                    holder=self.holder,
+                    acquired_at=case(
+                        (SchedulerLease.holder == self.holder, SchedulerLease.acquired_at),
+                        else_=now
+                    ),
+                    expires_at=expires_at
+                )
+            ).rowcount == 1
+            
+            if not acquired and self.db.session.get(SchedulerLease, self.name) is None:
+                self.db.session.add(SchedulerLease(
+                    name=self.name,
+                    holder=self.holder,
+                    acquired_at=now,
+                    expires_at=expires_at
+                ))
+                self.db.session.flush()
+                acquired = True
+            
+            self.db.session.commit()
+        
+        except IntegrityError:
+            # 其他进程同时创建了租约
+            self.db.session.rollback()
+            acquired = False
+        
+        except Exception as e:
+            logger.error(f"续约调度器租约失败: {e}")
+            self.db.session.rollback()
+            acquired = False
+        
+        # 数据库暂时不可用时，已持有的租约在本地到期前仍然有效
+        if acquired:
+            self._expires_at = expires_at
+        elif self._expires_at is not None and not self.is_leader:
+            self._expires_at = None
+        
+        if acquired and not was_leader:
+            logger.info(f"获得调度器租约 '{self.name}' ({self.holder})")
+        elif was_leader and not self.is_leader:
+            logger.warning(f"失去调度器租约 '{self.name}' ({self.holder})")
+        
+        return self.is_leader
+    
+    def release(self):
+        """主动释放租约，其他进程可以立即接管（需要应用上下文）"""
+        from models import SchedulerLease
+        
+        if self._expires_at is None:
+            return
+        
+        try:
+            self.db.session.execute(
+                update(SchedulerLease).where(
+                    SchedulerLease.name == self.name,
+                    SchedulerLease.holder == self.holder
+                ).values(expires_at=datetime.utcnow())
+            )
+            self.db.session.commit()
+            logger.info(f"释放调度器租约 '{self.name}' ({self.holder})")
+        except Exception as e:
+            logger.error(f"释放调度器租约失败: {e}")
+            self.db.session.rollback()
+        finally:
+            self._expires_at = None
+    
+    def get_status(self):
+        """获取租约状态（需要应用上下文）"""
+        from models import SchedulerLease
+        
+        lease = self.db.session.get(SchedulerLease, self.name)
+        return {
+            'holder': self.holder,
+            'is_leader': self.is_leader,
+            'lease': lease.to_dict() if lease else None
+        }
@@ -0,0 +1,243 @@
+import threading
+import logging
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Prometheus 文本格式的 Content-Type
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# 默认的直方图分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    """指标基类：按标签值保存各序列的数据（线程安全）"""
+    
+    type_name = None
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'指标 {self.name} 需要标签 {self.labelnames}，实际为 {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+    
+    def _render_series(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+class Counter(_Metric):
+    """只增不减的计数"""
+    
+    type_name = 'counter'
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """可任意设置的当前值"""
+    
+    type_name = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+    
+    def replace(self, series):
+        """
+        用一组新的序列替换全部序列（导出时重新采集的指标，已不存在的对象不再导出）
+        
+        Args:
+            series (iterable): (value, labels) 元组
+        """
+        values = {self._key(labels): value for value, labels in series}
+        with self._lock:
+            self._series = values
+
+class Histogram(_Metric):
+    """按分桶统计观测值的分布（累计计数、总和与次数）"""
+    
+    type_name = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+    
+    def _render_series(self, key, series):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, series['counts']):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(series["sum"])}')
+        lines.append(f'{self.name}_count{labels} {series["count"]}')
+        return lines
+    
+    def render(self):
+        # 复制各序列，渲染时不持有锁
+        with self._lock:
+            series = sorted((key, dict(value, counts=list(value['counts']))) for key, value in self._series.items())
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type_name}']
+        for key, value in series:
+            lines.extend(self._render_series(key, value))
+        return lines
+
+class MetricsRegistry:
+    """
+    进程内指标注册表
+    
+    计数和直方图在调用处直接更新；队列深度等当前状态由采集函数在每次导出前设置。
+    多进程部署时每个进程各自导出自己的指标
+    """
+    
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            self.metrics.append(metric)
+        return metric
+    
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+    
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+    
+    def add_collector(self, collector):
+        """注册导出前调用的采集函数（异常只记录日志）"""
+        with self._lock:
+            self.collectors.append(collector)
+    
+    def render(self):
+        """以 Prometheus 文本格式导出所有指标"""
+        for collector in list(self.collectors):
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"采集指标失败: {e}")
+        
+        lines = []
+        for metric in list(self.metrics):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = MetricsRegistry()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """在后台线程中提供 /metrics（没有 Web 服务的独立查询进程使用）"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logger.info(f"指标导出地址: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+# DeepL 请求
+DEEPL_REQUEST_SECONDS = REGISTRY.histogram(
+    'deepl_request_duration_seconds', 'DeepL /usage 请求耗时（按API类型和HTTP状态，超时和网络错误为 timeout / network）',
+    ('api_type', 'status'), buckets=(0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+)
+DEEPL_ERRORS = REGISTRY.counter(
+    'deepl_request_errors_total', 'DeepL 请求失败次数（按失败类型，包括熔断中跳过的请求）', ('api_type', 'kind')
+)
+DEEPL_RETRIES = REGISTRY.counter('deepl_request_retries_total', 'DeepL 请求重试次数', ('api_type',))
+DEEPL_BREAKER_OPEN = REGISTRY.gauge('deepl_circuit_breaker_open', '熔断器是否打开（1 为打开或半开）', ('api_type',))
+
+# 调度与查询
+GROUP_CYCLE_SECONDS = REGISTRY.histogram(
+    'group_check_duration_seconds', '一次组检查从加载密钥到全部查询结果返回的耗时', ('group_id',),
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+SCHEDULER_LAG_SECONDS = REGISTRY.histogram(
+    'scheduler_lag_seconds', '定时任务实际提交时间与计划运行时间的差', ('job',),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+)
+SCHEDULER_MISSED = REGISTRY.counter(
+    'scheduler_job_skipped_total', '因上一次仍在运行或错过运行时间而跳过的定时任务次数', ('job',)
+)
+SCHEDULER_OVERDUE = REGISTRY.gauge(
+    'scheduler_job_overdue_seconds', '导出时定时任务超过计划运行时间仍未执行的秒数（0为正常）', ('job',)
+)
+POLL_QUEUE_DEPTH = REGISTRY.gauge('poll_executor_pending', '查询执行器中排队的查询任务数')
+
+# 写入
+INGEST_COMMIT_SECONDS = REGISTRY.histogram(
+    'ingest_commit_duration_seconds', '批量写入用量的数据库提交耗时', buckets=DEFAULT_BUCKETS
+)
+INGEST_BATCH_SIZE = REGISTRY.histogram(
+    'ingest_batch_size', '每批写入的查询结果数', buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+INGEST_RECORDS = REGISTRY.counter(
+    'ingest_results_total', '写入线程处理的查询结果数（written 已写入 / failed 写入失败）', ('result',)
+)
+INGEST_POLLS = REGISTRY.counter('usage_polls_total', '已写入的查询结果（按是否查询成功）', ('success',))
+INGEST_LISTENER_ERRORS = REGISTRY.counter('ingest_listener_errors_total', '用量写入回调执行失败次数')
+INGEST_QUEUE_DEPTH = REGISTRY.gauge('ingest_queue_depth', '写入队列中等待写入的查询结果数')
@@ -0,0 +1,165 @@
+import heapq
+import itertools
+import threading
+import time
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+class FairPollExecutor:
+    """
+    公平轮询执行器 - 固定数量的工作线程，任务按组排队
+    
+    每个组一个先进先出队列，工作线程在有任务的组之间轮转取任务，
+    因此一个密钥很多的大组不会让其他组长时间排队。
+    定时任务、立即检查和检查所有组共用同一个执行器，
+    进程内同时进行的DeepL查询数量不超过工作线程数。
+    延迟任务（如等待重试的查询）到期后才进入组队列，等待期间不占用工作线程。
+    """
+    
+    def __init__(self, max_workers, name='poll-worker'):
+        self.max_workers = max(int(max_workers), 1)
+        self.name = name
+        self._queues = OrderedDict()  # 组 -> 待执行任务队列，按轮转顺序排列
+        self._running = {}            # 组 -> 正在执行的任务数
+        self._delayed = []            # 延迟任务 (到期时间, 序号, 组, 任务) 的小顶堆
+        self._sequence = itertools.count()
+        self._completed = 0
+        self._condition = threading.Condition()
+        self._workers = []
+        self._shutdown = False
+    
+    def submit(self, group_key, fn, *args, **kwargs):
+        """
+        提交一个任务到指定组的队列
+        
+        Returns:
+            concurrent.futures.Future: 任务结果
+        """
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('执行器已关闭')
+            
+            self._queues.setdefault(group_key, deque()).append((future, fn, args, kwargs))
+            self._start_workers()
+            self._condition.notify()
+        return future
+    
+    def submit_after(self, delay, group_key, fn, *args, **kwargs):
+        """
+        提交一个延迟任务，delay 秒后进入指定组的队列
+        
+        Returns:
+            concurrent.futures.Future: 任务结果
+        """
+        future = Future()
+        with self._condition:
+            if self._shutdown:
+                raise RuntimeError('执行器已关闭')
+            
+            not_before = time.monotonic() + max(delay, 0)
+            heapq.heappush(self._delayed, (not_before, next(self._sequence), group_key, (future, fn, args, kwargs)))
+            self._start_workers()
+            # 唤醒等待中的工作线程，按新的到期时间重新计算等待时长
+            self._condition.notify()
+        return future
+    
+    def _promote_due(self):
+        """把到期的延迟任务移入组队列，返回下一个延迟任务的剩余秒数，没有时返回 None（需持有锁）"""
+        now = time.monotonic()
+        while self._delayed and self._delayed[0][0] <= now:
+            _, _, group_key, task = heapq.heappop(self._delayed)
+            self._queues.setdefault(group_key, deque()).append(task)
+        return self._delayed[0][0] - now if self._delayed else None
+    
+    def _start_workers(self):
+        """按需启动工作线程（需持有锁）"""
+        while len(self._workers) < self.max_workers:
+            worker = threading.Thread(
+                target=self._worker,
+                name=f'{self.name}-{len(self._workers) + 1}',
+                daemon=True
+            )
+            worker.start()
+            self._workers.append(worker)
+    
+    def _next_task(self):
+        """取出队首组的下一个任务，并把该组移到轮转队尾（需持有锁）"""
+        group_key, queue = next(iter(self._queues.items()))
+        task = queue.popleft()
+        
+        if queue:
+            self._queues.move_to_end(group_key)
+        else:
+            del self._queues[group_key]
+        
+        self._running[group_key] = self._running.get(group_key, 0) + 1
+        return group_key, task
+    
+    def _worker(self):
+        while True:
+            with self._condition:
+                while True:
+                    timeout = self._promote_due()
+                    if self._queues:
+                        break
+                    if self._shutdown and timeout is None:
+                        return
+                    self._condition.wait(timeout)
+                group_key, (future, fn, args, kwargs) = self._next_task()
+            
+            try:
+                if future.set_running_or_notify_cancel():
+                    try:
+                        future.set_result(fn(*args, **kwargs))
+                    except BaseException as e:
+                        future.set_exception(e)
+            finally:
+                with self._condition:
+                    self._running[group_key] -= 1
+                    if not self._running[group_key]:
+                        del self._running[group_key]
+                    self._completed += 1
+    
+    def get_stats(self):
+        """获取执行器状态：工作线程数、排队和执行中的任务数（总数和按组）"""
+        with self._condition:
+            group_keys = list(self._queues) + [key for key in self._running if key not in self._queues]
+            return {
+                'max_workers': self.max_workers,
+                'workers': len(self._workers),
+                'queued': sum(len(queue) for queue in self._queues.values()),
+                'delayed': len(self._delayed),
+                'running': sum(self._running.values()),
+                'completed': self._completed,
+                'groups': [
+                    {
+                        'group': group_key,
+                        'queued': len(self._queues.get(group_key, ())),
+                        'running': self._running.get(group_key, 0)
+                    }
+                    for group_key in group_keys
+                ]
+            }
+    
+    def shutdown(self, wait=True, cancel_pending=True):
+        """关闭执行器，默认取消尚未开始的任务（包括延迟任务）"""
+        with self._condition:
+            self._shutdown = True
+            if cancel_pending:
+                for queue in self._queues.values():
+                    for future, _, _, _ in queue:
+                        future.cancel()
+                self._queues.clear()
+                for _, _, _, (future, _, _, _) in self._delayed:
+                    future.cancel()
+                self._delayed.clear()
+            self._condition.notify_all()
+            workers = list(self._workers)
+        
+        if wait:
+            for worker in workers:
+                worker.join()
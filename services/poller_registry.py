@@ -0,0 +1,97 @@
+import os
+import socket
+import logging
+from datetime import datetime, timedelta
+from config import Config
+from services.hash_ring import HashRing
+
+logger = logging.getLogger(__name__)
+
+class PollerRegistry:
+    """
+    查询进程注册表 - 基于数据库心跳的密钥分片
+    
+    每个独立查询进程定期在 poller_nodes 表中写入心跳，并用所有存活进程
+    构建一致性哈希环，只查询归属于自己的密钥。进程加入或离开（停止心跳）后，
+    各进程在下一次心跳时重建哈希环，密钥自动重新分配。
+    """
+    
+    def __init__(self, db, node_id=None):
+        self.db = db
+        self.node_id = node_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.started_at = datetime.utcnow()
+        self.ring = HashRing([self.node_id], Config.POLLER_VIRTUAL_NODES)
+    
+    def heartbeat(self):
+        """
+        写入本进程心跳并按存活进程重建哈希环（需要应用上下文）
+        
+        Returns:
+            bool: 存活进程集合是否发生变化
+        """
+        from models import PollerNode
+        
+        now = datetime.utcnow()
+        try:
+            node = self.db.session.get(PollerNode, self.node_id)
+            if node is None:
+                node = PollerNode(node_id=self.node_id, started_at=self.started_at)
+                self.db.session.add(node)
+            node.hostname = socket.gethostname()
+            node.pid = os.getpid()
+            node.heartbeat_at = now
+            
+            # 清理长时间没有心跳的进程记录
+            PollerNode.query.filter(
+                PollerNode.heartbeat_at < now - timedelta(seconds=Config.POLLER_NODE_TTL * 10)
+            ).delete(synchronize_session=False)
+            
+            self.db.session.commit()
+        except Exception as e:
+            logger.error(f"写入查询进程心跳失败: {e}")
+            self.db.session.rollback()
+            return False
+        
+        return self._rebuild(self.get_live_nodes(now))
+    
+    def _rebuild(self, node_ids):
+        """按存活进程重建哈希环（本进程总在环中）"""
+        node_ids = set(node_ids) | {self.node_id}
+        if set(self.ring.nodes) == node_ids:
+            return False
+        
+        self.ring = HashRing(node_ids, Config.POLLER_VIRTUAL_NODES)
+        logger.info(f"查询进程变化，重新分片: {len(node_ids)} 个进程 {sorted(node_ids)}")
+        return True
+    
+    def get_live_nodes(self, now=None):
+        """获取心跳未过期的进程ID列表"""
+        from models import PollerNode
+        
+        since = (now or datetime.utcnow()) - timedelta(seconds=Config.POLLER_NODE_TTL)
+        rows = self.db.session.query(PollerNode.node_id).filter(PollerNode.heartbeat_at >= since).all()
+        return [node_id for node_id, in rows]
+    
+    def owns(self, api_key_id):
+        """密钥是否归属于本进程"""
+        return self.ring.get_node(api_key_id) == self.node_id
+    
+    def leave(self):
+        """删除本进程的心跳记录，其他进程在下一次心跳时接管其密钥（需要应用上下文）"""
+        from models import PollerNode
+        
+        try:
+            PollerNode.query.filter_by(node_id=self.node_id).delete()
+            self.db.session.commit()
+            logger.info(f"查询进程 {self.node_id} 已退出分片")
+        except Exception as e:
+            logger.error(f"删除查询进程心跳失败: {e}")
+            self.db.session.rollback()
+    
+    def get_status(self):
+        """获取本进程的分片状态"""
+        return {
+            'node_id': self.node_id,
+            'nodes': list(self.ring.nodes),
+            'virtual_nodes': self.ring.replicas
+        }
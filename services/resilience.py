@@ -0,0 +1,140 @@
+import random
+import threading
+import time
+import logging
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# 查询失败的类型（usage_info['error_kind']）
+ERROR_AUTH = 'auth'                  # 401 / 403：密钥无效或已吊销，重试无意义
+ERROR_RATE_LIMITED = 'rate_limited'  # 429：按 Retry-After 等待后重试
+ERROR_UNAVAILABLE = 'unavailable'    # 5xx、超时、网络错误：退避重试，计入熔断
+ERROR_CIRCUIT_OPEN = 'circuit_open'  # 熔断中，未发送请求
+ERROR_OTHER = 'error'                # 其他错误（如 456 额度用尽），不重试
+
+RETRYABLE_ERRORS = (ERROR_RATE_LIMITED, ERROR_UNAVAILABLE)
+
+def classify_status(status_code):
+    """按HTTP状态码判断失败类型"""
+    if status_code in (401, 403):
+        return ERROR_AUTH
+    if status_code == 429:
+        return ERROR_RATE_LIMITED
+    if status_code >= 500:
+        return ERROR_UNAVAILABLE
+    return ERROR_OTHER
+
+def parse_retry_after(value, now=None):
+    """
+    解析 Retry-After 响应头（秒数或HTTP日期）
+    
+    Returns:
+        float: 需要等待的秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+    
+    value = value.strip()
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is not None:
+        retry_at = retry_at.replace(tzinfo=None) - retry_at.utcoffset()
+    return max((retry_at - (now or datetime.utcnow())).total_seconds(), 0.0)
+
+def retry_delay(attempt, retry_after=None):
+    """
+    第 attempt 次（从1开始）失败后的等待秒数
+    
+    有 Retry-After 时按服务端要求等待；否则指数退避（全抖动：在 0 到退避上限之间随机），
+    避免大量密钥同时重试
+    """
+    if retry_after is not None:
+        return retry_after
+    ceiling = min(Config.DEEPL_RETRY_BASE_DELAY * (2 ** (attempt - 1)), Config.DEEPL_RETRY_MAX_DELAY)
+    return random.uniform(0, ceiling)
+
+class CircuitBreaker:
+    """
+    熔断器（每个基础URL一个）
+    
+    - closed：正常放行，连续失败达到 failure_threshold 次后打开
+    - open：直接拒绝请求，reset_timeout 秒后进入 half_open
+    - half_open：只放行一个探测请求，成功则关闭，失败则重新打开
+    """
+    
+    def __init__(self, name, failure_threshold=None, reset_timeout=None):
+        self.name = name
+        self.failure_threshold = failure_threshold or Config.DEEPL_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or Config.DEEPL_BREAKER_RESET_TIMEOUT
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = None
+        self.rejected = 0
+        self._probing = False
+        self._lock = threading.Lock()
+    
+    def allow(self):
+        """是否允许发送请求"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+                self._probing = False
+            
+            if self.state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            
+            self.rejected += 1
+            return False
+    
+    def record_success(self):
+        with self._lock:
+            if self.state != 'closed':
+                logger.info(f"熔断器 {self.name} 已恢复")
+            self.state = 'closed'
+            self.failures = 0
+            self._probing = False
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half_open' or (self.state == 'closed' and self.failures >= self.failure_threshold):
+                if self.state == 'closed':
+                    logger.warning(f"熔断器 {self.name} 打开: 连续 {self.failures} 次请求失败")
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+                self._probing = False
+    
+    def record_result(self, usage_info):
+        """按查询结果更新状态：服务端可用（含认证失败等客户端错误）视为成功，5xx/超时/网络错误视为失败"""
+        kind = usage_info.get('error_kind')
+        if usage_info['is_success'] or kind in (ERROR_AUTH, ERROR_OTHER):
+            self.record_success()
+        elif kind == ERROR_UNAVAILABLE:
+            self.record_failure()
+        elif kind == ERROR_RATE_LIMITED:
+            # 限流说明服务端可用；半开状态下释放探测名额，由下一个请求继续探测
+            with self._lock:
+                self._probing = False
+    
+    def get_stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'rejected': self.rejected,
+                'open_seconds': round(time.monotonic() - self.opened_at, 1) if self.state != 'closed' and self.opened_at else None
+            }
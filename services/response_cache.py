@@ -0,0 +1,100 @@
+import threading
+import time
+import logging
+from datetime import datetime
+from flask import current_app, request
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    接口响应缓存 - 按数据版本号失效
+    
+    数据版本号保存在 data_versions 表中，用量写入和配置修改时在同一事务中递增，
+    因此多个进程之间也能正确失效。本进程最多每 RESPONSE_CACHE_CHECK_INTERVAL 秒
+    读取一次版本号，本进程内的修改提交后调用 invalidate() 立即生效。
+    版本号未变化时直接返回缓存的响应体；客户端带有相同 ETag 时返回 304。
+    内容还随时间变化的响应（如计费周期到期）可以给出失效时间，到期后重新生成，
+    失效时间也是 ETag 的一部分。
+    """
+    
+    def __init__(self, db, check_interval=None):
+        self.db = db
+        self.check_interval = Config.RESPONSE_CACHE_CHECK_INTERVAL if check_interval is None else check_interval
+        self._versions = {}
+        self._checked_at = None
+        self._entries = {}  # 缓存键 -> (版本号 ETag, ETag, 响应体, 失效时间)
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0}
+    
+    def invalidate(self):
+        """下一次请求时重新读取版本号"""
+        self._checked_at = None
+    
+    def get_versions(self):
+        """当前数据版本号（需要应用上下文）"""
+        from models import DataVersion
+        
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.check_interval:
+            self._versions = DataVersion.current()
+            self._checked_at = now
+        return self._versions
+    
+    def get_etag(self, key, names):
+        """根据缓存键和依赖的版本号生成 ETag"""
+        versions = self.get_versions()
+        return f"{key}-" + '-'.join(str(versions.get(name, 0)) for name in names)
+    
+    def response(self, key, names, build, expires=None):
+        """
+        返回缓存的JSON响应
+        
+        Args:
+            key (str): 缓存键
+            names (tuple): 响应依赖的数据版本名称
+            build (callable): 缓存失效时生成响应数据
+            expires (callable): 由响应数据给出其内容失效的时间（UTC，None表示不会失效）
+        """
+        version_etag = self.get_etag(key, names)
+        
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version_etag and (entry[3] is None or datetime.utcnow() < entry[3]):
+            etag, body = entry[1], entry[2]
+            cached = True
+        else:
+            data = build()
+            expires_at = expires(data) if expires is not None else None
+            etag = version_etag if expires_at is None else f"{version_etag}-{expires_at:%Y%m%d%H%M%S}"
+            body = current_app.json.dumps(data)
+            with self._lock:
+                self._entries[key] = (version_etag, etag, body, expires_at)
+            cached = False
+        
+        if request.if_none_match.contains_weak(etag):
+            self._count('not_modified')
+            response = current_app.response_class(status=304)
+        else:
+            self._count('hits' if cached else 'misses')
+            response = current_app.response_class(body, mimetype='application/json')
+        
+        # 浏览器每次都带 If-None-Match 重新验证
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+    
+    def get_stats(self):
+        """获取缓存命中统计"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'entries': len(self._entries),
+            'versions': dict(self._versions),
+            'check_interval': self.check_interval
+        })
+        return stats
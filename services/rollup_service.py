@@ -0,0 +1,140 @@
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, delete, select
+from config import Config
+from services.history_service import aggregate_query, raw_sources, rollup_source
+
+logger = logging.getLogger(__name__)
+
+# 汇总表字段，与 aggregate_query(per_key=True) 的输出列一一对应
+_ROLLUP_COLUMNS = [
+    'api_key_id', 'bucket_start', 'max_usage', 'min_usage', 'first_usage',
+    'last_usage', 'character_limit', 'records', 'first_time', 'last_time'
+]
+
+class RollupService:
+    """用量汇总服务类 - 将原始记录汇总为小时/天汇总表，并按保留策略清理旧数据"""
+    
+    def __init__(self, db, history_service):
+        self.db = db
+        self.history_service = history_service
+    
+    def compact(self, now=None):
+        """
+        执行一次汇总与清理
+        
+        只汇总已经结束的完整时间桶。每次从水位回溯 USAGE_COMPACTION_LOOKBACK 重新汇总，
+        覆盖汇总之后才写入的记录（查询周期较长、写入积压等），可重复执行
+        
+        Returns:
+            dict: 本次写入的汇总行数和删除的记录数
+        """
+        now = now or datetime.utcnow()
+        # 留出宽限时间，避免遗漏刚结束的小时内稍后才写入的记录
+        settled = now - timedelta(seconds=Config.USAGE_COMPACTION_GRACE)
+        current_hour = settled.replace(minute=0, second=0, microsecond=0)
+        current_day = current_hour.replace(hour=0)
+        
+        result = {
+            'hourly_rows': self._rollup_hourly(current_hour),
+            'daily_rows': self._rollup_daily(current_day)
+        }
+        result.update(self._apply_retention(now))
+        self.db.session.commit()
+        
+        logger.info(
+            f"用量汇总完成: 写入小时汇总 {result['hourly_rows']} 行, 天汇总 {result['daily_rows']} 行, "
+            f"清理原始记录 {result['raw_deleted']} 条, 小时汇总 {result['hourly_deleted']} 行"
+        )
+        return result
+    
+    def get_rebuild_starts(self):
+        """
+        获取本次需要重新汇总的起点
+        
+        小时表从小时水位回溯 USAGE_COMPACTION_LOOKBACK，天表从该小时所在的天开始；
+        还没有汇总数据时为 None（汇总全部数据）。清理只删除早于这些起点的数据，
+        保证重新汇总时原始记录和小时汇总仍然存在
+        
+        Returns:
+            dict: {'hourly': datetime|None, 'daily': datetime|None}
+        """
+        watermarks = self.history_service.get_watermarks()
+        hourly = watermarks['hourly']
+        daily = watermarks['daily']
+        
+        if hourly is not None:
+            hourly = (hourly - timedelta(seconds=Config.USAGE_COMPACTION_LOOKBACK)).replace(
+                minute=0, second=0, microsecond=0
+            )
+            if daily is not None:
+                daily = min(daily, hourly.replace(hour=0))
+        
+        return {'hourly': hourly, 'daily': daily}
+    
+    def _rollup_hourly(self, until):
+        """将 [重新汇总起点, until) 内的原始记录汇总到小时表（替换该范围内已有的汇总）"""
+        from models import UsageRollupHourly
+        
+        since = self.get_rebuild_starts()['hourly']
+        self._delete_rollups(UsageRollupHourly, since, until)
+        return self._insert_rollups(UsageRollupHourly, raw_sources(since=since, until=until), 'hour')
+    
+    def _rollup_daily(self, until):
+        """将 [重新汇总起点, until) 内的小时汇总继续汇总到天表（替换该范围内已有的汇总）"""
+        from models import UsageRollupHourly, UsageRollupDaily
+        
+        since = self.get_rebuild_starts()['daily']
+        conditions = [UsageRollupHourly.bucket_start < until]
+        if since:
+            conditions.append(UsageRollupHourly.bucket_start >= since)
+        
+        self._delete_rollups(UsageRollupDaily, since, until)
+        return self._insert_rollups(UsageRollupDaily, [rollup_source(UsageRollupHourly, *conditions)], 'day')
+    
+    def _delete_rollups(self, model, since, until):
+        """删除 [since, until) 内的汇总行，随后在同一事务中重新写入"""
+        conditions = [model.bucket_start < until]
+        if since:
+            conditions.append(model.bucket_start >= since)
+        self.db.session.execute(delete(model).where(*conditions))
+    
+    def _insert_rollups(self, model, sources, bucket):
+        """在数据库中聚合并批量写入汇总表（INSERT ... SELECT）"""
+        dialect_name = self.db.engine.dialect.name
+        query = aggregate_query(sources, bucket, dialect_name, per_key=True).order_by(None)
+        
+        statement = insert(model).from_select(_ROLLUP_COLUMNS, query)
+        return self.db.session.execute(statement).rowcount
+    
+    def _apply_retention(self, now):
+        """
+        按保留策略清理旧数据
+        
+        只删除已经汇总且不会再重新汇总的数据：原始记录早于小时表的重新汇总起点
+        （按最后一次采样时间），小时汇总早于天表的重新汇总起点；仍被最新用量表引用的记录会保留
+        """
+        from models import UsageRecord, UsageRollupHourly, LatestUsage
+        
+        starts = self.get_rebuild_starts()
+        raw_deleted = 0
+        hourly_deleted = 0
+        
+        if Config.RAW_RETENTION_DAYS and starts['hourly']:
+            cutoff = min(now - timedelta(days=Config.RAW_RETENTION_DAYS), starts['hourly'])
+            raw_deleted = self.db.session.execute(
+                delete(UsageRecord).where(
+                    func.coalesce(UsageRecord.last_seen, UsageRecord.check_time) < cutoff,
+                    UsageRecord.id.not_in(
+                        select(LatestUsage.record_id).where(LatestUsage.record_id.is_not(None))
+                    )
+                )
+            ).rowcount
+        
+        if Config.HOURLY_RETENTION_DAYS and starts['daily']:
+            cutoff = min(now - timedelta(days=Config.HOURLY_RETENTION_DAYS), starts['daily'])
+            hourly_deleted = self.db.session.execute(
+                delete(UsageRollupHourly).where(UsageRollupHourly.bucket_start < cutoff)
+            ).rowcount
+        
+        return {'raw_deleted': raw_deleted, 'hourly_deleted': hourly_deleted}
@@ -1,21 +1,113 @@
 import threading
 import time
 import logging
-from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import CancelledError, Future
+from apscheduler.events import EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED, EVENT_JOB_SUBMITTED
+from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor
+from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import or_
+from config import Config
+from services.poll_executor import FairPollExecutor
+from services.ingest_writer import IngestWriter
+from services.metrics import (
+    REGISTRY, DEEPL_BREAKER_OPEN, GROUP_CYCLE_SECONDS, INGEST_QUEUE_DEPTH, POLL_QUEUE_DEPTH,
+    SCHEDULER_LAG_SECONDS, SCHEDULER_MISSED, SCHEDULER_OVERDUE
+)
+from services.resilience import ERROR_CIRCUIT_OPEN
 
 logger = logging.getLogger(__name__)
 
+COMPACTION_JOB_ID = 'usage_compaction'
+LEADER_LEASE_JOB_ID = 'scheduler_leader_lease'
+POLLER_HEARTBEAT_JOB_ID = 'poller_heartbeat'
+
+# 只属于当前进程的任务（租约续约、心跳）始终保存在内存中
+LOCAL_JOBSTORE = 'local'
+# 数据库任务存储，只在持有租约的进程中挂载到调度器
+PERSISTENT_JOBSTORE = 'persistent'
+
+# 黄金分割比的小数部分，按ID生成的偏移量在任意数量的组之间都分布均匀
+_GOLDEN_RATIO_FRACTION = 0.6180339887498949
+
+def stagger_offset(seed, interval):
+    """根据ID计算在间隔内的固定起始偏移（秒）"""
+    return (seed * _GOLDEN_RATIO_FRACTION) % 1 * interval
+
+def create_scheduler():
+    """创建（未启动的）后台调度器，所有任务存储都在内存中"""
+    return BackgroundScheduler(
+        timezone=Config.SCHEDULER_TIMEZONE,
+        jobstores={'default': MemoryJobStore(), LOCAL_JOBSTORE: MemoryJobStore()},
+        executors={'default': ThreadPoolExecutor(Config.SCHEDULER_THREADS)},
+        job_defaults={'coalesce': True, 'misfire_grace_time': None}
+    )
+
+def create_persistent_jobstore(engine):
+    """
+    创建保存在数据库任务表中的任务存储
+    
+    组任务和汇总任务保存在该表中，重启后保留各任务的下一次运行时间；
+    停机期间错过的任务在启动后补跑一次。APScheduler 不支持多个调度器共用
+    同一个任务存储，因此由 SchedulerService 只在持有租约时挂载
+    """
+    from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+    return SQLAlchemyJobStore(engine=engine, tablename=Config.SCHEDULER_JOBS_TABLE)
+
+# 当前进程的调度器服务。组任务和汇总任务使用下面的模块级函数而不是绑定方法，
+# 以便保存到持久化任务存储中
+_active_service = None
+
+def run_group_job(group_id):
+    """组定时任务"""
+    if _active_service is not None:
+        _active_service.run_scheduled_check(group_id)
+
+def run_compaction_job():
+    """用量汇总定时任务"""
+    if _active_service is not None:
+        _active_service.run_scheduled_compaction()
+
 class SchedulerService:
     """调度器服务类 - 管理不同组的定时任务"""
     
-    def __init__(self, scheduler, deepl_service, db):
+    def __init__(self, scheduler, deepl_service, db, async_deepl_service=None, app=None, rollup_service=None,
+                 leader_lease=None, shard=None, schedule_jobs=True, ingest_writer=None, persistent_jobstore=None):
         self.scheduler = scheduler
         self.deepl_service = deepl_service
+        self.async_deepl_service = async_deepl_service  # 配置后组内密钥并发查询
+        self.rollup_service = rollup_service  # 用量汇总与数据清理
         self.db = db
+        self.app = app  # 定时任务在后台线程中运行，需要应用上下文
+        self.leader_lease = leader_lease  # 配置后只有持有租约的进程运行定时任务
+        self.shard = shard  # 独立查询进程的分片，配置后各进程只查询归属于自己的密钥
+        self.schedule_jobs = schedule_jobs  # 为 False 时本进程不运行定时任务（由独立查询进程负责）
+        self.pollers_running = False  # 是否有存活的独立查询进程（未配置分片的进程此时不执行定时查询）
+        self.pollers_checked_at = None
+        if persistent_jobstore is not None and leader_lease is None:
+            raise ValueError('数据库任务存储需要启用调度器租约（LEADER_ELECTION_ENABLED）')
+        # 数据库任务存储工厂，配置后组任务和汇总任务只在持有租约时保存在其中并运行
+        self.persistent_jobstore = persistent_jobstore
+        self.persistent_attached = False  # 数据库任务存储当前是否挂载在调度器上
+        self.jobstore = PERSISTENT_JOBSTORE if persistent_jobstore is not None else 'default'
         self.group_jobs = {}  # 存储各组的任务ID
-        self.max_workers = 10  # 最大并发线程数
+        self.group_signatures = {}  # 各组当前调度使用的配置，用于与数据库同步
+        self.max_workers = Config.MAX_CONCURRENT_GROUPS  # 查询工作线程数
+        
+        # 定时任务、立即检查和检查所有组共用的查询执行器，各组公平排队
+        self.poll_executor = FairPollExecutor(self.max_workers)
+        
+        # 查询结果由写入线程批量写入数据库
+        self.ingest_writer = ingest_writer or IngestWriter(db, app)
+        
+        # 记录定时任务的提交延迟和跳过次数
+        self.scheduler.add_listener(self._on_job_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_MISSED)
+        REGISTRY.add_collector(self.collect_metrics)
+        
+        global _active_service
+        _active_service = self
         
         # 启动时初始化所有组的调度器
         self._initialize_all_groups()
@@ -25,30 +117,68 @@ class SchedulerService:
         # 延迟初始化，避免在应用上下文外运行
         pass
     
+    def _jobstore_ready(self):
+        """组任务和汇总任务的任务存储是否可用（数据库任务存储只在持有租约时挂载）"""
+        return self.schedule_jobs and (self.persistent_jobstore is None or self.persistent_attached)
+    
     def setup_group_scheduler(self, group):
-        """为指定组设置调度器"""
-        job_id = f"group_{group.id}_usage_check"
+        """为指定组设置调度器（未持有数据库任务存储时由租约持有者在续约时同步）"""
+        if not self._jobstore_ready():
+            return
         
-        # 如果已存在任务，先移除
-        if job_id in self.group_jobs:
-            try:
-                self.scheduler.remove_job(job_id)
-            except:
-                pass
+        job_id = f"group_{group.id}_usage_check"
         
-        # 添加新的定时任务
+        # 添加新的定时任务（间隔不变的已有任务保持原来的运行时间）
         if group.is_active and group.query_interval > 0:
-            self.scheduler.add_job(
-                func=self.check_group_usage,
-                trigger=IntervalTrigger(seconds=group.query_interval),
-                id=job_id,
-                args=[group.id],
-                max_instances=1,  # 防止任务重叠
-                replace_existing=True
-            )
+            # 自适应组按最小间隔调度，每次只查询到期的密钥
+            adaptive = group.polling_mode == 'adaptive'
+            interval = min(group.query_interval, Config.ADAPTIVE_MIN_INTERVAL) if adaptive else group.query_interval
+            
+            self._add_interval_job(job_id, run_group_job, self._group_trigger(group, interval), args=[group.id])
             
             self.group_jobs[job_id] = group.id
-            logger.info(f"为组 '{group.name}' 设置了 {group.query_interval} 秒间隔的调度器")
+            self.group_signatures[group.id] = self._group_signature(group)
+            logger.info(f"为组 '{group.name}' 设置了 {interval} 秒间隔的调度器{'（自适应）' if adaptive else ''}")
+        
+        # 组已禁用，移除已存在的任务
+        else:
+            if job_id in self.group_jobs:
+                try:
+                    self.scheduler.remove_job(job_id)
+                except:
+                    pass
+                del self.group_jobs[job_id]
+            self.group_signatures[group.id] = self._group_signature(group)
+    
+    def _add_interval_job(self, job_id, func, trigger, **kwargs):
+        """添加间隔任务；同名任务的间隔相同时保留原任务（持久化任务存储中重启后不会重置运行时间）"""
+        existing = self.scheduler.get_job(job_id)
+        if existing is not None and getattr(existing.trigger, 'interval', None) == trigger.interval:
+            return existing
+        
+        return self.scheduler.add_job(
+            func=func,
+            trigger=trigger,
+            id=job_id,
+            jobstore=self.jobstore,
+            max_instances=1,  # 防止任务重叠
+            replace_existing=True,
+            **kwargs
+        )
+    
+    def _group_trigger(self, group, interval):
+        """
+        创建组的触发器
+        
+        各组的首次运行时间按组ID错开分布在一个间隔内，每次运行再叠加随机抖动，
+        避免相同间隔的组在同一时刻集中请求DeepL和写入数据库
+        """
+        start_date = None
+        if Config.SCHEDULER_STAGGER_ENABLED:
+            start_date = datetime.now(timezone.utc) + timedelta(seconds=stagger_offset(group.id, interval))
+        
+        jitter = min(Config.SCHEDULER_JITTER, interval // 2) or None
+        return IntervalTrigger(seconds=interval, start_date=start_date, jitter=jitter)
     
     def update_group_scheduler(self, group):
         """更新组的调度器设置"""
@@ -57,6 +187,9 @@ class SchedulerService:
     def remove_group_scheduler(self, group):
         """移除组的调度器"""
         job_id = f"group_{group.id}_usage_check"
+        self.group_signatures.pop(group.id, None)
+        if not self._jobstore_ready():
+            return
         
         try:
             self.scheduler.remove_job(job_id)
@@ -66,101 +199,534 @@ class SchedulerService:
         except Exception as e:
             logger.error(f"移除组调度器失败: {e}")
     
-    def check_group_usage(self, group_id):
+    @staticmethod
+    def _group_signature(group):
+        """组的调度相关配置"""
+        return (group.is_active, group.query_interval, group.polling_mode or 'fixed')
+    
+    def sync_group_schedulers(self):
+        """
+        按数据库中的组配置同步定时任务（需要应用上下文）
+        
+        多进程部署时组可能在其他进程中被创建、修改或删除，
+        持有租约的进程在每次续约后调用，使调度与数据库保持一致
+        """
+        from models import ApiGroup
+        
+        if not self._jobstore_ready():
+            return
+        
+        # 接管持久化任务存储中上次运行时保存的组任务
+        for job in self.scheduler.get_jobs(jobstore=self.jobstore):
+            if job.id.endswith('_usage_check') and job.id not in self.group_jobs:
+                self.group_jobs[job.id] = job.args[0]
+        
+        groups = ApiGroup.query.all()
+        for group in groups:
+            signature = self._group_signature(group)
+            if self.group_signatures.get(group.id) == signature:
+                continue
+            
+            self.setup_group_scheduler(group)
+        
+        existing_ids = {group.id for group in groups}
+        for job_id, group_id in list(self.group_jobs.items()):
+            if group_id not in existing_ids:
+                try:
+                    self.scheduler.remove_job(job_id)
+                except Exception:
+                    pass
+                del self.group_jobs[job_id]
+                self.group_signatures.pop(group_id, None)
+                logger.info(f"移除了已删除的组 {group_id} 的调度器")
+    
+    def is_leader(self):
+        """本进程是否负责运行定时任务（未启用租约时总是负责）"""
+        return self.leader_lease is None or self.leader_lease.is_leader
+    
+    def setup_leader_election(self):
+        """获取调度器租约并设置定时续约任务（未启用租约时不做任何事）"""
+        if self.leader_lease is None or not self.schedule_jobs:
+            return
+        
+        self.renew_leadership()
+        self.scheduler.add_job(
+            func=self.renew_leadership,
+            trigger=IntervalTrigger(seconds=Config.LEADER_RENEW_INTERVAL),
+            id=LEADER_LEASE_JOB_ID,
+            jobstore=LOCAL_JOBSTORE,
+            max_instances=1,
+            replace_existing=True
+        )
+        logger.info(f"设置了 {Config.LEADER_RENEW_INTERVAL} 秒间隔的调度器租约续约任务")
+    
+    def renew_leadership(self):
+        """获取或续约调度器租约，持有租约时同步组的定时任务"""
+        if self.app is None:
+            return self._renew_leadership()
+        
+        with self.app.app_context():
+            return self._renew_leadership()
+    
+    def _renew_leadership(self):
+        if not self.leader_lease.try_acquire():
+            self._detach_persistent_jobstore()
+            return False
+        
+        self._attach_persistent_jobstore()
+        
+        # 分片模式下各查询进程在心跳时自行同步
+        if self.shard is not None:
+            return True
+        
+        try:
+            self.sync_group_schedulers()
+        except Exception as e:
+            logger.error(f"同步组调度器时发生错误: {e}")
+            self.db.session.rollback()
+        return True
+    
+    def _attach_persistent_jobstore(self):
+        """获得租约后挂载数据库任务存储，按数据库同步组任务并设置汇总任务"""
+        if self.persistent_jobstore is None or self.persistent_attached or not self.schedule_jobs:
+            return
+        
+        self.group_jobs.clear()
+        self.group_signatures.clear()
+        self.scheduler.add_jobstore(self.persistent_jobstore(), PERSISTENT_JOBSTORE)
+        self.persistent_attached = True
+        logger.info("获得调度器租约，挂载数据库任务存储")
+        self.setup_compaction_scheduler()
+    
+    def _detach_persistent_jobstore(self):
+        """失去租约后卸下数据库任务存储，其中的任务不再由本进程运行"""
+        if not self.persistent_attached:
+            return
+        
+        # 不关闭任务存储（会释放共用的数据库引擎）
+        self.scheduler.remove_jobstore(PERSISTENT_JOBSTORE, shutdown=False)
+        self.persistent_attached = False
+        self.group_jobs.clear()
+        self.group_signatures.clear()
+        logger.warning("失去调度器租约，卸下数据库任务存储")
+    
+    def release_leadership(self):
+        """释放调度器租约（进程退出时调用）"""
+        if self.leader_lease is None:
+            return
+        
+        if self.app is None:
+            return self.leader_lease.release()
+        
+        with self.app.app_context():
+            return self.leader_lease.release()
+    
+    def run_scheduled_check(self, group_id):
+        """
+        定时任务入口：自适应组只查询到期的密钥
+        
+        分片模式下每个查询进程都执行（只查询自己的分片），否则仅持有租约的进程执行；
+        有独立查询进程存活时，未配置分片的进程（如Web进程）不执行，避免重复查询
+        """
+        if self.shard is None and (self.standalone_pollers_running() or not self.is_leader()):
+            return
+        return self.check_group_usage(group_id, due_only=True)
+    
+    def standalone_pollers_running(self):
+        """是否有心跳未过期的独立查询进程（每个心跳间隔最多查询一次数据库）"""
+        now = time.monotonic()
+        if self.pollers_checked_at is not None and now - self.pollers_checked_at < Config.POLLER_HEARTBEAT_INTERVAL:
+            return self.pollers_running
+        
+        try:
+            if self.app is None:
+                running = self._count_live_pollers() > 0
+            else:
+                with self.app.app_context():
+                    running = self._count_live_pollers() > 0
+        except Exception as e:
+            logger.error(f"查询独立查询进程状态失败: {e}")
+            return self.pollers_running
+        
+        if running != self.pollers_running:
+            if running:
+                logger.info("检测到独立查询进程，本进程暂停定时查询")
+            else:
+                logger.info("没有存活的独立查询进程，本进程恢复定时查询")
+        self.pollers_running = running
+        self.pollers_checked_at = now
+        return running
+    
+    def _count_live_pollers(self):
+        from models import PollerNode
+        
+        since = datetime.utcnow() - timedelta(seconds=Config.POLLER_NODE_TTL)
+        return PollerNode.query.filter(PollerNode.heartbeat_at >= since).count()
+    
+    def setup_shard(self):
+        """加入分片并设置定时心跳任务（未配置分片时不做任何事）"""
+        if self.shard is None:
+            return
+        
+        self.refresh_shard()
+        self.scheduler.add_job(
+            func=self.refresh_shard,
+            trigger=IntervalTrigger(seconds=Config.POLLER_HEARTBEAT_INTERVAL),
+            id=POLLER_HEARTBEAT_JOB_ID,
+            jobstore=LOCAL_JOBSTORE,
+            max_instances=1,
+            replace_existing=True
+        )
+        logger.info(f"查询进程 {self.shard.node_id} 设置了 {Config.POLLER_HEARTBEAT_INTERVAL} 秒间隔的心跳任务")
+    
+    def refresh_shard(self):
+        """写入心跳、按存活进程重新分片，并同步组的定时任务"""
+        if self.app is None:
+            return self._refresh_shard()
+        
+        with self.app.app_context():
+            return self._refresh_shard()
+    
+    def _refresh_shard(self):
+        self.shard.heartbeat()
+        
+        try:
+            self.sync_group_schedulers()
+        except Exception as e:
+            logger.error(f"同步组调度器时发生错误: {e}")
+            self.db.session.rollback()
+    
+    def leave_shard(self):
+        """退出分片（进程退出时调用）"""
+        if self.shard is None:
+            return
+        
+        if self.app is None:
+            return self.shard.leave()
+        
+        with self.app.app_context():
+            return self.shard.leave()
+    
+    def setup_compaction_scheduler(self):
+        """设置用量汇总与数据清理任务"""
+        if self.rollup_service is None or Config.USAGE_COMPACTION_INTERVAL <= 0 or not self._jobstore_ready():
+            return
+        
+        self._add_interval_job(
+            COMPACTION_JOB_ID,
+            run_compaction_job,
+            IntervalTrigger(seconds=Config.USAGE_COMPACTION_INTERVAL)
+        )
+        logger.info(f"设置了 {Config.USAGE_COMPACTION_INTERVAL} 秒间隔的用量汇总任务")
+    
+    def run_scheduled_compaction(self):
+        """定时任务入口：仅持有租约的进程执行汇总"""
+        if not self.is_leader():
+            return
+        return self.run_compaction()
+    
+    def run_compaction(self):
+        """执行用量汇总与数据清理"""
+        if self.app is None:
+            return self._run_compaction()
+        
+        with self.app.app_context():
+            return self._run_compaction()
+    
+    def _run_compaction(self):
+        try:
+            return self.rollup_service.compact()
+        except Exception as e:
+            logger.error(f"用量汇总时发生错误: {e}")
+            self.db.session.rollback()
+    
+    def check_group_usage(self, group_id, due_only=False, wait=False, progress=None):
         """
         检查指定组的所有API密钥用量
-        组内的密钥按顺序查询，不同组之间并发执行
+        查询任务提交到共享执行器（同步模式每个密钥一个任务，异步模式每批密钥一个任务），
+        当前线程等待查询结果后交给写入线程批量写入数据库
+        
+        Args:
+            group_id (int): 组ID
+            due_only (bool): 自适应组只查询已到期的密钥（定时任务使用）
+            wait (bool): 是否等待结果写入数据库后再返回（立即检查使用）
+            progress: 进度回调对象（add_total(n) / advance(n, failed)），立即检查任务使用
         """
-        from models import ApiGroup, ApiKey, UsageRecord
+        if self.app is None:
+            return self._check_group_usage(group_id, due_only, wait, progress)
         
+        with self.app.app_context():
+            return self._check_group_usage(group_id, due_only, wait, progress)
+    
+    def _check_group_usage(self, group_id, due_only=False, wait=False, progress=None):
+        started = time.perf_counter()
         try:
-            # 获取组信息
-            group = ApiGroup.query.get(group_id)
-            if not group or not group.is_active:
-                logger.warning(f"组 {group_id} 不存在或已禁用")
+            batch = self._dispatch_group(group_id, due_only, progress)
+        except Exception as e:
+            logger.error(f"检查组 {group_id} 用量时发生严重错误: {e}")
+            self.db.session.rollback()
+            if progress is not None:
+                raise
+            return
+        
+        if batch:
+            written = self._finish_group(batch, progress)
+            GROUP_CYCLE_SECONDS.observe(time.perf_counter() - started, group_id=group_id)
+            if wait and written is not None:
+                self._wait_written([written], strict=progress is not None)
+    
+    def _dispatch_group(self, group_id, due_only=False, progress=None):
+        """
+        加载组内需要查询的密钥并提交查询任务
+        
+        Returns:
+            dict: 批次信息（组、密钥ID和对应的查询任务），没有需要查询的密钥时返回 None
+        """
+        from models import ApiGroup, ApiKey
+        
+        # 获取组信息
+        group = ApiGroup.query.get(group_id)
+        if not group or not group.is_active:
+            logger.warning(f"组 {group_id} 不存在或已禁用")
+            return None
+        
+        adaptive = group.polling_mode == 'adaptive'
+        
+        # 获取组内需要查询的活跃API密钥（只取ID和密钥，写入结果时再加载完整对象）
+        # 已隔离的密钥只在到达探测时间时查询
+        now = datetime.utcnow()
+        query = self.db.session.query(ApiKey.id, ApiKey.api_key).filter(
+            ApiKey.group_id == group_id,
+            ApiKey.is_active == True,
+            or_(ApiKey.status != 'quarantined', ApiKey.next_probe_at <= now)
+        )
+        if adaptive and due_only:
+            query = query.filter(or_(ApiKey.next_check_at.is_(None), ApiKey.next_check_at <= now))
+        rows = query.order_by(ApiKey.id).all()
+        
+        # 分片模式下只查询归属于本进程的密钥
+        if self.shard is not None:
+            rows = [row for row in rows if self.shard.owns(row[0])]
+        
+        if not rows:
+            logger.info(f"组 '{group.name}' 没有{'到期的' if adaptive and due_only else '活跃的'}API密钥")
+            return None
+        
+        logger.info(f"开始检查组 '{group.name}' 的 {len(rows)} 个API密钥")
+        if progress is not None:
+            progress.add_total(len(rows))
+        
+        key_ids = [key_id for key_id, _ in rows]
+        return {
+            'group_id': group.id,
+            'group_name': group.name,
+            'key_ids': key_ids,
+            'tasks': self._submit_polls(group.id, [api_key for _, api_key in rows])
+        }
+    
+    def _submit_polls(self, group_id, api_keys):
+        """将一组密钥的查询提交到共享执行器，返回 [(任务, 密钥数)]"""
+        if self.async_deepl_service is not None:
+            size = self.async_deepl_service.max_concurrency
+            poll = self.async_deepl_service.poll_attempts
+        else:
+            size = 1
+            poll = self.deepl_service.poll_attempts
+        
+        chunks = [api_keys[i:i + size] for i in range(0, len(api_keys), size)]
+        return [(self._submit_poll(group_id, poll, chunk), len(chunk)) for chunk in chunks]
+    
+    def _submit_poll(self, group_id, poll, api_keys):
+        """
+        提交一批密钥的查询，返回全部密钥得到最终结果后完成的任务
+        
+        需要重试的密钥按等待时间作为延迟任务重新排队，等待期间不占用工作线程，
+        其他组的查询可以继续执行
+        """
+        future = Future()
+        results = [None] * len(api_keys)
+        
+        def run(indexes, attempt):
+            try:
+                outcomes = poll([api_keys[index] for index in indexes], attempt)
+            except BaseException as e:
+                future.set_exception(e)
                 return
             
-            # 获取组内所有活跃的API密钥
-            api_keys = ApiKey.query.filter_by(
-                group_id=group_id, 
-                is_active=True
-            ).all()
+            retry_indexes = []
+            delay = 0
+            for index, (usage_info, retry_delay) in zip(indexes, outcomes):
+                results[index] = usage_info
+                if retry_delay is not None:
+                    retry_indexes.append(index)
+                    delay = max(delay, retry_delay)
             
-            if not api_keys:
-                logger.info(f"组 '{group.name}' 没有活跃的API密钥")
+            if not retry_indexes:
+                future.set_result(results)
                 return
             
-            logger.info(f"开始检查组 '{group.name}' 的 {len(api_keys)} 个API密钥")
-            
-            # 按顺序检查组内的每个API密钥（符合您的需求）
-            success_count = 0
-            for api_key in api_keys:
-                try:
-                    # 查询API用量
-                    usage_info = self.deepl_service.get_usage(api_key.api_key)
-                    
-                    # 创建用量记录
-                    record = UsageRecord(
-                        api_key_id=api_key.id,
-                        check_time=usage_info['check_time'],
-                        character_count=usage_info['character_count'],
-                        character_limit=usage_info['character_limit'],
-                        is_success=usage_info['is_success'],
-                        error_message=usage_info.get('error_message')
-                    )
-                    
-                    # Pro API特有字段
-                    if usage_info.get('api_key_character_count') is not None:
-                        record.api_key_character_count = usage_info['api_key_character_count']
-                    if usage_info.get('api_key_character_limit') is not None:
-                        record.api_key_character_limit = usage_info['api_key_character_limit']
-                    if usage_info.get('start_time'):
-                        record.start_time = usage_info['start_time']
-                    if usage_info.get('end_time'):
-                        record.end_time = usage_info['end_time']
-                    
-                    # 更新API密钥的最后检查时间和计费周期（仅Pro API）
-                    api_key.last_check = usage_info['check_time']
-                    if api_key.api_type == 'pro' and usage_info.get('start_time'):
-                        api_key.billing_start_time = usage_info['start_time']
-                        api_key.billing_end_time = usage_info['end_time']
-                    
-                    self.db.session.add(record)
-                    
-                    if usage_info['is_success']:
-                        success_count += 1
-                        logger.info(f"API密钥 '{api_key.name}' 用量: {usage_info['character_count']}/{usage_info['character_limit']}")
-                    else:
-                        logger.error(f"API密钥 '{api_key.name}' 查询失败: {usage_info.get('error_message')}")
-                    
-                    # 在每次查询之间添加小延迟，避免过于频繁的请求
-                    time.sleep(0.5)
-                    
-                except Exception as e:
-                    logger.error(f"检查API密钥 '{api_key.name}' 时发生错误: {e}")
-                    
-                    # 创建错误记录
-                    error_record = UsageRecord(
-                        api_key_id=api_key.id,
-                        check_time=datetime.utcnow(),
-                        character_count=0,
-                        character_limit=0,
-                        is_success=False,
-                        error_message=f"检查过程中发生错误: {str(e)}"
-                    )
-                    self.db.session.add(error_record)
-            
-            # 提交所有更改
-            self.db.session.commit()
-            
-            logger.info(f"组 '{group.name}' 检查完成: {success_count}/{len(api_keys)} 成功")
+            try:
+                follow(self.poll_executor.submit_after(delay, group_id, run, retry_indexes, attempt + 1))
+            except RuntimeError:
+                # 执行器已关闭，使用最后一次的失败结果
+                future.set_result(results)
+        
+        def follow(task):
+            # 执行器关闭时取消的任务，同时取消整批查询
+            task.add_done_callback(lambda task: task.cancelled() and future.cancel())
+        
+        follow(self.poll_executor.submit(group_id, run, list(range(len(api_keys))), 1))
+        return future
+    
+    def _collect_results(self, tasks, progress=None):
+        """按提交顺序等待查询任务，依次产出 usage_info；已取消的任务产出 None"""
+        for future, size in tasks:
+            try:
+                results = future.result()
+                if progress is not None:
+                    progress.advance(size, failed=sum(1 for usage_info in results if not usage_info['is_success']))
+                yield from results
+            except CancelledError:
+                if progress is not None:
+                    progress.advance(size, failed=size)
+                yield from [None] * size
+            except Exception as e:
+                if progress is not None:
+                    progress.advance(size, failed=size)
+                logger.error(f"查询任务执行失败: {e}")
+                error_info = {
+                    'is_success': False,
+                    'error_message': f"检查过程中发生错误: {str(e)}",
+                    'character_count': 0,
+                    'character_limit': 0,
+                    'check_time': datetime.utcnow()
+                }
+                yield from [error_info] * size
+    
+    def _finish_group(self, batch, progress=None):
+        """
+        等待组的查询结果并交给写入线程
+        
+        立即检查任务（传入 progress）中出错时抛出异常，由任务记录为失败
+        
+        Returns:
+            WriteTicket: 结果写入数据库后完成，出错时返回 None
+        """
+        group_name = batch['group_name']
+        try:
+            # 熔断中未发送请求的结果不写入
+            results = [
+                (key_id, usage_info)
+                for key_id, usage_info in zip(batch['key_ids'], self._collect_results(batch['tasks'], progress))
+                if usage_info is not None and usage_info.get('error_kind') != ERROR_CIRCUIT_OPEN
+            ]
+            written = self.ingest_writer.submit_many(results)
             
+            success_count = sum(1 for _, usage_info in results if usage_info['is_success'])
+            logger.info(f"组 '{group_name}' 检查完成: {success_count}/{len(batch['key_ids'])} 成功")
+            return written
+        
         except Exception as e:
-            logger.error(f"检查组 {group_id} 用量时发生严重错误: {e}")
-            self.db.session.rollback()
+            logger.error(f"检查组 {group_name} 用量时发生严重错误: {e}")
+            if progress is not None:
+                raise
+            return None
+    
+    def _wait_written(self, pending_writes, strict=False):
+        """
+        等待查询结果写入数据库
+        
+        strict 为 True 时（立即检查任务），等待超时或有结果写入失败则抛出异常
+        """
+        for written in pending_writes:
+            if not written.wait(Config.INGEST_WAIT_TIMEOUT):
+                logger.error(f"等待用量写入超过 {Config.INGEST_WAIT_TIMEOUT} 秒")
+                if strict:
+                    raise TimeoutError(f"等待用量写入超过 {Config.INGEST_WAIT_TIMEOUT} 秒")
+            elif written.failed and strict:
+                raise RuntimeError(f"{written.failed} 条查询结果写入数据库失败")
     
-    def check_all_groups_now(self):
-        """立即检查所有活跃组的用量（并发执行不同组）"""
+    def check_keys_now(self, key_ids, wait=False, progress=None):
+        """
+        立即查询指定的密钥（如批量导入后的首次查询）
+        
+        按所属组提交到共享执行器，与定时查询使用相同的并发查询和批量写入路径
+        """
+        if self.app is None:
+            return self._check_keys_now(key_ids, wait, progress)
+        
+        with self.app.app_context():
+            return self._check_keys_now(key_ids, wait, progress)
+    
+    def _check_keys_now(self, key_ids, wait=False, progress=None):
+        from models import ApiGroup, ApiKey
+        
+        rows = []
+        key_ids = list(key_ids)
+        for start in range(0, len(key_ids), 500):
+            rows.extend(self.db.session.query(ApiKey.id, ApiKey.api_key, ApiKey.group_id).filter(
+                ApiKey.id.in_(key_ids[start:start + 500]),
+                ApiKey.is_active == True
+            ).all())
+        if not rows:
+            return
+        
+        group_names = dict(self.db.session.query(ApiGroup.id, ApiGroup.name).all())
+        keys_by_group = {}
+        for key_id, api_key, group_id in sorted(rows):
+            keys_by_group.setdefault(group_id, []).append((key_id, api_key))
+        
+        batches = [
+            {
+                'group_id': group_id,
+                'group_name': group_names.get(group_id, group_id),
+                'key_ids': [key_id for key_id, _ in keys],
+                'tasks': self._submit_polls(group_id, [api_key for _, api_key in keys])
+            }
+            for group_id, keys in keys_by_group.items()
+        ]
+        logger.info(f"开始查询 {len(rows)} 个指定的API密钥")
+        if progress is not None:
+            progress.add_total(len(rows))
+        
+        pending_writes, errors = self._finish_batches(batches, progress)
+        if wait:
+            self._wait_written(pending_writes, strict=progress is not None)
+        if errors:
+            raise errors[0]
+    
+    def _finish_batches(self, batches, progress=None):
+        """
+        依次等待各批次的查询结果并交给写入线程
+        
+        一个批次出错不影响其他批次；立即检查任务（传入 progress）中的错误被收集返回
+        
+        Returns:
+            tuple: (写入状态列表, 异常列表)
+        """
+        pending_writes = []
+        errors = []
+        for completed, batch in enumerate(batches, 1):
+            try:
+                written = self._finish_group(batch, progress)
+            except Exception as e:
+                errors.append(e)
+                continue
+            if written is not None:
+                pending_writes.append(written)
+            if len(batches) > 1:
+                logger.info(f"组 '{batch['group_name']}' 检查完成 ({completed}/{len(batches)})")
+        return pending_writes, errors
+    
+    def check_all_groups_now(self, wait=False, progress=None):
+        """立即检查所有活跃组的用量（先提交所有组的查询，由共享执行器在各组之间轮转执行）"""
+        if self.app is None:
+            return self._check_all_groups_now(wait, progress)
+        
+        with self.app.app_context():
+            return self._check_all_groups_now(wait, progress)
+    
+    def _check_all_groups_now(self, wait=False, progress=None):
         from models import ApiGroup
         
         try:
@@ -172,37 +738,73 @@ class SchedulerService:
             
             logger.info(f"开始并发检查 {len(groups)} 个组的用量")
             
-            # 使用线程池并发执行不同组的检查
-            with ThreadPoolExecutor(max_workers=min(len(groups), self.max_workers)) as executor:
-                # 提交所有组的检查任务
-                future_to_group = {
-                    executor.submit(self.check_group_usage, group.id): group 
-                    for group in groups
-                }
-                
-                # 等待所有任务完成
-                completed = 0
-                for future in as_completed(future_to_group):
-                    group = future_to_group[future]
-                    try:
-                        future.result()  # 获取结果（如果有异常会抛出）
-                        completed += 1
-                        logger.info(f"组 '{group.name}' 检查完成 ({completed}/{len(groups)})")
-                    except Exception as e:
-                        logger.error(f"组 '{group.name}' 检查失败: {e}")
+            batches = []
+            errors = []
+            for group in groups:
+                try:
+                    batch = self._dispatch_group(group.id, progress=progress)
+                except Exception as e:
+                    logger.error(f"组 '{group.name}' 检查失败: {e}")
+                    self.db.session.rollback()
+                    errors.append(e)
+                    continue
+                if batch:
+                    batches.append(batch)
             
-            logger.info("所有组的用量检查完成")
+            # 按提交顺序收集结果，各组的查询已经在执行器中并发进行
+            pending_writes, finish_errors = self._finish_batches(batches, progress)
+            errors.extend(finish_errors)
+            
+            if wait:
+                self._wait_written(pending_writes, strict=progress is not None)
             
+            if errors:
+                raise RuntimeError(f"{len(errors)} 个组检查失败: {errors[0]}")
+            logger.info("所有组的用量检查完成")
+        
         except Exception as e:
             logger.error(f"并发检查所有组时发生错误: {e}")
+            if progress is not None:
+                raise
+    
+    def _on_job_event(self, event):
+        """调度器事件：任务提交时记录实际时间与计划运行时间的差"""
+        if event.code == EVENT_JOB_SUBMITTED:
+            lag = (datetime.now(timezone.utc) - max(event.scheduled_run_times)).total_seconds()
+            SCHEDULER_LAG_SECONDS.observe(max(lag, 0), job=event.job_id)
+        else:
+            SCHEDULER_MISSED.inc(job=event.job_id)
+    
+    def collect_metrics(self):
+        """导出指标前更新队列深度、熔断器状态和定时任务的超期时间"""
+        POLL_QUEUE_DEPTH.set(self.poll_executor.get_stats()['queued'])
+        INGEST_QUEUE_DEPTH.set(self.ingest_writer.queue.qsize())
+        
+        deepl_service = self.async_deepl_service or self.deepl_service
+        for breaker in deepl_service.circuit_breakers.values():
+            DEEPL_BREAKER_OPEN.set(0 if breaker.state == 'closed' else 1, api_type=breaker.name)
+        
+        # 每次导出重新生成全部序列，已删除的组任务不再导出
+        overdue = []
+        if self.scheduler.running:
+            now = datetime.now(timezone.utc)
+            for job in self.scheduler.get_jobs():
+                if job.next_run_time is not None:
+                    overdue.append((max((now - job.next_run_time).total_seconds(), 0), {'job': job.id}))
+        SCHEDULER_OVERDUE.replace(overdue)
     
     def get_scheduler_status(self):
         """获取调度器状态信息"""
-        from models import ApiGroup
+        from models import ApiGroup, PollerNode
         
         status = {
             'running_jobs': len(self.group_jobs),
             'total_jobs': len(self.scheduler.get_jobs()),
+            'executor': self.poll_executor.get_stats(),
+            'ingest': self.ingest_writer.get_stats(),
+            'leader': self.leader_lease.get_status() if self.leader_lease else None,
+            'shard': self.shard.get_status() if self.shard else None,
+            'pollers': [node.to_dict() for node in PollerNode.query.order_by(PollerNode.node_id).all()],
             'groups': []
         }
         
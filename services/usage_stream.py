@@ -0,0 +1,160 @@
+import json
+import queue
+import threading
+import logging
+from config import Config
+from services.usage_summary import query_summary
+
+logger = logging.getLogger(__name__)
+
+class UsageStreamBroker:
+    """
+    用量推送服务 - 通过 Server-Sent Events 向页面推送变化的密钥用量
+    
+    每个进程一个后台线程：有订阅者时检查数据版本号，用量版本变化后从最新用量表
+    找出检查时间变化的密钥，只查询这些密钥的摘要并序列化一次，再放入每个订阅者的队列，
+    因此数据库负载与打开的页面数量无关。本进程写入用量后立即唤醒线程，
+    其他进程（如独立查询进程）写入的用量最多延迟 USAGE_STREAM_CHECK_INTERVAL 秒。
+    组或密钥配置变化时推送 reload 事件，由页面重新加载完整摘要。
+    """
+    
+    def __init__(self, db, app, check_interval=None, client_queue_size=None):
+        self.db = db
+        self.app = app
+        self.check_interval = check_interval or Config.USAGE_STREAM_CHECK_INTERVAL
+        self.client_queue_size = client_queue_size or Config.USAGE_STREAM_CLIENT_QUEUE
+        
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        
+        self._versions = None
+        self._check_times = {}  # api_key_id -> 已推送的检查时间
+        self._stats = {'events': 0, 'rows': 0, 'dropped': 0}
+    
+    def notify(self, *args):
+        """唤醒推送线程（作为用量写入回调使用）"""
+        self._wake.set()
+    
+    def subscribe(self):
+        """新增订阅者，返回其消息队列"""
+        client = queue.Queue(maxsize=self.client_queue_size)
+        with self._lock:
+            self._subscribers.add(client)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='usage-stream', daemon=True)
+                self._thread.start()
+        return client
+    
+    def unsubscribe(self, client):
+        with self._lock:
+            self._subscribers.discard(client)
+    
+    def publish(self, event, data, event_id=None):
+        """序列化一次消息并放入所有订阅者的队列"""
+        message = f"event: {event}\n"
+        if event_id is not None:
+            message += f"id: {event_id}\n"
+        message += f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for client in subscribers:
+            try:
+                client.put_nowait(message)
+            except queue.Full:
+                # 页面处理不过来：丢弃积压的消息，让页面重新加载完整摘要
+                self._drain(client)
+                client.put_nowait("event: reload\ndata: {}\n\n")
+                self._stats['dropped'] += 1
+        self._stats['events'] += 1
+    
+    def _drain(self, client):
+        try:
+            while True:
+                client.get_nowait()
+        except queue.Empty:
+            pass
+    
+    def stream(self, client):
+        """
+        生成发送给一个订阅者的 SSE 消息
+        
+        空闲时定期发送注释行保持连接，也用于及时发现已断开的连接。
+        """
+        try:
+            yield f"retry: {Config.USAGE_STREAM_RETRY_MS}\n\n"
+            while True:
+                try:
+                    yield client.get(timeout=Config.USAGE_STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+        finally:
+            self.unsubscribe(client)
+    
+    def _run(self):
+        while True:
+            # 启动后立即记录基准，之后每次唤醒或到达检查间隔时比较
+            try:
+                with self.app.app_context():
+                    self.check_changes()
+            except Exception as e:
+                logger.error(f"检查用量变化失败: {e}")
+            
+            self._wake.wait(self.check_interval)
+            self._wake.clear()
+            
+            with self._lock:
+                if not self._subscribers:
+                    # 没有订阅者时退出，下一个订阅者会重新启动线程
+                    self._thread = None
+                    self._versions = None
+                    return
+    
+    def check_changes(self):
+        """比较数据版本号，推送变化的密钥用量（需要应用上下文）"""
+        from models import DataVersion, LatestUsage
+        
+        versions = DataVersion.current()
+        previous = self._versions
+        self._versions = versions
+        
+        check_times = dict(self.db.session.query(LatestUsage.api_key_id, LatestUsage.check_time).all())
+        if previous is None:
+            # 刚启动：页面连接后会自行加载完整摘要，这里只记录基准
+            self._check_times = check_times
+            return
+        
+        if versions.get('config') != previous.get('config'):
+            self._check_times = check_times
+            self.publish('reload', {}, event_id=versions.get('usage'))
+            return
+        
+        if versions.get('usage') == previous.get('usage'):
+            return
+        
+        changed = [
+            api_key_id for api_key_id, check_time in check_times.items()
+            if self._check_times.get(api_key_id) != check_time
+        ]
+        self._check_times = check_times
+        if not changed:
+            return
+        
+        rows = query_summary(self.db, changed)
+        if rows:
+            self.publish('usage', rows, event_id=versions.get('usage'))
+            self._stats['rows'] += len(rows)
+    
+    def get_stats(self):
+        """获取订阅者数量和推送统计"""
+        with self._lock:
+            subscribers = len(self._subscribers)
+        stats = dict(self._stats)
+        stats.update({
+            'subscribers': subscribers,
+            'running': self._thread is not None and self._thread.is_alive(),
+            'check_interval': self.check_interval
+        })
+        return stats
@@ -0,0 +1,71 @@
+from datetime import datetime
+
+def query_summary(db, key_ids=None):
+    """
+    从最新用量表单次查询启用密钥的用量摘要（需要应用上下文）
+    
+    Args:
+        key_ids (iterable): 只查询这些密钥，默认查询全部
+    """
+    from models import ApiKey, LatestUsage
+    
+    query = db.session.query(ApiKey, LatestUsage).outerjoin(
+        LatestUsage, LatestUsage.api_key_id == ApiKey.id
+    ).filter(ApiKey.is_active == True)
+    if key_ids is not None:
+        query = query.filter(ApiKey.id.in_(list(key_ids)))
+    
+    return [build_summary_item(key, record) for key, record in query.order_by(ApiKey.id).all()]
+
+def summary_expires_at(items):
+    """摘要中 is_expired 下一次变化的时间：尚未到期的 Pro 密钥中最早的计费周期结束时间"""
+    end_times = [
+        datetime.fromisoformat(item['billing_end_time']) for item in items
+        if item.get('is_expired') is False and item.get('billing_end_time') and item['api_type'] == 'pro'
+    ]
+    return min(end_times, default=None)
+
+def build_summary_item(key, latest_record):
+    """构建单个API密钥的用量摘要"""
+    if latest_record:
+        # 对于Pro API，使用api_key_character_count/limit字段
+        if key.api_type == 'pro' and latest_record.api_key_character_count is not None:
+            character_count = latest_record.api_key_character_count
+            character_limit = latest_record.api_key_character_limit or 0
+        else:
+            character_count = latest_record.character_count
+            character_limit = latest_record.character_limit
+        
+        # 判断是否过期（仅Pro API有计费周期）
+        is_expired = False
+        if key.api_type == 'pro' and key.billing_end_time:
+            is_expired = datetime.utcnow() > key.billing_end_time
+        
+        return {
+            'key_id': key.id,
+            'key_name': key.name,
+            'api_key': key.api_key,  # 添加完整密钥
+            'api_type': key.api_type,
+            'character_count': character_count,
+            'character_limit': character_limit,
+            'usage_percentage': (character_count / character_limit * 100) if character_limit > 0 else 0,
+            'last_check': latest_record.check_time.isoformat(),
+            'group_id': key.group_id,
+            'is_expired': is_expired,
+            'billing_end_time': key.billing_end_time.isoformat() if key.billing_end_time else None,
+            'status': key.status or 'active'
+        }
+    
+    # 即使没有使用记录，也显示API密钥
+    return {
+        'key_id': key.id,
+        'key_name': key.name,
+        'api_key': key.api_key,  # 添加完整密钥
+        'api_type': key.api_type,
+        'character_count': 0,
+        'character_limit': 0,
+        'usage_percentage': 0,
+        'last_check': None,
+        'group_id': key.group_id,
+        'status': key.status or 'active'
+    }
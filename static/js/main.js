@@ -2,6 +2,8 @@
 let usageChart = null;
 let apiUsageChart = null;
 let selectedGroupId = null;
+let apiKeysSummary = {};  // key_id -> 用量摘要
+let usageStream = null;
 
 // 显示Toast通知
 function showToast(message, type = 'info') {
@@ -34,6 +36,10 @@ function showToast(message, type = 'info') {
 // 加载API密钥摘要
 function loadApiKeysSummary() {
     $.get('/api/usage/summary', function(data) {
+        apiKeysSummary = {};
+        data.forEach(item => {
+            apiKeysSummary[item.key_id] = item;
+        });
         updateOverviewCards(data);
         updateApiKeysTable(data);
     }).fail(function() {
@@ -91,68 +97,123 @@ function updateApiKeysTable(data) {
     tbody.empty();
     
     data.forEach(item => {
-        const usagePercent = item.usage_percentage.toFixed(1);
-        const progressColor = getProgressColor(usagePercent);
-        const lastCheck = item.last_check ? new Date(item.last_check).toLocaleString('zh-CN') : '从未检查';
-        const groupName = groupsCache[item.group_id] || '未知组';
+        tbody.append(renderApiKeyRow(item));
+    });
+}
+
+// 生成单个API密钥的表格行
+function renderApiKeyRow(item) {
+    const usagePercent = item.usage_percentage.toFixed(1);
+    const progressColor = getProgressColor(usagePercent);
+    const lastCheck = item.last_check ? new Date(item.last_check).toLocaleString('zh-CN') : '从未检查';
+    const groupName = groupsCache[item.group_id] || '未知组';
+    
+    // 处理状态显示
+    let statusBadge = '';
+    let statusIndicator = '';
+    if (item.status === 'quarantined') {
+        statusBadge = '<span class="badge bg-dark" title="连续认证失败，已暂停定时查询，仅定期重新探测">已隔离</span>';
+        statusIndicator = '<span class="status-indicator inactive"></span>';
+    } else if (item.api_type === 'pro' && item.is_expired) {
+        statusBadge = '<span class="badge bg-danger">已过期</span>';
+        statusIndicator = '<span class="status-indicator inactive"></span>';
+    } else if (item.character_limit === 0) {
+        statusBadge = '<span class="badge bg-warning">未检查</span>';
+        statusIndicator = '<span class="status-indicator inactive"></span>';
+    } else if (item.usage_percentage >= 99) {
+        statusBadge = '<span class="badge bg-danger">已用尽</span>';
+        statusIndicator = '<span class="status-indicator inactive"></span>';
+    } else if (item.usage_percentage >= 90) {
+        statusBadge = '<span class="badge bg-warning">即将用尽</span>';
+        statusIndicator = '<span class="status-indicator active"></span>';
+    } else {
+        statusBadge = '<span class="badge bg-success">正常</span>';
+        statusIndicator = '<span class="status-indicator active"></span>';
+    }
+    
+    const row = `
+        <tr class="fade-in api-key-row" data-key-id="${item.key_id}" data-group-id="${item.group_id}" 
+            data-api-key="${item.api_key || ''}" data-api-name="${item.key_name}"
+            onclick="showApiDetails(${item.key_id})" style="cursor: pointer;">
+            <td>
+                ${statusIndicator}
+                ${item.key_name}
+            </td>
+            <td>
+                <span class="badge bg-${item.api_type === 'pro' ? 'primary' : 'secondary'}">
+                    ${item.api_type.toUpperCase()}
+                </span>
+            </td>
+            <td>${groupName}</td>
+            <td>${item.character_limit > 0 ? formatNumber(item.character_count) + ' / ' + formatNumber(item.character_limit) : '未检查'}</td>
+            <td>
+                <div class="progress" style="min-width: 100px;">
+                    <div class="progress-bar bg-${progressColor}" style="width: ${usagePercent}%">
+                        ${usagePercent}%
+                    </div>
+                </div>
+            </td>
+            <td><small>${lastCheck}</small></td>
+            <td>${statusBadge}</td>
+            <td onclick="event.stopPropagation();">
+                <div class="btn-group btn-group-sm">
+                    <button class="btn btn-outline-success" onclick="checkSingleKey(${item.key_id})" title="立即检查">
+                        <i class="bi bi-arrow-clockwise"></i>
+                    </button>
+                    <button class="btn btn-outline-danger" onclick="deleteApiKey(${item.key_id})" title="删除">
+                        <i class="bi bi-trash"></i>
+                    </button>
+                </div>
+            </td>
+        </tr>
+    `;
+    return row;
+}
+
+// 按推送的摘要原地更新变化的行
+function patchApiKeysTable(items) {
+    const tbody = $('#api-keys-tbody');
+    
+    items.forEach(item => {
+        apiKeysSummary[item.key_id] = item;
         
-        // 处理状态显示
-        let statusBadge = '';
-        let statusIndicator = '';
-        if (item.api_type === 'pro' && item.is_expired) {
-            statusBadge = '<span class="badge bg-danger">已过期</span>';
-            statusIndicator = '<span class="status-indicator inactive"></span>';
-        } else if (item.character_limit === 0) {
-            statusBadge = '<span class="badge bg-warning">未检查</span>';
-            statusIndicator = '<span class="status-indicator inactive"></span>';
-        } else if (item.usage_percentage >= 99) {
-            statusBadge = '<span class="badge bg-danger">已用尽</span>';
-            statusIndicator = '<span class="status-indicator inactive"></span>';
-        } else if (item.usage_percentage >= 90) {
-            statusBadge = '<span class="badge bg-warning">即将用尽</span>';
-            statusIndicator = '<span class="status-indicator active"></span>';
+        const row = $(renderApiKeyRow(item));
+        const oldRow = $(`.api-key-row[data-key-id="${item.key_id}"]`);
+        if (oldRow.length) {
+            oldRow.replaceWith(row);
         } else {
-            statusBadge = '<span class="badge bg-success">正常</span>';
-            statusIndicator = '<span class="status-indicator active"></span>';
+            tbody.append(row);
         }
         
-        const row = `
-            <tr class="fade-in api-key-row" data-key-id="${item.key_id}" data-group-id="${item.group_id}" 
-                data-api-key="${item.api_key || ''}" data-api-name="${item.key_name}"
-                onclick="showApiDetails(${item.key_id})" style="cursor: pointer;">
-                <td>
-                    ${statusIndicator}
-                    ${item.key_name}
-                </td>
-                <td>
-                    <span class="badge bg-${item.api_type === 'pro' ? 'primary' : 'secondary'}">
-                        ${item.api_type.toUpperCase()}
-                    </span>
-                </td>
-                <td>${groupName}</td>
-                <td>${item.character_limit > 0 ? formatNumber(item.character_count) + ' / ' + formatNumber(item.character_limit) : '未检查'}</td>
-                <td>
-                    <div class="progress" style="min-width: 100px;">
-                        <div class="progress-bar bg-${progressColor}" style="width: ${usagePercent}%">
-                            ${usagePercent}%
-                        </div>
-                    </div>
-                </td>
-                <td><small>${lastCheck}</small></td>
-                <td>${statusBadge}</td>
-                <td onclick="event.stopPropagation();">
-                    <div class="btn-group btn-group-sm">
-                        <button class="btn btn-outline-success" onclick="checkSingleKey(${item.key_id})" title="立即检查">
-                            <i class="bi bi-arrow-clockwise"></i>
-                        </button>
-                        <button class="btn btn-outline-danger" onclick="deleteApiKey(${item.key_id})" title="删除">
-                            <i class="bi bi-trash"></i>
-                        </button>
-                    </div>
-                </td>
-            </tr>
-        `;
-        tbody.append(row);
+        // 保持当前的组筛选
+        if (selectedGroupId && item.group_id != selectedGroupId) {
+            row.hide();
+        }
+    });
+    
+    updateOverviewCards(Object.values(apiKeysSummary));
+}
+
+// 订阅用量推送，浏览器不支持时退回定时刷新
+function startUsageStream() {
+    if (!window.EventSource) {
+        loadApiKeysSummary();
+        setInterval(loadApiKeysSummary, 30000); // 每30秒刷新一次
+        return;
+    }
+    
+    usageStream = new EventSource('/api/usage/stream');
+    
+    // 连接（或断线重连）后加载一次完整摘要，之后只接收变化的行
+    usageStream.addEventListener('open', function() {
+        loadApiKeysSummary();
+    });
+    usageStream.addEventListener('usage', function(event) {
+        patchApiKeysTable(JSON.parse(event.data));
+    });
+    usageStream.addEventListener('reload', function() {
+        loadGroupsCache();
+        loadApiKeysSummary();
     });
 }
 
@@ -199,6 +260,7 @@ function showAddGroupModal() {
 function createGroup() {
     const name = $('#groupName').val();
     const queryInterval = parseInt($('#queryInterval').val());
+    const pollingMode = $('#pollingMode').val();
     const isActive = $('#groupActive').is(':checked');
     
     if (!name) {
@@ -213,6 +275,7 @@ function createGroup() {
         data: JSON.stringify({
             name: name,
             query_interval: queryInterval,
+            polling_mode: pollingMode,
             is_active: isActive
         }),
         success: function(response) {
@@ -283,19 +346,42 @@ function deleteApiKey(keyId) {
     });
 }
 
-// 立即检查指定组
-function checkGroupNow(groupId) {
-    $.get(`/api/check-now/${groupId}`, function(response) {
-        showToast(response.message, 'success');
+// 提交立即检查任务，并跟踪任务进度
+function submitCheckJob(url) {
+    $.post(url, function(response) {
+        showToast(response.message, 'info');
+        watchCheckJob(response.job_id);
     }).fail(function() {
         showToast('检查失败', 'error');
     });
 }
 
+// 轮询检查任务状态，结束后提示结果（用量变化由推送更新到表格）
+function watchCheckJob(jobId) {
+    $.get(`/api/check-jobs/${jobId}`, function(job) {
+        if (job.status === 'queued' || job.status === 'running') {
+            setTimeout(() => watchCheckJob(jobId), 1000);
+        } else if (job.status === 'succeeded') {
+            const message = job.failed > 0
+                ? `检查完成：${job.completed - job.failed}/${job.total} 成功`
+                : `检查完成：共 ${job.total} 个API密钥`;
+            showToast(message, job.failed > 0 ? 'warning' : 'success');
+        } else {
+            showToast(`检查失败：${job.error || '未知错误'}`, 'error');
+        }
+    }).fail(function() {
+        showToast('获取检查进度失败', 'error');
+    });
+}
+
+// 立即检查指定组
+function checkGroupNow(groupId) {
+    submitCheckJob(`/api/check-now/${groupId}`);
+}
+
 // 检查所有组
 function checkAllGroups() {
-    showToast('开始检查所有组的API用量...', 'info');
-    // TODO: 实现检查所有组的功能
+    submitCheckJob('/api/check-now/all');
 }
 
 // 全局变量存储当前查看的API信息
@@ -402,8 +488,9 @@ function showApiDetails(keyId) {
 // 加载用量数据
 function loadUsageData(period) {
     const hours = period === 'day' ? 720 : 24; // 30天或24小时
+    const query = period === 'day' ? `bucket=day&hours=${hours}` : `hours=${hours}`;
     
-    $.get(`/api/usage/${currentApiId}?period=${period}&hours=${hours}`, function(data) {
+    $.get(`/api/usage/${currentApiId}?${query}`, function(data) {
         if (period === 'hour') {
             displayHourlyUsage(data);
         } else {
@@ -723,6 +810,7 @@ function editGroup(groupId) {
             $('#editGroupId').val(group.id);
             $('#editGroupName').val(group.name);
             $('#editQueryInterval').val(group.query_interval);
+            $('#editPollingMode').val(group.polling_mode || 'fixed');
             $('#editGroupActive').prop('checked', group.is_active);
             
             // 显示模态框
@@ -740,6 +828,7 @@ function updateGroup() {
     const groupId = $('#editGroupId').val();
     const name = $('#editGroupName').val();
     const queryInterval = parseInt($('#editQueryInterval').val());
+    const pollingMode = $('#editPollingMode').val();
     const isActive = $('#editGroupActive').is(':checked');
     
     if (!name || queryInterval < 60) {
@@ -754,6 +843,7 @@ function updateGroup() {
         data: JSON.stringify({
             name: name,
             query_interval: queryInterval,
+            polling_mode: pollingMode,
             is_active: isActive
         }),
         success: function() {
@@ -806,15 +896,6 @@ function deleteGroup() {
 
 // 检查单个API密钥
 function checkSingleKey(keyId) {
-    // 找到该密钥所属的组ID
-    const keyRow = $(`.api-key-row[data-key-id="${keyId}"]`);
-    const groupId = keyRow.data('group-id');
-    
-    if (groupId) {
-        showToast('正在检查API密钥...', 'info');
-        checkGroupNow(groupId);
-    } else {
-        showToast('无法找到API密钥所属的组', 'error');
-    }
+    submitCheckJob(`/api/check-now/key/${keyId}`);
 }
 
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+# 测试直接导入项目根目录下的模块
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from support import WebhookStub
+
+@pytest.fixture
+def app(tmp_path):
+    """使用临时 SQLite 数据库的应用（已进入应用上下文并建好表，不启动调度器）"""
+    from app import create_app
+    from models import db
+    
+    class TestConfig(Config):
+        SQLALCHEMY_DATABASE_URI = f"sqlite:///{tmp_path / 'monitor.db'}"
+        SQLALCHEMY_ENGINE_OPTIONS = {}
+        EMBEDDED_SCHEDULER_ENABLED = False  # 测试中请求接口时不启动调度器
+    
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+
+@pytest.fixture
+def group(app):
+    from models import db, ApiGroup
+    
+    group = ApiGroup(name='g', query_interval=3600, is_active=True)
+    db.session.add(group)
+    db.session.commit()
+    return group
+
+@pytest.fixture
+def make_key(group):
+    """创建API密钥：make_key(name, api_type='free', **字段)"""
+    from models import db, ApiKey
+    
+    def make(name, api_type='free', **fields):
+        fields.setdefault('group_id', group.id)
+        key = ApiKey(name=name, api_key=f'{name}-key' + (':fx' if api_type == 'free' else ''), api_type=api_type, **fields)
+        db.session.add(key)
+        db.session.commit()
+        return key
+    
+    return make
+
+@pytest.fixture
+def stub():
+    """本地 webhook 桩服务"""
+    server = WebhookStub()
+    yield server
+    server.close()
@@ -0,0 +1,88 @@
+"""测试共用的辅助类和函数"""
+import json
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class WebhookStub:
+    """记录收到的 POST 请求体，按 statuses 依次返回状态码（用完后返回 200）"""
+    
+    def __init__(self, statuses=()):
+        self.statuses = list(statuses)
+        self.requests = []
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                stub.requests.append(json.loads(body))
+                self.send_response(stub.statuses.pop(0) if stub.statuses else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/hook'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+class DeepLStub:
+    """
+    DeepL /usage 接口桩服务
+    
+    responses 中依次为状态码或 (状态码, 响应头字典)，用完后返回 200 和 usage
+    """
+    
+    def __init__(self, responses=(), usage=None):
+        self.responses = list(responses)
+        self.usage = usage or {'character_count': 100, 'character_limit': 500000}
+        self.requests = 0
+        stub = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests += 1
+                response = stub.responses.pop(0) if stub.responses else 200
+                status, headers = response if isinstance(response, tuple) else (response, {})
+                body = json.dumps(stub.usage if status == 200 else {'message': 'stub error'}).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/v2'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+    
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+def usage(count, limit=1000, api_type='free', check_time=None, **fields):
+    """一次成功查询的用量信息（与 DeepLService 的返回格式相同）"""
+    return dict(
+        is_success=True, character_count=count, character_limit=limit,
+        api_type=api_type, check_time=check_time or datetime.utcnow(), **fields
+    )
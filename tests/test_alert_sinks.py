@@ -0,0 +1,109 @@
+"""告警通知：用本地 HTTP 桩服务验证 webhook 的发送、重试、去重和重新发送"""
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import Config
+from services import alert_sinks
+from services.alert_sinks import DeliveryError, WebhookSink
+from support import usage, wait_until
+
+class Rule:
+    name = 'stub'
+    
+    def __init__(self, url):
+        self.webhook_url = url
+
+@pytest.fixture(autouse=True)
+def no_retry_sleep(monkeypatch):
+    monkeypatch.setattr(alert_sinks.time, 'sleep', lambda seconds: None)
+
+def test_webhook_retries_server_errors(stub):
+    stub.statuses = [503, 500]
+    sink = WebhookSink(retries=2)
+    try:
+        sink.send(Rule(stub.url), {'event': 'firing', 'api_key_id': 1}).result(timeout=5)
+    finally:
+        sink.shutdown()
+    
+    assert len(stub.requests) == 3
+    assert all(body == {'event': 'firing', 'api_key_id': 1} for body in stub.requests)
+
+def test_webhook_raises_after_retries(stub):
+    stub.statuses = [500, 500]
+    sink = WebhookSink(retries=1)
+    try:
+        with pytest.raises(DeliveryError, match='HTTP 500'):
+            sink.send(Rule(stub.url), {'event': 'firing'}).result(timeout=5)
+    finally:
+        sink.shutdown()
+    
+    assert len(stub.requests) == 2
+
+@pytest.fixture
+def alert_app(app, make_key, stub):
+    from models import db, AlertRule
+    
+    make_key('k1', id=1)
+    db.session.add(AlertRule(id=1, name='quota', rule_type='percent', threshold=80,
+                             sink='webhook', webhook_url=stub.url, is_active=True))
+    db.session.commit()
+    yield app
+    app.extensions['monitor'].alert_service.shutdown()
+
+def delivered(app):
+    from models import db, AlertState
+    
+    with app.app_context():
+        state = db.session.get(AlertState, (1, 1))
+        return state is not None and state.pending_event is None
+
+def test_firing_and_resolved_are_posted_once(alert_app, stub):
+    service = alert_app.extensions['monitor'].alert_service
+    
+    events = service.evaluate([(1, usage(900))])
+    assert [event['event'] for event in events] == ['firing']
+    assert wait_until(lambda: len(stub.requests) == 1 and delivered(alert_app))
+    assert stub.requests[0]['event'] == 'firing'
+    assert stub.requests[0]['value'] == 90.0
+    assert stub.requests[0]['key_name'] == 'k1'
+    
+    # 持续触发期间不重复通知
+    assert service.evaluate([(1, usage(950))]) == []
+    
+    service.evaluate([(1, usage(100))])
+    assert wait_until(lambda: len(stub.requests) == 2 and delivered(alert_app))
+    assert stub.requests[1]['event'] == 'resolved'
+    assert stub.requests[1]['value'] == 10.0
+    
+    time.sleep(0.1)
+    assert len(stub.requests) == 2
+
+def test_failed_notification_is_redelivered(alert_app, stub):
+    from models import db, AlertState
+    
+    service = alert_app.extensions['monitor'].alert_service
+    stub.statuses = [500] * (Config.ALERT_WEBHOOK_RETRIES + 1)
+    
+    service.evaluate([(1, usage(900))])
+    
+    def failed_once():
+        db.session.expire_all()
+        state = db.session.get(AlertState, (1, 1))
+        return state.delivery_attempts == 1
+    
+    assert wait_until(failed_once)
+    state = db.session.get(AlertState, (1, 1))
+    assert state.status == 'firing'
+    assert state.pending_event is not None
+    assert state.delivery_error == 'HTTP 500'
+    assert state.next_delivery_at > datetime.utcnow()
+    
+    # 未到重新发送时间
+    assert service.redeliver_pending() == 0
+    
+    assert service.redeliver_pending(now=datetime.utcnow() + timedelta(hours=1)) == 1
+    assert wait_until(lambda: delivered(alert_app))
+    assert len(stub.requests) == Config.ALERT_WEBHOOK_RETRIES + 2
+    assert stub.requests[-1]['event'] == 'firing'
@@ -0,0 +1,162 @@
+"""接口：响应缓存的 ETag / 304 和批量导入去重"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from support import wait_until
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+def bump(app, *names):
+    """模拟其他进程修改数据：递增版本号，本进程下一次请求时重新读取"""
+    from models import db, DataVersion
+    
+    DataVersion.bump(*names)
+    db.session.commit()
+    app.extensions['monitor'].response_cache.invalidate()
+
+@pytest.mark.parametrize('path, name', [('/api/groups', 'config'), ('/api/usage/summary', 'usage')])
+def test_unchanged_response_returns_304(app, client, group, path, name):
+    first = client.get(path)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert etag.startswith('W/')
+    assert first.headers['Cache-Control'] == 'no-cache'
+    
+    second = client.get(path, headers={'If-None-Match': etag})
+    assert second.status_code == 304
+    assert second.data == b''
+    
+    # 依赖的数据版本变化后返回新内容和新的 ETag
+    bump(app, name)
+    third = client.get(path, headers={'If-None-Match': etag})
+    assert third.status_code == 200
+    assert third.headers['ETag'] != etag
+
+def test_unrelated_version_keeps_etag(app, client, group):
+    etag = client.get('/api/groups').headers['ETag']
+    
+    bump(app, 'usage')
+    assert client.get('/api/groups', headers={'If-None-Match': etag}).status_code == 304
+
+def test_summary_etag_changes_when_billing_period_ends(app, client, make_key):
+    from models import db, LatestUsage
+    
+    end_time = datetime.utcnow() + timedelta(seconds=1)
+    key = make_key('pro1', api_type='pro', billing_end_time=end_time)
+    db.session.add(LatestUsage(api_key_id=key.id, check_time=datetime.utcnow(), character_count=10, character_limit=100))
+    db.session.commit()
+    
+    response = client.get('/api/usage/summary')
+    assert end_time.strftime('%Y%m%d%H%M%S') in response.headers['ETag']
+    assert response.get_json()[0]['is_expired'] is False
+    
+    # 计费周期结束后不需要版本号变化也会重新生成，is_expired 随之变化
+    wait_until(lambda: datetime.utcnow() > end_time)
+    expired = client.get('/api/usage/summary', headers={'If-None-Match': response.headers['ETag']})
+    assert expired.status_code == 200
+    assert expired.get_json()[0]['is_expired'] is True
+
+def test_bulk_import_deduplicates(client, group, make_key):
+    make_key('existing')
+    
+    response = client.post('/api/keys/bulk', json={
+        'group_id': group.id,
+        'keys': [
+            'new-key-0000001:fx',
+            {'api_key': 'new-key-0000002', 'name': 'pro'},
+            ' new-key-0000001:fx ',  # 与前面的行重复（去掉空白后）
+            'existing-key:fx',       # 与已有密钥重复
+            'short'
+        ]
+    })
+    
+    data = response.get_json()
+    assert response.status_code == 200
+    assert (data['created'], data['duplicate'], data['invalid']) == (2, 2, 1)
+    messages = {result['row']: result.get('message') for result in data['results']}
+    assert messages[3] == '与前面的行重复'
+    assert messages[4] == 'API密钥已存在'
+    
+    # 再次导入同样的密钥全部为重复
+    again = client.post('/api/keys/bulk', json={'group_id': group.id, 'keys': ['new-key-0000001:fx', 'new-key-0000002']})
+    assert again.get_json()['duplicate'] == 2
+    assert again.get_json()['created'] == 0
+
+def test_bulk_import_csv_with_unknown_group(client, group):
+    response = client.post(
+        f'/api/keys/bulk?group_id={group.id}',
+        data='api_key,name,group_id\nnew-key-0000003:fx,a,\nnew-key-0000004:fx,b,999\n',
+        content_type='text/csv'
+    )
+    
+    data = response.get_json()
+    assert (data['created'], data['invalid']) == (1, 1)
+    assert data['results'][1]['message'] == '组不存在'
+
+def test_bulk_import_rejects_empty_body(client, group):
+    assert client.post('/api/keys/bulk', json={'group_id': group.id, 'keys': []}).status_code == 400
+
+def test_delete_group_removes_key_data(app, client, group, make_key):
+    from models import (
+        db, ApiGroup, ApiKey, AlertRule, AlertState, LatestUsage, UsageForecast, UsageRecord, UsageRollupHourly
+    )
+    
+    other_group = ApiGroup(name='other', query_interval=3600, is_active=True)
+    db.session.add(other_group)
+    db.session.commit()
+    key = make_key('k1')
+    kept = make_key('k2', group_id=other_group.id)
+    
+    now = datetime.utcnow()
+    for api_key in (key, kept):
+        record = UsageRecord(api_key_id=api_key.id, check_time=now, character_count=10, character_limit=100)
+        db.session.add(record)
+        db.session.flush()
+        db.session.add_all([
+            LatestUsage(api_key_id=api_key.id, record_id=record.id, check_time=now, character_count=10, character_limit=100),
+            UsageForecast(api_key_id=api_key.id, computed_at=now),
+            UsageRollupHourly(api_key_id=api_key.id, bucket_start=now.replace(minute=0, second=0, microsecond=0),
+                              first_time=now, last_time=now, max_usage=10, min_usage=10, first_usage=10,
+                              last_usage=10, records=1)
+        ])
+    key_rule = AlertRule(name='key', rule_type='percent', threshold=90, api_key_id=key.id)
+    global_rule = AlertRule(name='all', rule_type='percent', threshold=90)
+    db.session.add_all([key_rule, global_rule])
+    db.session.flush()
+    db.session.add_all([
+        AlertState(rule_id=key_rule.id, api_key_id=key.id, status='firing'),
+        AlertState(rule_id=global_rule.id, api_key_id=key.id, status='firing'),
+        AlertState(rule_id=global_rule.id, api_key_id=kept.id, status='firing')
+    ])
+    db.session.commit()
+    key_id, kept_id, group_id = key.id, kept.id, group.id
+    
+    assert client.delete(f'/api/groups/{group_id}').status_code == 200
+    
+    db.session.expire_all()
+    assert db.session.get(ApiGroup, group_id) is None
+    assert [api_key.id for api_key in ApiKey.query.all()] == [kept_id]
+    for model in (UsageRecord, LatestUsage, UsageForecast, UsageRollupHourly, AlertState):
+        assert {row.api_key_id for row in model.query.all()} == {kept_id}, model.__name__
+    assert [rule.name for rule in AlertRule.query.all()] == ['all']
+
+def test_legacy_period_day_is_newest_first(client, make_key):
+    from models import db, UsageRecord
+    
+    key = make_key('k1')
+    now = datetime.utcnow()
+    db.session.add_all([
+        UsageRecord(api_key_id=key.id, check_time=now - timedelta(days=days), character_count=100 - days, character_limit=1000)
+        for days in range(3)
+    ])
+    db.session.commit()
+    
+    legacy = [row['date'] for row in client.get(f'/api/usage/{key.id}?period=day&hours=96').get_json()]
+    buckets = [row['date'] for row in client.get(f'/api/usage/{key.id}?bucket=day&hours=96').get_json()]
+    
+    assert len(legacy) == 3
+    assert legacy == sorted(legacy, reverse=True)
+    assert buckets == sorted(buckets)
@@ -0,0 +1,24 @@
+"""运行时初始化：以 app:app 运行且长时间没有请求时输出警告"""
+import logging
+import time
+
+def test_idle_runtime_warns(app, caplog, monkeypatch):
+    monitor = app.extensions['monitor']
+    monkeypatch.setitem(app.config, 'EMBEDDED_SCHEDULER_ENABLED', True)
+    
+    with caplog.at_level(logging.WARNING, logger='services.app_services'):
+        monitor.warn_if_runtime_idle(0.05)
+        time.sleep(0.3)
+    
+    assert '运行时未初始化' in caplog.text
+
+def test_started_runtime_does_not_warn(app, caplog, monkeypatch):
+    monitor = app.extensions['monitor']
+    monkeypatch.setitem(app.config, 'EMBEDDED_SCHEDULER_ENABLED', True)
+    monkeypatch.setattr(monitor, 'runtime_started', True)
+    
+    with caplog.at_level(logging.WARNING, logger='services.app_services'):
+        monitor.warn_if_runtime_idle(0.05)
+        time.sleep(0.3)
+    
+    assert '运行时未初始化' not in caplog.text
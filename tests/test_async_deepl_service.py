@@ -0,0 +1,79 @@
+"""异步DeepL服务：批量查询的最终结果、重试和进程内的并发上限"""
+import asyncio
+import threading
+
+import pytest
+
+from services.async_deepl_service import AsyncDeepLService
+
+pytestmark = pytest.mark.skipif(not AsyncDeepLService.is_available(), reason='未安装aiohttp')
+
+class FakeDeepL:
+    """按密钥依次返回的响应：状态码或 (状态码, Retry-After秒数)，用完后返回 200"""
+    
+    def __init__(self, service, responses=None, delay=0):
+        self.service = service
+        self.responses = {key: list(items) for key, items in (responses or {}).items()}
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+    
+    async def __call__(self, session, base_url, url, headers, is_free, api_key):
+        with self._lock:
+            self.calls.append(api_key)
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+            queued = self.responses.get(api_key)
+            response = queued.pop(0) if queued else 200
+            status, retry_after = response if isinstance(response, tuple) else (response, None)
+            if status == 200:
+                return self.service._parse_usage({'character_count': 10, 'character_limit': 100}, is_free), None
+            return self.service._http_error_result(status, ''), retry_after
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+@pytest.fixture
+def service():
+    service = AsyncDeepLService(max_concurrency=3)
+    yield service
+    service.close()
+
+def test_get_usage_many_returns_final_results(service):
+    fake = FakeDeepL(service, {'a:fx': [(429, 0), (503, 0)], 'b:fx': [403]})
+    service._request_usage_async = fake
+    
+    results = asyncio.run(service.get_usage_many(['a:fx', 'b:fx', 'c:fx']))
+    
+    assert [result['is_success'] for result in results] == [True, False, True]
+    assert results[1]['error_kind'] == 'auth'
+    assert fake.calls.count('a:fx') == 3  # 429 和 503 各重试一次
+    assert fake.calls.count('b:fx') == 1  # 认证失败不重试
+
+def test_try_get_usage_many_returns_retry_delay(service):
+    service._request_usage_async = FakeDeepL(service, {'a:fx': [(429, 7)]})
+    
+    (usage_info, delay), = service.poll_attempts(['a:fx'])
+    
+    assert not usage_info['is_success']
+    assert delay == 7
+
+def test_concurrency_limit_is_shared_across_callers(service):
+    fake = FakeDeepL(service, delay=0.05)
+    service._request_usage_async = fake
+    
+    threads = [
+        threading.Thread(target=service.poll_many, args=([f'k{index}-{n}:fx' for n in range(3)],))
+        for index in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(fake.calls) == 18
+    assert fake.peak == 3
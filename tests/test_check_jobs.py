@@ -0,0 +1,139 @@
+"""立即检查任务：同一目标只有一个未结束的任务，中断的任务被放弃后重新创建"""
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from config import Config
+from services.check_jobs import CheckJobManager
+from support import wait_until
+
+class FakeScheduler:
+    """记录检查调用，release 之前一直阻塞（模拟正在执行的任务）"""
+    
+    def __init__(self, error=None):
+        self.calls = []
+        self.error = error
+        self.release = threading.Event()
+    
+    def check_group_usage(self, group_id, wait=False, progress=None):
+        self.calls.append(('group', group_id))
+        progress.add_total(2)
+        self.release.wait(5)
+        if self.error:
+            raise self.error
+        progress.advance(2)
+    
+    def check_keys_now(self, key_ids, wait=False, progress=None):
+        self.calls.append(('keys', list(key_ids)))
+    
+    def check_all_groups_now(self, wait=False, progress=None):
+        self.calls.append(('all', None))
+
+@pytest.fixture
+def managers(app):
+    """模拟两个进程的任务管理器，共用同一个数据库"""
+    from models import db
+    
+    scheduler = FakeScheduler()
+    created = [CheckJobManager(db, app, scheduler), CheckJobManager(db, app, scheduler)]
+    yield scheduler, created
+    scheduler.release.set()
+    for manager in created:
+        manager.shutdown()
+
+def job_status(manager, job_id):
+    from models import db
+    
+    db.session.expire_all()
+    return manager.get(job_id)
+
+def test_duplicate_submits_are_coalesced_across_processes(managers):
+    scheduler, (first, second) = managers
+    
+    job, coalesced = first.submit('group:1')
+    assert not coalesced
+    duplicate, coalesced = second.submit('group:1')
+    assert coalesced
+    assert duplicate['job_id'] == job['job_id']
+    assert duplicate['coalesced'] == 1
+    
+    # 其他目标不受影响
+    other, coalesced = second.submit('all')
+    assert not coalesced and other['job_id'] != job['job_id']
+    
+    scheduler.release.set()
+    assert wait_until(lambda: job_status(first, job['job_id'])['status'] == 'succeeded')
+    assert job_status(first, job['job_id'])['completed'] == 2
+    assert scheduler.calls.count(('group', 1)) == 1
+    
+    # 任务结束后同一目标可以再次创建
+    again, coalesced = second.submit('group:1')
+    assert not coalesced and again['job_id'] != job['job_id']
+
+def test_unique_index_allows_one_active_job_per_target(app):
+    from models import db, CheckJob
+    
+    db.session.add(CheckJob(id='a' * 32, target='group:1', active_target='group:1', status='queued'))
+    db.session.commit()
+    db.session.add(CheckJob(id='b' * 32, target='group:1', active_target='group:1', status='queued'))
+    with pytest.raises(IntegrityError):
+        db.session.commit()
+    db.session.rollback()
+    
+    # 已结束的任务释放 active_target，不占用唯一索引
+    db.session.add(CheckJob(id='c' * 32, target='group:1', active_target=None, status='succeeded'))
+    db.session.commit()
+
+def test_stale_job_is_abandoned_and_recreated(managers):
+    from models import db, CheckJob
+    
+    scheduler, (first, second) = managers
+    job, _ = first.submit('group:1')
+    # 等执行线程写完进度、阻塞在查询中，之后只有心跳会更新任务
+    assert wait_until(lambda: job_status(first, job['job_id'])['total'] == 2)
+    
+    # 执行任务的进程停止了心跳
+    stale = datetime.utcnow() - timedelta(seconds=Config.CHECK_JOB_STALE_SECONDS + 1)
+    db.session.execute(update(CheckJob).where(CheckJob.id == job['job_id']).values(updated_at=stale))
+    db.session.commit()
+    
+    replacement, coalesced = second.submit('group:1')
+    assert not coalesced
+    assert replacement['job_id'] != job['job_id']
+    
+    abandoned = job_status(second, job['job_id'])
+    assert abandoned['status'] == 'failed'
+    assert abandoned['error'] == '执行任务的进程已中断'
+    
+    # 原来的执行线程结束后不会覆盖已放弃的任务
+    scheduler.release.set()
+    assert wait_until(lambda: job_status(second, replacement['job_id'])['status'] == 'succeeded')
+    assert job_status(first, job['job_id'])['status'] == 'failed'
+
+def test_failed_check_marks_job_failed(app):
+    from models import db
+    
+    scheduler = FakeScheduler(error=RuntimeError('1 个组检查失败'))
+    scheduler.release.set()
+    manager = CheckJobManager(db, app, scheduler)
+    try:
+        job, _ = manager.submit('group:7')
+        assert wait_until(lambda: job_status(manager, job['job_id'])['status'] == 'failed')
+        assert job_status(manager, job['job_id'])['error'] == '1 个组检查失败'
+    finally:
+        manager.shutdown()
+
+def test_import_job_checks_the_given_keys(app):
+    from models import db
+    
+    scheduler = FakeScheduler()
+    manager = CheckJobManager(db, app, scheduler)
+    try:
+        job, _ = manager.submit('import:batch', [3, 4])
+        assert wait_until(lambda: job_status(manager, job['job_id'])['status'] == 'succeeded')
+        assert scheduler.calls == [('keys', [3, 4])]
+    finally:
+        manager.shutdown()
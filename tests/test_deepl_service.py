@@ -0,0 +1,87 @@
+"""DeepL查询：Retry-After 重试和已隔离密钥的探测"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import Config
+from services.deepl_service import DeepLService
+from services.resilience import parse_retry_after
+from support import DeepLStub
+
+@pytest.fixture
+def deepl(monkeypatch):
+    server = DeepLStub()
+    monkeypatch.setattr(Config, 'DEEPL_FREE_BASE_URL', server.url)
+    monkeypatch.setattr(Config, 'DEEPL_PRO_BASE_URL', server.url)
+    yield server
+    server.close()
+
+@pytest.fixture
+def service(deepl):
+    service = DeepLService()
+    yield service
+    service.close()
+
+def test_retry_after_seconds_and_http_date():
+    now = datetime(2026, 1, 1, 12)
+    assert parse_retry_after('7') == 7.0
+    assert parse_retry_after('Thu, 01 Jan 2026 12:00:30 GMT', now=now) == 30.0
+    assert parse_retry_after('Thu, 01 Jan 2026 11:00:00 GMT', now=now) == 0.0
+    assert parse_retry_after('soon') is None
+    assert parse_retry_after(None) is None
+
+def test_rate_limited_request_waits_for_retry_after(deepl, service):
+    deepl.responses = [(429, {'Retry-After': '0'})]
+    
+    usage_info = service.get_usage('k1-key:fx')
+    
+    assert usage_info['is_success']
+    assert usage_info['character_count'] == 100
+    assert deepl.requests == 2
+
+def test_try_get_usage_returns_retry_after_delay(deepl, service):
+    deepl.responses = [(429, {'Retry-After': '12'})]
+    
+    usage_info, delay = service.try_get_usage('k1-key:fx')
+    
+    assert usage_info['error_kind'] == 'rate_limited'
+    assert delay == 12.0
+
+def test_retry_after_beyond_max_delay_is_not_retried(deepl, service):
+    deepl.responses = [(429, {'Retry-After': str(Config.DEEPL_RETRY_MAX_DELAY + 1)})]
+    
+    usage_info = service.get_usage('k1-key:fx')
+    
+    assert not usage_info['is_success']
+    assert usage_info['error_kind'] == 'rate_limited'
+    assert deepl.requests == 1
+
+def test_auth_errors_are_not_retried(deepl, service):
+    deepl.responses = [403]
+    
+    usage_info = service.get_usage('k1-key:fx')
+    
+    assert usage_info['error_kind'] == 'auth'
+    assert deepl.requests == 1
+
+def test_quarantined_keys_are_only_polled_when_probe_is_due(app, make_key, deepl):
+    from models import db
+    
+    app.config['ASYNC_POLLING_ENABLED'] = False
+    scheduler_service = app.extensions['monitor'].scheduler_service
+    
+    active = make_key('active')
+    waiting = make_key('waiting', status='quarantined', next_probe_at=datetime.utcnow() + timedelta(hours=1))
+    due = make_key('due', status='quarantined', next_probe_at=datetime.utcnow() - timedelta(minutes=1))
+    
+    try:
+        scheduler_service.check_group_usage(active.group_id, wait=True)
+    finally:
+        scheduler_service.ingest_writer.stop(timeout=5)
+    
+    assert deepl.requests == 2
+    for key in (active, waiting, due):
+        db.session.refresh(key)
+    assert active.last_check is not None
+    assert waiting.last_check is None and waiting.status == 'quarantined'
+    assert due.last_check is not None and due.status == 'active'  # 探测成功后解除隔离
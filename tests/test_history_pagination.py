@@ -0,0 +1,87 @@
+"""用量记录的键集分页：相同时间的记录跨页不重复不遗漏，原始记录读完后继续读取小时汇总"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import Config
+from services.history_service import HistoryService
+from services.rollup_service import RollupService
+
+@pytest.fixture
+def history(app):
+    from models import db
+    return HistoryService(db)
+
+@pytest.fixture
+def key(make_key):
+    return make_key('k1')
+
+def add_records(key, check_times):
+    from models import db, UsageRecord
+    
+    records = [
+        UsageRecord(api_key_id=key.id, check_time=check_time, character_count=index, character_limit=1000)
+        for index, check_time in enumerate(check_times)
+    ]
+    db.session.add_all(records)
+    db.session.commit()
+    return [record.id for record in records]
+
+def read_all(history, key, start_time, limit):
+    pages = []
+    cursor = None
+    while True:
+        page = history.get_records_page(key.id, start_time, limit, cursor)
+        pages.append(page['items'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            return pages
+
+def test_pages_split_records_with_equal_check_time(history, key):
+    now = datetime.utcnow().replace(microsecond=0)
+    same = now - timedelta(minutes=5)
+    ids = add_records(key, [now - timedelta(minutes=1), same, same, same, now - timedelta(minutes=9)])
+    
+    pages = read_all(history, key, now - timedelta(days=1), limit=2)
+    
+    assert [len(items) for items in pages] == [2, 2, 1]
+    seen = [item['id'] for items in pages for item in items]
+    assert sorted(seen) == sorted(ids)
+    # 按 (check_time, id) 倒序
+    assert seen == [ids[0], ids[3], ids[2], ids[1], ids[4]]
+
+def test_exact_page_size_has_no_next_cursor(history, key):
+    now = datetime.utcnow()
+    add_records(key, [now - timedelta(minutes=index) for index in range(3)])
+    
+    page = history.get_records_page(key.id, now - timedelta(days=1), 3)
+    assert len(page['items']) == 3
+    assert page['next_cursor'] is None
+
+def test_records_before_start_time_are_excluded(history, key):
+    now = datetime.utcnow()
+    add_records(key, [now - timedelta(hours=1), now - timedelta(days=2)])
+    
+    pages = read_all(history, key, now - timedelta(days=1), limit=1)
+    assert sum(len(items) for items in pages) == 1
+
+def test_pages_continue_into_hourly_rollups(history, key, monkeypatch):
+    from models import db, UsageRecord
+    
+    monkeypatch.setattr(Config, 'RAW_RETENTION_DAYS', 30)
+    now = datetime.utcnow()
+    old_hours = [now - timedelta(days=40, hours=hours) for hours in range(3)]
+    recent = [now - timedelta(minutes=1), now - timedelta(minutes=2), now - timedelta(days=1)]
+    add_records(key, old_hours + recent)
+    
+    # 汇总后清理超过保留天数的原始记录
+    RollupService(db, history).compact(now)
+    assert UsageRecord.query.count() == 3
+    
+    pages = read_all(history, key, now - timedelta(days=60), limit=2)
+    items = [item for items in pages for item in items]
+    
+    assert [item.get('is_rollup', False) for item in items] == [False, False, False, True, True, True]
+    times = [item['check_time'] for item in items]
+    assert times == sorted(times, reverse=True)
+    assert len(set(times)) == len(times)
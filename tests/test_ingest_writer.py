@@ -0,0 +1,126 @@
+"""用量写入：批量写入与等待、仅变化存储模式和密钥隔离"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import Config
+from services.ingest_writer import IngestWriter
+from support import usage
+
+def auth_failure(check_time=None):
+    return {
+        'is_success': False, 'error_message': 'API请求失败: HTTP 403', 'error_kind': 'auth',
+        'character_count': 0, 'character_limit': 0, 'check_time': check_time or datetime.utcnow()
+    }
+
+@pytest.fixture
+def writer(app):
+    from models import db
+    
+    writer = IngestWriter(db, app, flush_size=2, flush_interval=0.05)
+    yield writer
+    writer.stop(timeout=5)
+
+def test_results_are_written_in_batches(app, make_key, writer):
+    from models import db, UsageRecord
+    
+    keys = [make_key(f'k{index}') for index in range(5)]
+    batches = []
+    writer.add_listener(batches.append)
+    
+    written = writer.submit_many([(key.id, usage(index * 10)) for index, key in enumerate(keys)])
+    assert written.wait(5)
+    assert written.failed == 0
+    
+    stats = writer.get_stats()
+    assert stats['written'] == 5
+    assert stats['batches'] == 3  # 每批最多 flush_size 条
+    assert sorted(len(batch) for batch in batches) == [1, 2, 2]
+    assert db.session.query(UsageRecord).count() == 5
+
+def test_empty_submit_is_already_done(writer):
+    assert writer.submit_many([]).is_set()
+
+def test_failed_writes_are_reported_on_the_ticket(app, make_key, writer, monkeypatch):
+    key = make_key('k1')
+    batches = []
+    writer.add_listener(batches.append)
+    monkeypatch.setattr(Config, 'INGEST_MAX_RETRIES', 1)
+    
+    def fail(results):
+        raise RuntimeError('database is locked')
+    
+    monkeypatch.setattr(writer, 'write_batch', fail)
+    written = writer.submit_many([(key.id, usage(10)), (key.id, usage(20))])
+    
+    assert written.wait(5)
+    assert written.failed == 2
+    assert batches == []  # 写入失败时不通知
+    assert writer.get_stats()['failed'] == 2
+
+def test_change_only_extends_last_seen(app, make_key, writer, monkeypatch):
+    from models import db, LatestUsage, UsageRecord
+    
+    monkeypatch.setattr(Config, 'USAGE_STORAGE_MODE', 'change_only')
+    key = make_key('k1')
+    start = datetime(2026, 1, 1, 12)
+    
+    for minutes in (0, 10, 20):
+        writer.write_batch([(key.id, usage(100, check_time=start + timedelta(minutes=minutes)))])
+    writer.write_batch([(key.id, usage(150, check_time=start + timedelta(minutes=30)))])
+    
+    records = db.session.query(UsageRecord).order_by(UsageRecord.check_time).all()
+    assert [record.character_count for record in records] == [100, 150]
+    assert records[0].check_time == start
+    assert records[0].last_seen == start + timedelta(minutes=20)
+    assert records[1].last_seen is None
+    
+    latest = db.session.get(LatestUsage, key.id)
+    assert latest.record_id == records[1].id
+    assert latest.check_time == start + timedelta(minutes=30)
+
+def test_full_mode_writes_every_poll(app, make_key, writer, monkeypatch):
+    from models import db, UsageRecord
+    
+    monkeypatch.setattr(Config, 'USAGE_STORAGE_MODE', 'full')
+    key = make_key('k1')
+    for _ in range(3):
+        writer.write_batch([(key.id, usage(100))])
+    
+    assert db.session.query(UsageRecord).count() == 3
+
+def test_repeated_auth_failures_quarantine_the_key(app, make_key, writer, monkeypatch):
+    from models import db
+    
+    monkeypatch.setattr(Config, 'KEY_QUARANTINE_THRESHOLD', 2)
+    key = make_key('k1')
+    now = datetime.utcnow()
+    
+    writer.write_batch([(key.id, auth_failure(now))])
+    db.session.refresh(key)
+    assert key.status == 'active' and key.auth_failures == 1
+    
+    writer.write_batch([(key.id, auth_failure(now))])
+    db.session.refresh(key)
+    assert key.status == 'quarantined'
+    assert key.quarantined_at == now
+    assert key.next_probe_at == now + timedelta(seconds=Config.KEY_PROBE_INTERVAL)
+    
+    # 探测成功后解除隔离
+    writer.write_batch([(key.id, usage(10))])
+    db.session.refresh(key)
+    assert key.status == 'active'
+    assert key.auth_failures == 0
+    assert key.next_probe_at is None
+
+def test_other_failures_do_not_count_towards_quarantine(app, make_key, writer, monkeypatch):
+    from models import db
+    
+    monkeypatch.setattr(Config, 'KEY_QUARANTINE_THRESHOLD', 1)
+    key = make_key('k1')
+    failure = dict(auth_failure(), error_kind='unavailable', error_message='HTTP 503')
+    writer.write_batch([(key.id, failure)])
+    
+    db.session.refresh(key)
+    assert key.status == 'active'
+    assert not key.auth_failures
@@ -0,0 +1,62 @@
+"""调度器租约：同一时刻只有一个持有者，过期或释放后由其他进程接管"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from services.leader_lease import LeaderLease
+
+def expire(name='scheduler'):
+    from models import db, SchedulerLease
+    
+    db.session.execute(
+        update(SchedulerLease).where(SchedulerLease.name == name)
+        .values(expires_at=datetime.utcnow() - timedelta(seconds=1))
+    )
+    db.session.commit()
+
+def test_only_one_holder(app):
+    from models import db
+    
+    first = LeaderLease(db, holder='a')
+    second = LeaderLease(db, holder='b')
+    
+    assert first.try_acquire()
+    assert not second.try_acquire()
+    # 续约保持持有
+    assert first.try_acquire()
+    assert first.get_status()['lease']['holder'] == 'a'
+
+def test_expired_lease_is_taken_over(app):
+    from models import db
+    
+    first = LeaderLease(db, holder='a')
+    second = LeaderLease(db, holder='b')
+    assert first.try_acquire()
+    acquired_at = first.get_status()['lease']['acquired_at']
+    
+    # 持有者停止续约，租约过期
+    expire()
+    assert second.try_acquire()
+    assert second.get_status()['lease']['acquired_at'] != acquired_at
+    
+    # 原持有者续约失败并放弃本地持有状态
+    first._expires_at = datetime.utcnow() - timedelta(seconds=1)
+    assert not first.try_acquire()
+    assert not first.is_leader
+
+def test_released_lease_is_available_immediately(app):
+    from models import db
+    
+    first = LeaderLease(db, holder='a')
+    second = LeaderLease(db, holder='b')
+    assert first.try_acquire()
+    
+    first.release()
+    assert not first.is_leader
+    assert second.try_acquire()
+
+def test_leases_are_independent_by_name(app):
+    from models import db
+    
+    assert LeaderLease(db, name='scheduler', holder='a').try_acquire()
+    assert LeaderLease(db, name='other', holder='b').try_acquire()
@@ -0,0 +1,44 @@
+"""独立查询进程：写入用量后在本进程中刷新预测、评估告警"""
+import pytest
+
+from poller import create_poller_service
+from support import usage, wait_until
+
+@pytest.fixture
+def poller_service(app):
+    scheduler_service, alert_service = create_poller_service(app, 'test-0')
+    yield scheduler_service
+    scheduler_service.ingest_writer.stop()
+    alert_service.shutdown()
+
+def test_poller_ingest_fires_alerts(app, make_key, stub, poller_service):
+    from models import db, AlertRule, AlertState
+    
+    key = make_key('k1')
+    db.session.add(AlertRule(name='quota', rule_type='percent', threshold=80,
+                             sink='webhook', webhook_url=stub.url, is_active=True))
+    db.session.commit()
+    
+    written = poller_service.ingest_writer.submit_many([(key.id, usage(900))])
+    assert written.wait(5) and not written.failed
+    
+    assert wait_until(lambda: len(stub.requests) == 1)
+    assert stub.requests[0]['event'] == 'firing'
+    assert stub.requests[0]['key_name'] == 'k1'
+    
+    db.session.expire_all()
+    assert db.session.query(AlertState).filter_by(api_key_id=key.id).one().status == 'firing'
+
+def test_poller_ingest_refreshes_forecasts(app, make_key, poller_service):
+    from models import db, UsageForecast
+    
+    key = make_key('k1')
+    written = poller_service.ingest_writer.submit_many([(key.id, usage(300))])
+    assert written.wait(5) and not written.failed
+    
+    def refreshed():
+        db.session.expire_all()
+        forecast = db.session.get(UsageForecast, key.id)
+        return forecast is not None and forecast.character_count == 300
+    
+    assert wait_until(refreshed)
@@ -0,0 +1,78 @@
+"""查询进程分片：一致性哈希环和基于心跳的重新分片"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from services.hash_ring import HashRing
+from services.poller_registry import PollerRegistry
+
+KEYS = range(2000)
+
+def owners(ring):
+    return {key: ring.get_node(key) for key in KEYS}
+
+def test_ring_spreads_keys_across_nodes():
+    ring = HashRing(['a', 'b', 'c', 'd'], replicas=64)
+    counts = {}
+    for node in owners(ring).values():
+        counts[node] = counts.get(node, 0) + 1
+    
+    assert set(counts) == {'a', 'b', 'c', 'd'}
+    assert min(counts.values()) > len(KEYS) / 4 * 0.5
+
+def test_removing_a_node_only_moves_its_keys():
+    before = owners(HashRing(['a', 'b', 'c', 'd']))
+    after = owners(HashRing(['a', 'b', 'c']))
+    
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert moved
+    assert all(before[key] == 'd' for key in moved)
+
+def test_adding_a_node_moves_about_one_share():
+    before = owners(HashRing(['a', 'b', 'c']))
+    after = owners(HashRing(['a', 'b', 'c', 'd']))
+    
+    moved = [key for key in KEYS if before[key] != after[key]]
+    assert all(after[key] == 'd' for key in moved)
+    assert len(moved) < len(KEYS) / 4 * 1.5
+
+def test_empty_ring_has_no_owner():
+    assert HashRing([]).get_node(1) is None
+
+def test_heartbeats_rebalance_between_processes(app):
+    from models import db, PollerNode
+    
+    first = PollerRegistry(db, 'p-0')
+    second = PollerRegistry(db, 'p-1')
+    
+    first.heartbeat()
+    assert second.heartbeat()  # 看到了 p-0
+    assert first.heartbeat()   # 看到了 p-1
+    
+    owned = [key for key in KEYS if first.owns(key)]
+    assert 0 < len(owned) < len(KEYS)
+    assert all(first.owns(key) != second.owns(key) for key in KEYS)
+    
+    # p-1 退出后 p-0 在下一次心跳时接管全部密钥
+    second.leave()
+    assert first.heartbeat()
+    assert all(first.owns(key) for key in KEYS)
+
+def test_nodes_without_recent_heartbeat_are_dropped(app):
+    from config import Config
+    from models import db, PollerNode
+    
+    first = PollerRegistry(db, 'p-0')
+    second = PollerRegistry(db, 'p-1')
+    second.heartbeat()
+    first.heartbeat()
+    assert sorted(first.get_live_nodes()) == ['p-0', 'p-1']
+    
+    # p-1 停止心跳超过 POLLER_NODE_TTL
+    stale = datetime.utcnow() - timedelta(seconds=Config.POLLER_NODE_TTL + 1)
+    db.session.execute(update(PollerNode).where(PollerNode.node_id == 'p-1').values(heartbeat_at=stale))
+    db.session.commit()
+    
+    assert first.heartbeat()
+    assert first.get_live_nodes() == ['p-0']
+    assert all(first.owns(key) for key in KEYS)
@@ -0,0 +1,127 @@
+"""用量汇总：回溯重新汇总晚写入的记录，按保留策略清理旧数据"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from config import Config
+from services.history_service import HistoryService
+from services.rollup_service import RollupService
+
+NOW = datetime(2026, 3, 10, 12, 30)
+
+@pytest.fixture
+def rollups(app):
+    from models import db
+    return RollupService(db, HistoryService(db))
+
+@pytest.fixture
+def key(make_key):
+    return make_key('k1')
+
+def add_record(key, check_time, count):
+    from models import db, UsageRecord
+    
+    record = UsageRecord(api_key_id=key.id, check_time=check_time, character_count=count, character_limit=1000)
+    db.session.add(record)
+    db.session.commit()
+    return record
+
+def hourly(key):
+    from models import UsageRollupHourly
+    
+    return {
+        rollup.bucket_start: rollup
+        for rollup in UsageRollupHourly.query.filter_by(api_key_id=key.id)
+    }
+
+def test_only_finished_hours_are_rolled_up(rollups, key):
+    add_record(key, NOW.replace(hour=10, minute=10), 100)
+    add_record(key, NOW.replace(hour=10, minute=50), 150)
+    add_record(key, NOW.replace(minute=0), 200)  # 当前小时还没结束
+    
+    rollups.compact(NOW)
+    
+    buckets = hourly(key)
+    assert list(buckets) == [NOW.replace(hour=10, minute=0)]
+    bucket = buckets[NOW.replace(hour=10, minute=0)]
+    assert (bucket.records, bucket.first_usage, bucket.last_usage) == (2, 100, 150)
+
+def test_late_record_within_lookback_is_rolled_up_again(rollups, key):
+    add_record(key, NOW.replace(hour=9, minute=10), 100)
+    add_record(key, NOW.replace(hour=11, minute=10), 300)
+    rollups.compact(NOW)
+    
+    # 汇总之后才写入的 9 点记录（在回溯范围内）
+    add_record(key, NOW.replace(hour=9, minute=40), 150)
+    rollups.compact(NOW)
+    
+    bucket = hourly(key)[NOW.replace(hour=9, minute=0)]
+    assert (bucket.records, bucket.last_usage) == (2, 150)
+
+def test_records_older_than_lookback_are_not_rolled_up_again(rollups, key, monkeypatch):
+    monkeypatch.setattr(Config, 'USAGE_COMPACTION_LOOKBACK', 3600)
+    add_record(key, NOW.replace(hour=6, minute=10), 100)
+    add_record(key, NOW.replace(hour=11, minute=10), 300)
+    rollups.compact(NOW)
+    
+    assert rollups.get_rebuild_starts()['hourly'] == NOW.replace(hour=11, minute=0)
+    
+    add_record(key, NOW.replace(hour=6, minute=40), 150)
+    rollups.compact(NOW)
+    
+    assert hourly(key)[NOW.replace(hour=6, minute=0)].records == 1
+
+def test_daily_rollup_follows_hourly_rollup(rollups, key):
+    from models import UsageRollupDaily
+    
+    add_record(key, datetime(2026, 3, 8, 10, 0), 100)
+    add_record(key, datetime(2026, 3, 8, 20, 0), 400)
+    rollups.compact(NOW)
+    
+    daily = UsageRollupDaily.query.filter_by(api_key_id=key.id).one()
+    assert daily.bucket_start == datetime(2026, 3, 8)
+    assert (daily.records, daily.first_usage, daily.last_usage) == (2, 100, 400)
+
+def test_retention_deletes_old_rolled_up_records(rollups, key, monkeypatch):
+    from models import db, UsageRecord, LatestUsage
+    
+    monkeypatch.setattr(Config, 'RAW_RETENTION_DAYS', 30)
+    old_id = add_record(key, NOW - timedelta(days=40), 100).id
+    referenced = add_record(key, NOW - timedelta(days=40, hours=-1), 120)
+    recent = add_record(key, NOW - timedelta(days=1), 200)
+    # 最新用量表仍引用的记录不删除
+    db.session.add(LatestUsage(api_key_id=key.id, record_id=referenced.id, check_time=referenced.check_time,
+                               character_count=120, character_limit=1000))
+    db.session.commit()
+    
+    result = rollups.compact(NOW)
+    
+    assert result['raw_deleted'] == 1
+    remaining = {record.id for record in UsageRecord.query.all()}
+    assert remaining == {referenced.id, recent.id}
+    assert old_id not in remaining
+    # 被清理的时间段仍保留在汇总表中
+    assert (NOW - timedelta(days=40)).replace(minute=0) in hourly(key)
+
+def test_retention_keeps_records_inside_rebuild_window(rollups, key, monkeypatch):
+    from models import UsageRecord
+    
+    monkeypatch.setattr(Config, 'RAW_RETENTION_DAYS', 30)
+    # 回溯范围超过保留天数时，重新汇总需要的原始记录不能删除
+    monkeypatch.setattr(Config, 'USAGE_COMPACTION_LOOKBACK', 60 * 86400)
+    add_record(key, NOW - timedelta(days=40), 100)
+    add_record(key, NOW - timedelta(days=1), 200)
+    
+    result = rollups.compact(NOW)
+    
+    assert result['raw_deleted'] == 0
+    assert UsageRecord.query.count() == 2
+
+def test_retention_disabled(rollups, key, monkeypatch):
+    from models import UsageRecord
+    
+    monkeypatch.setattr(Config, 'RAW_RETENTION_DAYS', 0)
+    add_record(key, NOW - timedelta(days=400), 100)
+    
+    assert rollups.compact(NOW)['raw_deleted'] == 0
+    assert UsageRecord.query.count() == 1
@@ -0,0 +1,11 @@
+"""
+WSGI 入口
+
+创建应用并立即执行运行时初始化，启动后即开始定时查询（不等待第一个请求）。
+
+用法:
+    gunicorn -w 4 --threads 16 -b 0.0.0.0:5323 wsgi:app
+"""
+from app import create_app
+
+app = create_app(start_runtime=True)